@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive limits on the number of concurrent requests to a server.
+
+Each kind of work (ReST requests, admin requests, uploads) on each server has a
+limit on the number of requests in flight. The limit is adjusted with AIMD
+(additive increase, multiplicative decrease), like TCP congestion control:
+  * after `limit` requests in a row are healthy, the limit grows by one;
+  * when a request fails (an exception, a 5xx response, or an ArcGIS error; see
+    rest.py) or is much slower than the usual fast requests of the same kind
+    (latency > TOLERANCE * the baseline), the limit is halved (at most once for
+    each `limit` requests).
+The baseline is a low percentile (BASELINE_PERCENTILE) of the latencies of the
+last BASELINE_WINDOW requests of the same kind, so one unusually fast request
+does not make the normal ones look slow, and the baseline follows the server
+when its normal speed changes.
+A limiter keeps a baseline for each key given to slot(): i.e. the endpoint of a
+ReST request (see rest.py), or the size class of an upload (see size_class()),
+so a slow export is not compared to a fast catalog request, or a large upload
+to a small one.
+A busy server (i.e. one that is also serving peak traffic) slows down, so it
+gets fewer concurrent uploads, and an idle one gets more.
+
+The publishing tools queue their jobs, so a growing queue shows up as slower
+uploads. The final (and extreme) limits of each run are added to the run
+report (see summaries()).
+
+    key = adaptive_limit.size_class(os.path.getsize(service_definition))
+    with adaptive_limit.limiter("upload", server).slot(key) as slot:
+        response = ...
+        if rest.is_server_error(response):
+            slot.failed()
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import deque
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# A request slower than TOLERANCE times the baseline latency is a slowdown
+TOLERANCE = 2.0
+
+# The baseline latency is this percentile of the latencies of the last
+# BASELINE_WINDOW healthy requests (of the same kind)
+BASELINE_PERCENTILE = 0.1
+BASELINE_WINDOW = 20
+
+# Payloads up to this size are in the smallest size class (see size_class())
+MEGABYTE = 1024 * 1024
+
+# Default limits (see configure())
+INITIAL_LIMIT = 2
+MAX_LIMIT = 8
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_defaults = {"initial": INITIAL_LIMIT, "maximum": MAX_LIMIT}
+
+
+class AdaptiveLimit(object):
+    """An AIMD limit on the number of requests in flight."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, name, initial=INITIAL_LIMIT, minimum=1, maximum=MAX_LIMIT):
+        self.name = name
+        self.__minimum = max(1, minimum)
+        self.__maximum = max(self.__minimum, maximum)
+        self.__limit = min(self.__maximum, max(self.__minimum, initial))
+        self.__in_flight = 0
+        self.__healthy = 0  # healthy requests since the last change
+        self.__since_decrease = 0  # requests since the last decrease
+        self.__latencies = {}  # key: the seconds of the last BASELINE_WINDOW requests
+        self.__condition = threading.Condition()
+        self.__stats = {
+            "requests": 0,
+            "errors": 0,
+            "slowdowns": 0,
+            "decreases": 0,
+            "lowest_limit": self.__limit,
+            "highest_limit": self.__limit,
+        }
+
+    @property
+    def limit(self):
+        """Return the current limit."""
+        with self.__condition:
+            return self.__limit
+
+    def slot(self, key=""):
+        """Return a context manager that holds a slot while a request is made. key
+        is the kind of request (the latency is compared to the baseline for key)."""
+        return _Slot(self, key)
+
+    def acquire(self):
+        """Wait for (and take) a slot."""
+        with self.__condition:
+            while self.__in_flight >= self.__limit:
+                self.__condition.wait()
+            self.__in_flight += 1
+
+    def release(self, seconds, ok=True, key=""):
+        """Return a slot after a request (of the kind key) that took seconds, and
+        adjust the limit."""
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__stats["requests"] += 1
+            self.__since_decrease += 1
+            slow = False
+            if ok:
+                latencies = self.__latencies.get(key)
+                if latencies is None:
+                    latencies = deque(maxlen=BASELINE_WINDOW)
+                    self.__latencies[key] = latencies
+                baseline = _baseline(latencies)
+                slow = baseline is not None and seconds > baseline * TOLERANCE
+                latencies.append(seconds)
+            else:
+                self.__stats["errors"] += 1
+            if slow:
+                self.__stats["slowdowns"] += 1
+            if not ok or slow:
+                self.__decrease()
+            else:
+                self.__healthy += 1
+                if self.__healthy >= self.__limit:
+                    self.__increase()
+            self.__condition.notify_all()
+
+    def summary(self):
+        """Return a dictionary of the current limit and the statistics."""
+        with self.__condition:
+            result = dict(self.__stats)
+            result["name"] = self.name
+            result["limit"] = self.__limit
+            if self.__latencies:
+                result["baseline_seconds"] = dict(
+                    (key or "default", round(_baseline(latencies), 3))
+                    for key, latencies in self.__latencies.items()
+                )
+            return result
+
+    def __increase(self):
+        self.__healthy = 0
+        if self.__limit < self.__maximum:
+            self.__limit += 1
+            self.__stats["highest_limit"] = max(
+                self.__stats["highest_limit"], self.__limit
+            )
+            logger.debug("Increased the %s limit to %s", self.name, self.__limit)
+
+    def __decrease(self):
+        self.__healthy = 0
+        # Requests in flight at the last decrease were sent before it had an effect.
+        if self.__since_decrease < self.__limit:
+            return
+        self.__since_decrease = 0
+        new_limit = max(self.__minimum, self.__limit // 2)
+        if new_limit < self.__limit:
+            self.__limit = new_limit
+            self.__stats["decreases"] += 1
+            self.__stats["lowest_limit"] = min(
+                self.__stats["lowest_limit"], self.__limit
+            )
+            logger.info("Reduced the %s limit to %s", self.name, self.__limit)
+
+
+class _Slot(object):
+    """Holds a slot of an AdaptiveLimit in a with block."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, limiter, key):
+        self.__limiter = limiter
+        self.__key = key
+        self.__start = None
+        self.__failed = False
+
+    def __enter__(self):
+        self.__limiter.acquire()
+        self.__start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ok = exc_type is None and not self.__failed
+        self.__limiter.release(time.time() - self.__start, ok, self.__key)
+        return False
+
+    def failed(self):
+        """Count the request as failed (i.e. a 5xx response)."""
+        self.__failed = True
+
+
+class _NoSlot(object):
+    """A stand-in for a slot, for requests that are not limited."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def failed(self):
+        """Do nothing."""
+
+
+UNLIMITED = _NoSlot()
+
+
+def _baseline(latencies):
+    """Return the BASELINE_PERCENTILE of latencies, or None if there are none."""
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return ordered[int(len(ordered) * BASELINE_PERCENTILE)]
+
+
+def configure(initial=INITIAL_LIMIT, maximum=MAX_LIMIT):
+    """Set the initial and maximum limits of the limiters created after this."""
+    _defaults["initial"] = initial
+    _defaults["maximum"] = maximum
+
+
+def limiter(kind, server):
+    """Return the (shared) limiter for a kind of work (i.e. 'upload') on server."""
+    key = "{0} {1}".format(kind, server)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimit(
+                key, initial=_defaults["initial"], maximum=_defaults["maximum"]
+            )
+        return _limiters[key]
+
+
+def size_class(size):
+    """Return the baseline key for a request with a payload of size bytes (i.e. an
+    upload): the next power of two of the size in megabytes, like '4MB'."""
+    megabytes = 1
+    while megabytes * MEGABYTE < (size or 0):
+        megabytes *= 2
+    return "{0}MB".format(megabytes)
+
+
+def summaries():
+    """Return a list of the summary of each limiter used in this run."""
+    with _limiters_lock:
+        limiters = [_limiters[key] for key in sorted(_limiters)]
+    return [item.summary() for item in limiters]
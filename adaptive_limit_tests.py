@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the adaptive concurrency limits.
+
+Run with: python -m pytest adaptive_limit_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+
+import adaptive_limit
+from adaptive_limit import AdaptiveLimit
+import rest
+
+
+def run(limiter, count, seconds=0.1, ok=True, key=""):
+    """Acquire and release limiter count times (one at a time)."""
+    for _ in range(count):
+        limiter.acquire()
+        limiter.release(seconds, ok, key)
+
+
+def test_grows_while_healthy():
+    """The limit grows by one after limit healthy requests, up to the maximum."""
+    limiter = AdaptiveLimit("test", initial=2, maximum=4)
+    run(limiter, 2)
+    assert limiter.limit == 3
+    run(limiter, 3)
+    assert limiter.limit == 4
+    run(limiter, 20)
+    assert limiter.limit == 4
+    assert limiter.summary()["highest_limit"] == 4
+
+
+def test_backs_off_on_errors_and_slowdowns():
+    """The limit is halved on an error or a slow request, once per limit requests."""
+    limiter = AdaptiveLimit("test", initial=8, maximum=8)
+    run(limiter, 8)
+    run(limiter, 1, ok=False)
+    assert limiter.limit == 4
+    run(limiter, 1, ok=False)  # too soon after the last decrease
+    assert limiter.limit == 4
+    run(limiter, 4)
+    run(limiter, 1, seconds=1.0)  # 10 times the baseline
+    assert limiter.limit == 2
+    summary = limiter.summary()
+    assert summary["errors"] == 2
+    assert summary["slowdowns"] == 1
+    assert summary["lowest_limit"] == 2
+
+
+def test_baseline_for_each_kind_of_request():
+    """A slow request is only a slowdown compared with requests of the same kind."""
+    limiter = AdaptiveLimit("test", initial=4, maximum=8)
+    run(limiter, 4, seconds=0.1, key="catalog")
+    run(limiter, 1, seconds=5.0, key="MapServer/export")
+    run(limiter, 1, seconds=60.0, key=adaptive_limit.size_class(500 * 1024 * 1024))
+    assert limiter.summary()["slowdowns"] == 0
+    run(limiter, 1, seconds=12.0, key="MapServer/export")
+    assert limiter.summary()["slowdowns"] == 1
+    assert sorted(limiter.summary()["baseline_seconds"]) == [
+        "512MB",
+        "MapServer/export",
+        "catalog",
+    ]
+    assert adaptive_limit.size_class(0) == "1MB"
+    assert adaptive_limit.size_class(3 * 1024 * 1024) == "4MB"
+
+    print("test the endpoints of ReST requests")
+    endpoints = [
+        ("https://gis/arcgis/rest/services?f=json", "catalog"),
+        ("https://gis/arcgis/rest/services/Roads?f=json", "catalog"),
+        ("https://gis/arcgis/rest/services/Roads/Main/MapServer", "MapServer"),
+        ("https://gis/arcgis/rest/services/Main/MapServer/export", "MapServer/export"),
+        (
+            "https://gis/arcgis/rest/services/Main/MapServer/tile/3/2/1",
+            "MapServer/tile",
+        ),
+        ("https://gis/arcgis/admin/services/Main.MapServer/delete", "MapServer/delete"),
+        ("https://gis/arcgis/admin/generateToken", "generateToken"),
+    ]
+    for url, endpoint in endpoints:
+        assert rest._endpoint(url) == endpoint, url  # pylint: disable=protected-access
+
+
+def test_baseline_is_a_low_percentile():
+    """One unusually fast request does not make the normal requests slowdowns, and
+    the baseline follows the server when its normal speed changes."""
+    limiter = AdaptiveLimit("test", initial=1, maximum=1)
+    run(limiter, adaptive_limit.BASELINE_WINDOW - 1, seconds=1.0)
+    run(limiter, 1, seconds=0.1)
+    run(limiter, 5, seconds=1.0)
+    assert limiter.summary()["slowdowns"] == 0
+    assert limiter.summary()["baseline_seconds"] == {"default": 1.0}
+    run(limiter, 1, seconds=2.5)
+    assert limiter.summary()["slowdowns"] == 1
+
+    print("test the baseline moves to a slower normal")
+    run(limiter, 2 * adaptive_limit.BASELINE_WINDOW, seconds=3.0)
+    assert limiter.summary()["baseline_seconds"] == {"default": 3.0}
+
+
+def test_limits_concurrency():
+    """No more than limit requests are in flight at once."""
+    limiter = AdaptiveLimit("test", initial=2, maximum=2)
+    lock = threading.Lock()
+    state = {"in_flight": 0, "most": 0}
+
+    def work():
+        with limiter.slot():
+            with lock:
+                state["in_flight"] += 1
+                state["most"] = max(state["most"], state["in_flight"])
+            threading.Event().wait(0.02)
+            with lock:
+                state["in_flight"] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["most"] <= 2
+    assert limiter.summary()["requests"] == 8
+
+
+if __name__ == "__main__":
+    test_grows_while_healthy()
+    test_backs_off_on_errors_and_slowdowns()
+    test_baseline_for_each_kind_of_request()
+    test_baseline_is_a_low_percentile()
+    test_limits_concurrency()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+A reader for ArcGIS Server connection (*.ags) files.
+
+An *.ags file is an OLE compound document (a small FAT file system in a file)
+with a single stream, AGSConnProperties, which is a serialized ESRI PropertySet:
+a connection name, a couple of GUIDs, a property count, and then a list of
+(name, VARIANT) pairs. The file is memory mapped and only the sectors of that
+stream are read.
+
+Results are cached by path, modification time and size, so the many documents
+that share a connection file share one parse.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+CFB_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+STREAM_NAME = "AGSConnProperties"
+# {588E5A11-D09B-11D1-AA7C-00C04FA33A15} esriSystem.PropertySet
+PROPERTY_SET_CLSID = b"\x11\x5a\x8e\x58\x9b\xd0\xd1\x11\xaa\x7c\x00\xc0\x4f\xa3\x3a\x15"
+
+# Special sector numbers
+END_OF_CHAIN = 0xFFFFFFFE
+FREE_SECTOR = 0xFFFFFFFF
+MAX_REGULAR_SECTOR = 0xFFFFFFFA
+
+# VARIANT types; value is the size of the fixed length types and a struct format
+VT_BSTR = 8
+VT_BOOL = 11
+FIXED_VARIANTS = {
+    0: (0, None),  # VT_EMPTY
+    1: (0, None),  # VT_NULL
+    2: (2, "<h"),  # VT_I2
+    3: (4, "<i"),  # VT_I4
+    4: (4, "<f"),  # VT_R4
+    5: (8, "<d"),  # VT_R8
+    16: (1, "<b"),  # VT_I1
+    17: (1, "<B"),  # VT_UI1
+    18: (2, "<H"),  # VT_UI2
+    19: (4, "<I"),  # VT_UI4
+    20: (8, "<q"),  # VT_I8
+    21: (8, "<Q"),  # VT_UI8
+    22: (4, "<i"),  # VT_INT
+    23: (4, "<I"),  # VT_UINT
+}
+
+_cache = {}
+
+
+class AgsFileError(Exception):
+    """Raise when an *.ags file is not in the expected format."""
+
+
+class AgsConnection(object):
+    """The properties of an ArcGIS Server connection file."""
+
+    def __init__(self, name, properties):
+        self.name = name
+        self.properties = properties
+
+    def __repr__(self):
+        return "AgsConnection({0!r})".format(self.name)
+
+    @property
+    def server_url(self):
+        """Return the base URL of the server, i.e. http://server:6080/arcgis."""
+        for key in ("URL", "RestUrl", "AdminURL", "SoapUrl"):
+            url = self.properties.get(key)
+            if url:
+                index = url.lower().find("/arcgis")
+                if index >= 0:
+                    return url[: index + len("/arcgis")]
+        return None
+
+    @property
+    def rest_url(self):
+        """Return the URL of the ReST services directory."""
+        return self.properties.get("RestUrl") or None
+
+    @property
+    def admin_url(self):
+        """Return the URL of the server's admin API."""
+        return self.properties.get("AdminURL") or None
+
+    @property
+    def folder(self):
+        """Return the staging folder for the connection (None for the default)."""
+        return self.properties.get("STAGINGFOLDER") or None
+
+    @property
+    def connection_type(self):
+        """Return 'user', 'publisher', or 'administrator' (or None if unknown).
+
+        ArcCatalog names connections like 'arcgis on server_6080 (publisher)'."""
+        if self.name and self.name.endswith(")") and "(" in self.name:
+            return self.name[self.name.rindex("(") + 1 : -1].lower()
+        return None
+
+
+def clear_cache():
+    """Forget all the previously read connection files."""
+    _cache.clear()
+
+
+def read(path):
+    """Return the AgsConnection for the *.ags file at path, or None if it is invalid.
+
+    The result is cached until the file's modification time or size changes."""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        logger.warning("Connection file %s not found", path)
+        return None
+    key = os.path.normcase(os.path.abspath(path))
+    signature = (stat.st_mtime, stat.st_size)
+    if key in _cache and _cache[key][0] == signature:
+        return _cache[key][1]
+    connection = None
+    try:
+        connection = _parse(path, stat.st_size)
+    except (AgsFileError, struct.error, UnicodeDecodeError, ValueError) as ex:
+        logger.warning("Unable to read the connection file %s: %s", path, ex)
+    _cache[key] = (signature, connection)
+    return connection
+
+
+def _parse(path, size):
+    if size < 512:
+        raise AgsFileError("File is too small to be a compound document")
+    with open(path, "rb") as in_file:
+        data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            stream = CompoundFile(data).read_stream(STREAM_NAME)
+            return _parse_property_set(stream)
+        finally:
+            data.close()
+
+
+class CompoundFile(object):
+    """A minimal (read only) reader for OLE compound documents."""
+
+    def __init__(self, data):
+        self.__data = data
+        if data[:8] != CFB_SIGNATURE:
+            raise AgsFileError("Not an OLE compound document")
+        sector_shift, mini_sector_shift = struct.unpack_from("<HH", data, 0x1E)
+        self.__sector_size = 1 << sector_shift
+        self.__mini_sector_size = 1 << mini_sector_shift
+        (
+            fat_count,
+            self.__directory_start,
+            _,
+            self.__mini_cutoff,
+            self.__mini_fat_start,
+            _,
+            difat_start,
+            difat_count,
+        ) = struct.unpack_from("<IIIIIIII", data, 0x2C)
+        difat = list(struct.unpack_from("<109I", data, 0x4C))
+        entries_per_sector = self.__sector_size // 4
+        sector = difat_start
+        for _ in range(difat_count):
+            if sector > MAX_REGULAR_SECTOR:
+                break
+            values = self.__unpack_sector(sector, entries_per_sector)
+            difat.extend(values[:-1])
+            sector = values[-1]
+        self.__fat = []
+        for sector in difat[:fat_count]:
+            self.__fat.extend(self.__unpack_sector(sector, entries_per_sector))
+        self.__mini_fat = None
+        self.__mini_stream = None
+
+    def read_stream(self, name):
+        """Return the contents (bytes) of the named stream."""
+        entries = self.__directory()
+        root = entries[0]
+        for entry_name, entry_type, start, size in entries:
+            if entry_type == 2 and entry_name == name:
+                if size < self.__mini_cutoff:
+                    return self.__read_mini(start, size, root)
+                return self.__read_chain(start, self.__fat, self.__sector_size)[:size]
+        raise AgsFileError("Stream {0} not found".format(name))
+
+    def __directory(self):
+        """Return a list of (name, type, start sector, size) for each directory entry."""
+        data = self.__read_chain(self.__directory_start, self.__fat, self.__sector_size)
+        entries = []
+        for offset in range(0, len(data) - 127, 128):
+            name_length, entry_type = struct.unpack_from("<HB", data, offset + 64)
+            start, size = struct.unpack_from("<II", data, offset + 116)
+            name = data[offset : offset + max(0, name_length - 2)].decode("utf-16-le")
+            entries.append((name, entry_type, start, size))
+        if not entries or entries[0][1] != 5:
+            raise AgsFileError("Root directory entry not found")
+        return entries
+
+    def __read_mini(self, start, size, root):
+        if self.__mini_fat is None:
+            data = self.__read_chain(
+                self.__mini_fat_start, self.__fat, self.__sector_size
+            )
+            self.__mini_fat = list(struct.unpack("<{0}I".format(len(data) // 4), data))
+            _, _, root_start, root_size = root
+            self.__mini_stream = self.__read_chain(
+                root_start, self.__fat, self.__sector_size
+            )[:root_size]
+        return self.__read_chain(
+            start, self.__mini_fat, self.__mini_sector_size, self.__mini_stream
+        )[:size]
+
+    def __read_chain(self, start, fat, sector_size, source=None):
+        """Return the bytes in the chain of sectors that begins at start."""
+        chunks = []
+        sector = start
+        seen = set()
+        while sector <= MAX_REGULAR_SECTOR:
+            if sector in seen or sector >= len(fat):
+                raise AgsFileError("Invalid sector chain")
+            seen.add(sector)
+            if source is None:
+                offset = (sector + 1) * sector_size
+                chunks.append(self.__data[offset : offset + sector_size])
+            else:
+                offset = sector * sector_size
+                chunks.append(source[offset : offset + sector_size])
+            sector = fat[sector]
+        return b"".join(chunks)
+
+    def __unpack_sector(self, sector, count):
+        offset = (sector + 1) * self.__sector_size
+        return list(struct.unpack_from("<{0}I".format(count), self.__data, offset))
+
+
+def _parse_property_set(stream):
+    """Return an AgsConnection from the bytes of the AGSConnProperties stream."""
+    # Connection name: u16 version, u32 byte length, utf-16 text (with a null)
+    name, _ = _read_text(stream, 2)
+    index = stream.find(PROPERTY_SET_CLSID)
+    if index < 0:
+        raise AgsFileError("Property set not found")
+    # CLSID, u16 version, u32 property count
+    offset = index + len(PROPERTY_SET_CLSID) + 2
+    (count,) = struct.unpack_from("<I", stream, offset)
+    offset += 4
+    properties = {}
+    for _ in range(count):
+        key, offset = _read_text(stream, offset)
+        (variant_type,) = struct.unpack_from("<H", stream, offset)
+        offset += 2
+        if variant_type == VT_BSTR:
+            value, offset = _read_text(stream, offset)
+        elif variant_type == VT_BOOL:
+            (value,) = struct.unpack_from("<h", stream, offset)
+            value = value != 0
+            offset += 2
+        elif variant_type in FIXED_VARIANTS:
+            size, fmt = FIXED_VARIANTS[variant_type]
+            value = None if fmt is None else struct.unpack_from(fmt, stream, offset)[0]
+            offset += size
+        else:
+            # Arrays (i.e. the encrypted password) have an undocumented layout.
+            logger.debug("Stopped reading at %s (VARIANT type %s)", key, variant_type)
+            break
+        properties[key] = value
+    return AgsConnection(name, properties)
+
+
+def _read_text(data, offset):
+    """Return the text (u32 byte length + utf-16) at offset, and the next offset."""
+    (length,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    text = data[offset : offset + length].decode("utf-16-le").rstrip("\x00")
+    return text, offset + length
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the ArcGIS Server connection file reader.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+
+import ags_file
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+def test_read_connection_file():
+    """Test that the properties are read from a real connection file."""
+    ags_file.clear_cache()
+    connection = ags_file.read(os.path.join(TEST_DATA, "real.ags"))
+    assert connection is not None
+    print("name:", connection.name)
+    assert connection.name == "arcgis on inpakrovmgis_6080 (user)"
+    assert connection.connection_type == "user"
+    assert connection.server_url == "http://inpakrovmgis:6080/arcgis"
+    assert connection.rest_url == "http://inpakrovmgis:6080/arcgis/rest"
+    assert connection.admin_url == "http://inpakrovmgis:6080/arcgis/admin"
+    assert connection.folder is None
+    assert connection.properties["HTTPTIMEOUT"] == 60
+    assert connection.properties["ANONYMOUS"] is True
+    assert "PASSWORD" not in connection.properties
+
+
+def test_read_is_memoized():
+    """Test that a file is parsed once, until it changes."""
+    ags_file.clear_cache()
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "copy.ags")
+        shutil.copy(os.path.join(TEST_DATA, "real.ags"), path)
+        first = ags_file.read(path)
+        assert ags_file.read(path) is first
+        print("test a changed file is parsed again")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        second = ags_file.read(path)
+        assert second is not first
+        assert second.server_url == first.server_url
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_read_invalid_files():
+    """Test that missing, empty and non compound files return None."""
+    ags_file.clear_cache()
+    assert ags_file.read(os.path.join(TEST_DATA, "missing.ags")) is None
+    assert ags_file.read(os.path.join(TEST_DATA, "test.ags")) is None
+    assert ags_file.read(os.path.join(TEST_DATA, "test.mxd")) is None
+
+
+if __name__ == "__main__":
+    test_read_connection_file()
+    test_read_is_memoized()
+    test_read_invalid_files()
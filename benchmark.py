@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+A load benchmark for map services, and a regression gate for replacements.
+
+A set of requests (map exports, queries, ...) is sent to a live service, with
+`concurrency` requests in flight at once, and the latency percentiles and the
+throughput are measured. When a live service is replaced, it is benchmarked
+before and after; if the new version is slower by more than the threshold, the
+publish is failed, or the service is rolled back to the previous service
+definition (see Doc.rollback()).
+
+The requests can be saved in a JSON file like:
+  {"*": [{"path": "export", "params": {"bbox": "...", "f": "image"}}, ...],
+   "folder/name": [{"path": "0/query", "params": {"where": "1=1", "f": "json"}}]}
+Paths are relative to the service URL. The requests for a service path are used
+if it is in the file, else the requests for '*'. Without a file (or a match)
+the warm-up requests (see warmup.py) are used.
+
+The benchmark can also be run from the command line:
+
+    python benchmark.py http://server/arcgis folder/name [requests.json]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import sys
+import threading
+import time
+
+import rest
+import warmup
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# The latency percentile compared by the regression gate
+GATE_PERCENTILE = "p90"
+
+
+class Benchmark(object):
+    """Measures the latency and throughput of a service."""
+
+    def __init__(self, saved_requests=None, concurrency=4, repeat=5, timeout=120):
+        """saved_requests is a dictionary like the file described above (or None).
+        Each request is sent repeat times."""
+        self.__saved_requests = saved_requests or {}
+        self.__concurrency = max(1, concurrency)
+        self.__repeat = max(1, repeat)
+        self.__timeout = timeout
+
+    def run(self, server_url, service_path):
+        """Benchmark the live service_path on server_url.
+
+        Returns a dictionary of statistics (see summarize()), or None if the service
+        is not available or there are no requests for it."""
+        url, info = warmup.wait_until_ready(server_url, service_path, timeout=0)
+        if url is None:
+            logger.warning("Unable to benchmark %s; it is not available", service_path)
+            return None
+        jobs = self.__requests(url, service_path, info) * self.__repeat
+        if not jobs:
+            logger.warning("There are no benchmark requests for %s", service_path)
+            return None
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not jobs:
+                        return
+                    request_url, params = jobs.pop()
+                start = time.time()
+                try:
+                    response = rest.get(
+                        request_url,
+                        params=params,
+                        timeout=self.__timeout,
+                        limited=False,
+                    )
+                    response.raise_for_status()
+                    with lock:
+                        latencies.append((time.time() - start) * 1000)
+                except Exception as ex:
+                    logger.debug("Benchmark request %s failed: %s", request_url, ex)
+                    with lock:
+                        errors[0] += 1
+
+        start = time.time()
+        threads = [threading.Thread(target=work) for _ in range(self.__concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = summarize(latencies, errors[0], time.time() - start)
+        logger.info("Benchmark of %s: %s", service_path, stats)
+        return stats
+
+    def __requests(self, url, service_path, info):
+        """Return a list of (url, params) to send to the service."""
+        saved = self.__saved_requests.get(service_path.lower())
+        if saved is None:
+            saved = self.__saved_requests.get("*")
+        if saved:
+            return [
+                (url + "/" + item["path"].lstrip("/"), item.get("params", {}))
+                for item in saved
+            ]
+        jobs = []
+        for name in ("export", "query"):
+            request = warmup.warmup_request(name, url, info)
+            if request is not None:
+                jobs.append(request)
+        return jobs
+
+
+def load_requests(path):
+    """Return the saved benchmark requests in the JSON file at path (keys are lower
+    case service paths), or None."""
+    if path is None:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as in_file:
+            saved = json.load(in_file)
+        return dict((key.lower(), value) for key, value in saved.items())
+    except Exception as ex:
+        logger.warning("Unable to load the benchmark requests %s: %s", path, ex)
+        return None
+
+
+def summarize(latencies, errors, seconds):
+    """Return the statistics for a list of latencies (milliseconds)."""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    stats = {
+        "count": count,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput": round(count / seconds, 3) if seconds > 0 else None,
+        "mean": round(sum(ordered) / count, 1) if count else None,
+    }
+    for percent in (50, 90, 99):
+        stats["p{0}".format(percent)] = percentile(ordered, percent)
+    return stats
+
+
+def percentile(ordered, percent):
+    """Return the percent (nearest rank) percentile of the sorted list ordered."""
+    if not ordered:
+        return None
+    rank = int(-(-percent * len(ordered) // 100))  # ceiling
+    return round(ordered[max(0, rank - 1)], 1)
+
+
+def is_regression(before, after, threshold=0.5):
+    """Return True if after is slower than before by more than threshold (a
+    fraction, i.e. 0.5 is 50% slower), or has a higher error rate."""
+    if before is None or before.get(GATE_PERCENTILE) is None:
+        return False
+    if after is None or after.get(GATE_PERCENTILE) is None:
+        return True
+    if after[GATE_PERCENTILE] > before[GATE_PERCENTILE] * (1 + threshold):
+        return True
+    before_rate = before["errors"] / float(before["count"] + before["errors"])
+    after_rate = after["errors"] / float(after["count"] + after["errors"])
+    return after_rate > before_rate
+
+
+def gate(before, after, threshold=0.5, action="fail"):
+    """Return the (status, message) of the regression gate for a replacement with
+    the statistics before and after (see is_regression()).
+
+    The status is 'passed', 'regressed', or 'rollback' if action is 'rollback'
+    (see Doc.rollback()). The message compares the latencies (None if passed)."""
+    if not is_regression(before, after, threshold):
+        return "passed", None
+    message = "{0} ms before, {1} ms after".format(
+        (before or {}).get(GATE_PERCENTILE), (after or {}).get(GATE_PERCENTILE)
+    )
+    if action == "rollback":
+        return "rollback", message
+    return "regressed", message
+
+
+def main():
+    """Benchmark the service named on the command line."""
+    if len(sys.argv) < 3:
+        print("Usage: {0} SERVER_URL SERVICE_PATH [REQUESTS]".format(sys.argv[0]))
+        sys.exit(1)
+    saved = load_requests(sys.argv[3]) if len(sys.argv) > 3 else None
+    stats = Benchmark(saved).run(sys.argv[1], sys.argv[2])
+    print(json.dumps(stats, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the service benchmark and the regression gate for replacements.
+
+Run with: python -m pytest benchmark_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+
+import benchmark
+from benchmark import Benchmark
+import http_replay
+import rest
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+URL = "https://gis/arcgis"
+
+
+class FakeService(object):
+    """A transport for a server with one map service (Roads), that fails the
+    queries if failing is True."""
+
+    def __init__(self, failing=False):
+        self.failing = failing
+        self.requests = []  # the URL of each request to the service
+
+    def request(self, method, url, **kwargs):
+        """Answer a catalog, service description, export or query request."""
+        # pylint: disable=unused-argument
+        url = url.split("?", 1)[0]
+        if url == URL + "/rest/services":
+            body = {"folders": [], "services": [{"name": "Roads", "type": "MapServer"}]}
+        elif url == URL + "/rest/services/Roads/MapServer":
+            body = {
+                "fullExtent": {"xmin": 0, "ymin": 0, "xmax": 10, "ymax": 10},
+                "layers": [{"id": 0, "name": "Roads"}],
+            }
+        else:
+            self.requests.append(url)
+            if self.failing and url.endswith("/query"):
+                return http_replay.ReplayResponse(500, "", url)
+            body = {"count": 1}
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+def stats(p90, count=100, errors=0):
+    """Return benchmark statistics with the p90 latency (ms) and error count."""
+    return {"p90": p90, "count": count, "errors": errors}
+
+
+def test_percentiles():
+    """The percentiles are the nearest rank, and the throughput is per second."""
+    result = benchmark.summarize([float(ms) for ms in range(1, 101)], 2, 4.0)
+    assert result["count"] == 100 and result["errors"] == 2
+    assert (result["p50"], result["p90"], result["p99"]) == (50.0, 90.0, 99.0)
+    assert result["throughput"] == 25.0
+    assert result["mean"] == 50.5
+    assert benchmark.percentile([], 90) is None
+    assert benchmark.summarize([], 3, 1.0)["p90"] is None
+
+
+def test_regression_threshold():
+    """A replacement regresses if its p90 is slower by more than the threshold,
+    or it has a higher error rate."""
+    before = stats(100.0)
+    assert not benchmark.is_regression(before, stats(150.0), threshold=0.5)
+    assert benchmark.is_regression(before, stats(151.0), threshold=0.5)
+    assert not benchmark.is_regression(before, stats(151.0), threshold=1.0)
+    assert benchmark.is_regression(before, stats(90.0, count=95, errors=5))
+    assert not benchmark.is_regression(stats(100.0, 95, 5), stats(100.0, 95, 5))
+    print("test an unknown before is not a regression, and an unknown after is")
+    assert not benchmark.is_regression(None, stats(500.0))
+    assert benchmark.is_regression(before, None)
+    assert benchmark.is_regression(before, stats(None, count=0, errors=100))
+
+
+def test_rollback_decision():
+    """A regression is rolled back only if the action is rollback."""
+    assert benchmark.gate(stats(100.0), stats(120.0), action="rollback") == (
+        "passed",
+        None,
+    )
+    status, message = benchmark.gate(stats(100.0), stats(300.0))
+    assert status == "regressed"
+    assert message == "100.0 ms before, 300.0 ms after"
+    status, _ = benchmark.gate(stats(100.0), stats(300.0), action="rollback")
+    assert status == "rollback"
+    status, message = benchmark.gate(stats(100.0), None, action="rollback")
+    assert status == "rollback" and message == "100.0 ms before, None ms after"
+
+
+def test_run_against_service():
+    """Without saved requests the warm-up requests are sent repeat times, and the
+    failed requests are counted as errors."""
+    server = FakeService(failing=True)
+    previous = rest.set_transport(server)
+    try:
+        result = Benchmark(concurrency=2, repeat=3).run(URL, "Roads")
+        assert Benchmark().run(URL, "Missing") is None
+    finally:
+        rest.set_transport(previous)
+    print(result)
+    assert result["count"] == 3 and result["errors"] == 3
+    assert sorted(set(server.requests)) == [
+        URL + "/rest/services/Roads/MapServer/0/query",
+        URL + "/rest/services/Roads/MapServer/export",
+    ]
+
+
+def test_saved_requests():
+    """Saved requests for the service (or '*') are used instead of the warm-ups."""
+    folder = tempfile.mkdtemp()
+    server = FakeService()
+    previous = rest.set_transport(server)
+    try:
+        path = os.path.join(folder, "requests.json")
+        saved = {
+            "*": [{"path": "export", "params": {"f": "image"}}],
+            "Roads": [{"path": "/0/query", "params": {"where": "1=1"}}],
+        }
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(saved))
+        requests = benchmark.load_requests(path)
+        assert sorted(requests) == ["*", "roads"]
+        result = Benchmark(requests, repeat=2).run(URL, "Roads")
+        assert result["count"] == 2
+        assert set(server.requests) == set(
+            [URL + "/rest/services/Roads/MapServer/0/query"]
+        )
+        assert benchmark.load_requests(os.path.join(folder, "missing.json")) is None
+        assert benchmark.load_requests(None) is None
+    finally:
+        rest.set_transport(previous)
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_percentiles()
+    test_regression_threshold()
+    test_rollback_decision()
+    test_run_against_service()
+    test_saved_requests()
@@ -55,7 +55,7 @@ class BufferingSMTPHandler(logging.handlers.BufferingHandler):
                 smtp = smtplib.SMTP(self.mailhost, port)
                 msg = "From: %s\r\nTo: %s\r\nSubject: %s\r\n\r\n" % (
                     self.fromaddr,
-                    self.toaddrs.join(","),
+                    ",".join(self.toaddrs),
                     self.subject,
                 )
                 for record in self.buffer:
@@ -45,11 +45,168 @@ class Config(object):
     # This will be considered along with the files found in the root_directory.
     # This file allows the user to publish source documents not in the root_folder, provide
     # additional or non-default publishing parameters, and to specify if the service should
-    # be deleted or unconditionally re-published. service_list must be a quoted path or None.
-    # The file must have a header row and at least XX columns the first of which must be
-    # string values for: TODO: define the service_list file format.
+    # be skipped or unconditionally re-published. service_list must be a quoted path or None.
+    # The file must have a header row and at least 3 columns the first of which must be
+    # string values for: source_path, service_folder, service_name (see service_list.py).
+    # Optional columns (named in the header row) include image_service, skip and force
+    # (yes or no), priority (see max_runtime), summary and tags (comma separated) for the
+    # service, and the instance and pooling settings in pooling.py (i.e. min_instances,
+    # max_instances, isolation). Changes to these settings are applied to a published
+    # service with the admin API (see admin_username) without republishing it.
+    # cache_scales (comma separated) are the scales to rebuild when the service's data
+    # changes (see cache_jobs). Invalid rows are ignored, and listed in the run_report.
     service_list = "c:/tmp/pub/services.csv"
 
+    # dependency_index
+    # The dependency_index is a path to a JSON file that records the data sources
+    # used by each published service (and their state when the service was published).
+    # On each run, services with a data source that has changed are republished.
+    # The file is created if it does not exist. dependency_index must be a quoted path
+    # or None. If None, changes to data sources will not trigger a republish.
+    dependency_index = "c:/tmp/pub/dependencies.json"
+
+    # max_runtime
+    # The time budget (in minutes) for publishing in each run, or None for no limit.
+    # Documents are published in priority order (see scheduler.py), and a document is
+    # only started if it is expected to finish in the remaining time. The rest are
+    # deferred to the next run.
+    max_runtime = None
+
+    # schedule_file
+    # The schedule_file is a path to a JSON file with the time it took to publish each
+    # document in previous runs, and the documents deferred by max_runtime.
+    # schedule_file must be a quoted path or None.
+    schedule_file = "c:/tmp/pub/schedule.json"
+
+    # usage_database
+    # The usage_database is a path to a SQLite database with a history of the requests
+    # and response times of each service, collected from the server's usage reports on
+    # each run (this requires admin_username and admin_password). Busier services are
+    # published first when there is a max_runtime. usage_database must be a quoted path
+    # or None.
+    usage_database = None
+
+    # apply_usage
+    # If True, the min_instances and max_instances of each service are set from the
+    # recent usage (see usage.py), unless they are set in the service_list. The
+    # settings are applied to published services with the admin API.
+    apply_usage = False
+
+    # warmup / warmup_requests / warmup_timeout
+    # If warmup is True, each new or replaced service is polled until it is ready (up to
+    # warmup_timeout seconds), and then sent the warmup_requests (any of "export",
+    # "query" and "tile") to start instances and fill caches. The time to ready is in the
+    # run_report, and services that do not start are reported as not_ready.
+    warmup = False
+    warmup_requests = ["export", "query", "tile"]
+    warmup_timeout = 300
+
+    # benchmark / benchmark_requests / benchmark_threshold / benchmark_concurrency /
+    # regression_action
+    # If benchmark is True, a live service is benchmarked (latency percentiles and
+    # throughput, with benchmark_concurrency requests at once) before and after it is
+    # replaced. benchmark_requests is a quoted path to a JSON file of the requests to
+    # send (see benchmark.py) or None to use the warm-up requests. If the 90th
+    # percentile latency is more than benchmark_threshold (0.5 = 50%) slower after, or
+    # there are more errors, the replacement is a regression. regression_action is
+    # "fail" (report it, and try again on the next run) or "rollback" (republish the
+    # previous service definition).
+    benchmark = False
+    benchmark_requests = None
+    benchmark_threshold = 0.5
+    benchmark_concurrency = 4
+    regression_action = "fail"
+
+    # folder_workers
+    # The number of server folders to publish to (or unpublish from) at once. Changes in
+    # the same folder are always made one at a time, and missing folders are created
+    # before the first upload. arcpy is not thread safe, so documents are drafted,
+    # analyzed, staged and uploaded one at a time; the admin requests (service edits,
+    # deletes, and checks) and warm-ups overlap. Use 1 to publish one document at a
+    # time.
+    folder_workers = 1
+
+    # max_concurrency
+    # The most uploads, or ReST requests, to send to a server at once. The limit starts
+    # at 2, grows while the server responds quickly, and is halved when it slows down
+    # or fails. The limits used are in the run_report.
+    max_concurrency = 8
+
+    # cache_jobs / cache_window / cache_instances
+    # If cache_jobs is a quoted path (to a JSON file), then when the data of a cached
+    # map service changes, the tiles that cover the changed data (at the scales in the
+    # service_list cache_scales column, or all the cached scales) are rebuilt. Updates
+    # are only started in the cache_window (i.e. "22:00-05:00", or None for any time);
+    # updates queued at other times are saved in cache_jobs for a later run (or for
+    # `python tile_cache.py cache_jobs.json 22:00-05:00` in a scheduled task). Each
+    # update uses cache_instances caching service instances, and is submitted with the
+    # admin_username and admin_password. The updates that are still running are also
+    # saved in cache_jobs, and their status (checked by each run) is in the run_report.
+    cache_jobs = None
+    cache_window = "22:00-05:00"
+    cache_instances = 2
+
+    # memory_profile
+    # If True, the memory used by the process is read at each stage of each document
+    # (with tracemalloc, which slows the run), and the growth for each document and
+    # stage, and the code that allocated the most memory, are added to the run_report.
+    # With folder_workers above 1 (documents in parallel), only the growth over the
+    # run is reported.
+    memory_profile = False
+
+    # trace_file / trace_otlp
+    # If trace_file is a quoted path, a trace of the run (the time each worker spends
+    # in each document stage and ReST request) is saved there in the Chrome trace
+    # format; open it in chrome://tracing or https://ui.perfetto.dev. If trace_otlp is
+    # the quoted URL of an OpenTelemetry collector (i.e.
+    # "http://localhost:4318/v1/traces"), the trace is sent there. None to not trace.
+    trace_file = None
+    trace_otlp = None
+
+    # http_record / http_replay / replay_latency_scale / replay_failure_rate
+    # If http_record is a quoted path, the ReST responses of the run (and the time each
+    # took) are saved there. If http_replay is the quoted path of a saved file, the ReST
+    # responses are served from it instead of the server, after the recorded time
+    # multiplied by replay_latency_scale (0 for no delay), and a fraction
+    # (replay_failure_rate) of them fail with a 503 response. This reproduces a slow or
+    # failing server for testing (see http_replay.py). None to use the server.
+    http_record = None
+    http_replay = None
+    replay_latency_scale = 1.0
+    replay_failure_rate = 0.0
+
+    # journal
+    # The journal is a path to a file where the progress of each document (drafted,
+    # analyzed, staged, uploaded, verified, deleted) is recorded as it happens. If a run
+    # is interrupted, the next run can be started with --resume to skip the finished
+    # work. journal must be a quoted path or None.
+    journal = "c:/tmp/pub/journal.jsonl"
+
+    # fingerprint_file
+    # The fingerprint_file is a path to a file with a fingerprint (a hash) of the folders
+    # and documents in root_directory, the service_list, the history_file and the list
+    # of services on the server, taken after the last successful run. If none of these
+    # (or the data sources in the dependency_index) have changed, the run ends without
+    # doing anything. fingerprint_file must be a quoted path or None (always run).
+    fingerprint_file = "c:/tmp/pub/fingerprint.txt"
+
+    # run_report
+    # The run_report is a path to a JSON file for a report of what was (and was not)
+    # published and unpublished in each run. It is overwritten on each run. When a
+    # run is sharded across several nodes, give each node a different file, and
+    # merge them with `python run_report.py merged.json shard1.json shard2.json`.
+    # run_report must be a quoted path or None (no report).
+    run_report = "c:/tmp/pub/report.json"
+
+    # work_queue
+    # The work_queue is a path to a SQLite database (on a share all publishing nodes can
+    # reach) used to balance the work across several worker processes. One process runs
+    # with --enqueue to discover the work, and any number of processes (on any number of
+    # machines) run with --worker to do it. Workers lease one job at a time; if a worker
+    # dies, the job is given to another worker when the lease expires. work_queue must be
+    # a quoted path or None.
+    work_queue = None
+
     # server
     # The default server type/connection file.  Must be a quoted string or None
     # A quoted string should be either 'MY_HOSTED_SERVICES' or a valid file path.
@@ -57,6 +214,15 @@ class Config(object):
     # to 'MY_HOSTED_SERVICES'.
     server = "c:/tmp/pub/server.ags"
 
+    # targets
+    # A list of servers to publish to at the same time (i.e. dev, staging and prod), or
+    # None to publish to the one server above. Each item is a quoted path to a
+    # connection (*.ags) file, optionally prefixed with a name for the run report,
+    # i.e. ["dev=c:/tmp/pub/dev.ags", "prod=c:/tmp/pub/prod.ags"]. Each document is
+    # drafted, analyzed and staged once, then uploaded to each of the targets (one at
+    # a time; arcpy is not thread safe).
+    targets = None
+
     # server_url
     # The Server URL is used to check if a service exists before publishing,
     # And to connect to the server for un-publishing.  If the server URL is not
@@ -23,7 +23,8 @@ config = {
     },
     "handlers": {
         # command line arguments (--verbose and --debug will change the level of
-        # first handler to INFO and DEBUG)
+        # the console handler to INFO and DEBUG)
+        # The handlers are run on a background thread (see queue_logging.py)
         "console": {
             "class": "logging.StreamHandler",
             "level": "WARNING",
@@ -37,8 +38,11 @@ config = {
             "filename": "publisher.log",
         },
         "email": {
+            # Summarize the errors in an email at most every 5 minutes (and at most
+            # 4 times an hour), sent in the background (see smtp_error_reporter.py)
+            "class": "smtp_error_reporter.SMTPErrorReporter",
             # Bundle 100 messages into a single email
-            "class": "buffering_smtp_handler.BufferingSMTPHandler",
+            # 'class':    'buffering_smtp_handler.BufferingSMTPHandler',
             # Separate email for each message
             # 'class':    'logging.handlers.SMTPHandler',
             "level": "ERROR",
@@ -50,7 +54,9 @@ config = {
         },
     },
     "root": {
-        "level": "NOTSET",
+        # The lowest level of the handlers; records below it are not created at all.
+        # (--debug lowers it; see queue_logging.set_level)
+        "level": "INFO",
         # Do not send emails when testing
         "handlers": ["console", "file"]
         # 'handlers': ['console', 'file', 'email']
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+An index of the data sources used by each published service.
+
+The index is used to find the services that need to be republished because
+one or more of their data sources have changed.  It is saved as a JSON file
+with the following structure:
+  {"version": 2,
+   "services": {"service_path": {"source_path": [mtime, size] or null, ...}, ...}}
+The signature ([mtime, size]) of each data source is recorded when the service
+is published.  On the next run, each distinct data source is checked once, and
+the services with a data source that has a different signature are returned.
+
+The signature of a feature class in a file geodatabase is taken from the files
+in the geodatabase (the geodatabase folder does not change when its data is
+edited in place); a shapefile includes its .dbf and .shx files. The signature of
+a source that does not exist is None, so a missing source is only a change when
+it appears (or disappears).
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+VERSION = 2
+
+# Workspaces that hold the data sources (feature classes are not files)
+WORKSPACE_EXTENSIONS = (".gdb", ".mdb", ".sde")
+# The files of a shapefile that change when its features or attributes are edited
+SHAPEFILE_EXTENSIONS = (".shp", ".shx", ".dbf")
+# Files in a file geodatabase that change when it is read (not edited)
+LOCK_FILE_EXTENSION = ".lock"
+
+
+class DependencyIndex(object):
+    """The data sources of each published service, and their state when published."""
+
+    def __init__(self, path=None):
+        self.__path = path
+        self.__services = {}
+        # Services in different folders are published on different threads.
+        self.__lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.__load()
+
+    @property
+    def path(self):
+        """Return the filesystem path of the saved index (may be None)."""
+        return self.__path
+
+    def sources(self, service_path):
+        """Return the list of data sources recorded for service_path."""
+        with self.__lock:
+            return sorted(self.__services.get(_key(service_path), {}).keys())
+
+    def contains(self, service_path):
+        """Return True if the data sources of service_path are in the index."""
+        if service_path is None:
+            return False
+        with self.__lock:
+            return _key(service_path) in self.__services
+
+    def record(self, service_path, sources, seed=False):
+        """Record the current state of the data sources for a (re)published service.
+
+        If seed is True, the service is only recorded if it is not in the index (i.e.
+        an up to date service published before the index was kept)."""
+        if service_path is None or sources is None:
+            return
+        if seed and self.contains(service_path):
+            return
+        source_signatures = signatures(sources)
+        with self.__lock:
+            if seed and _key(service_path) in self.__services:
+                return
+            self.__services[_key(service_path)] = source_signatures
+
+    def record_signatures(self, service_path, source_signatures, seed=False):
+        """Record the data source signatures taken when a service was (re)published.
+
+        source_signatures is a dictionary (from signatures()), possibly round tripped
+        through JSON by another process (i.e. a worker in the work queue). seed is
+        the same as in record()."""
+        if service_path is None or source_signatures is None:
+            return
+        with self.__lock:
+            if seed and _key(service_path) in self.__services:
+                return
+            self.__services[_key(service_path)] = dict(
+                (source, None if sig is None else tuple(sig))
+                for source, sig in source_signatures.items()
+            )
+
+    def remove(self, service_path):
+        """Remove an unpublished service from the index."""
+        with self.__lock:
+            self.__services.pop(_key(service_path), None)
+
+    def changed_services(self):
+        """Return the set of service paths with a data source that has changed.
+
+        Each distinct data source is only checked once (they are often shared)."""
+        current = {}
+        workspaces = {}
+        changed = set()
+        for service, source_signatures in self.__services.items():
+            for source, old_signature in source_signatures.items():
+                if source not in current:
+                    current[source] = signature(source, workspaces)
+                if current[source] != old_signature:
+                    logger.debug("%s has changed (used by %s)", source, service)
+                    changed.add(service)
+        logger.info(
+            "Checked %s data sources; %s services need to be republished",
+            len(current),
+            len(changed),
+        )
+        return changed
+
+    def changed_sources(self, service_path):
+        """Return the list of data sources of service_path that have changed since it
+        was recorded, or None if nothing was recorded for it (assume everything has).
+
+        Call this before record() replaces the signatures."""
+        with self.__lock:
+            source_signatures = self.__services.get(_key(service_path))
+        if source_signatures is None:
+            return None
+        workspaces = {}
+        return sorted(
+            source
+            for source, old_signature in source_signatures.items()
+            if signature(source, workspaces) != old_signature
+        )
+
+    def is_changed(self, service_path, changed):
+        """Return True if service_path is in the set returned by changed_services()."""
+        return service_path is not None and _key(service_path) in changed
+
+    def save(self):
+        """Save the index to the file it was loaded from."""
+        if self.__path is None:
+            return
+        with self.__lock:
+            data = {"version": VERSION, "services": dict(self.__services)}
+        try:
+            with open(self.__path, "w", encoding="utf-8") as out_file:
+                out_file.write(json.dumps(data, indent=2, sort_keys=True))
+        except Exception as ex:
+            logger.warning(
+                "Unable to save the dependency index %s: %s", self.__path, ex
+            )
+
+    def __load(self):
+        try:
+            with open(self.__path, "r", encoding="utf-8") as in_file:
+                data = json.load(in_file)
+            if "version" not in data:
+                # The signatures in an index saved before version 2 were taken from
+                # the nearest folder, and can not be compared; take them again.
+                logger.info("Updating the dependency index %s", self.__path)
+                for service, source_signatures in data.items():
+                    self.record(service, list(source_signatures))
+                return
+            for service, source_signatures in data["services"].items():
+                self.record_signatures(service, source_signatures)
+        except Exception as ex:
+            logger.warning(
+                "Unable to load the dependency index %s: %s", self.__path, ex
+            )
+            self.__services = {}
+
+
+def signatures(sources):
+    """Return a dictionary of the signature of each of the sources."""
+    workspaces = {}
+    return dict((source, signature(source, workspaces)) for source in sources)
+
+
+def signature(source, workspaces=None):
+    """Return the (mtime, size) of the data in source, or None if it does not exist.
+
+    A source in a file geodatabase is signed with the latest mtime and the total size
+    of the files in the geodatabase; a source in a personal geodatabase (.mdb) or an
+    enterprise geodatabase (.sde) with its workspace file. workspaces is an optional
+    dictionary that caches the workspace signatures (many sources share them)."""
+    if not source:
+        return None
+    workspace = _workspace(source)
+    if workspace is None:
+        base, extension = os.path.splitext(source)
+        if extension.lower() == ".shp":
+            return _files_signature(
+                [base + part for part in SHAPEFILE_EXTENSIONS], source
+            )
+        return _files_signature([source], source)
+    key = os.path.normcase(workspace)
+    if workspaces is not None and key in workspaces:
+        return workspaces[key]
+    if os.path.isdir(workspace):
+        result = _folder_signature(workspace)
+    else:
+        result = _files_signature([workspace], workspace)
+    if workspaces is not None:
+        workspaces[key] = result
+    return result
+
+
+def _workspace(source):
+    """Return the path of the geodatabase that contains source (or None)."""
+    path = source
+    while path:
+        if os.path.splitext(path)[1].lower() in WORKSPACE_EXTENSIONS:
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return None
+
+
+def _files_signature(paths, required):
+    """Return the latest mtime and total size of the paths (that exist), or None if
+    the required path does not exist."""
+    if not os.path.isfile(required):
+        return None
+    latest = 0
+    total = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        latest = max(latest, stat.st_mtime)
+        total += stat.st_size
+    return latest, total
+
+
+def _folder_signature(folder):
+    """Return the latest mtime and total size of the files in a file geodatabase
+    (ignoring lock files), or None if it does not exist."""
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return None
+    latest = 0
+    total = 0
+    for name in names:
+        if name.lower().endswith(LOCK_FILE_EXTENSION):
+            continue
+        try:
+            stat = os.stat(os.path.join(folder, name))
+        except OSError:
+            continue
+        latest = max(latest, stat.st_mtime)
+        total += stat.st_size
+    return latest, total
+
+
+def _key(service_path):
+    """Service paths are case insensitive on the server."""
+    return service_path.lower()
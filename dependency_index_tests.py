@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the index of the data sources used by each published service.
+
+Run with: python -m pytest dependency_index_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+
+import dependency_index
+from dependency_index import DependencyIndex
+
+
+def write(path, text):
+    """Write text to path (replacing the file)."""
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write(text)
+
+
+def set_mtime(path, mtime):
+    """Set the access and modified times of path."""
+    os.utime(path, (mtime, mtime))
+
+
+def make_gdb(folder):
+    """Create a stand-in for a file geodatabase in folder; returns its path."""
+    gdb = os.path.join(folder, "roads.gdb")
+    os.mkdir(gdb)
+    write(os.path.join(gdb, "a00000009.gdbtable"), "roads")
+    write(os.path.join(gdb, "a00000009.gdbtablx"), "index")
+    set_mtime(os.path.join(gdb, "a00000009.gdbtable"), 1000)
+    set_mtime(os.path.join(gdb, "a00000009.gdbtablx"), 1000)
+    set_mtime(gdb, 1000)
+    return gdb
+
+
+def test_edits_in_a_file_geodatabase_are_changes():
+    """Editing a table in place changes the signature; reading it does not."""
+    folder = tempfile.mkdtemp()
+    try:
+        gdb = make_gdb(folder)
+        index = DependencyIndex()
+        index.record("Transport/Roads", [os.path.join(gdb, "Roads")])
+        index.record("Transport/Streets", [os.path.join(gdb, "Streets")])
+        assert index.changed_services() == set()
+
+        print("test a lock file is not a change")
+        write(os.path.join(gdb, "_gdb.host.1234.sr.lock"), "")
+        set_mtime(gdb, 1000)
+        assert index.changed_services() == set()
+
+        print("test an edit in place is a change")
+        write(os.path.join(gdb, "a00000009.gdbtable"), "roads")
+        set_mtime(os.path.join(gdb, "a00000009.gdbtable"), 2000)
+        set_mtime(gdb, 1000)
+        changed = index.changed_services()
+        assert changed == set(["transport/roads", "transport/streets"])
+        assert index.changed_sources("Transport/Roads") == [os.path.join(gdb, "Roads")]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_shapefile_attributes_are_changes():
+    """A shapefile is signed with its .dbf (the attributes) and .shx files."""
+    folder = tempfile.mkdtemp()
+    try:
+        shapefile = os.path.join(folder, "parks.shp")
+        for extension in (".shp", ".shx", ".dbf"):
+            write(os.path.join(folder, "parks" + extension), extension)
+            set_mtime(os.path.join(folder, "parks" + extension), 1000)
+        before = dependency_index.signature(shapefile)
+        write(os.path.join(folder, "parks.dbf"), ".dbf with a new column")
+        assert dependency_index.signature(shapefile) != before
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_missing_sources_are_not_their_folders():
+    """A missing source is None (not the folder it would be in), until it exists."""
+    folder = tempfile.mkdtemp()
+    try:
+        gdb = make_gdb(folder)
+        missing = os.path.join(folder, "missing.gdb", "Roads")
+        raster = os.path.join(folder, "dem.tif")
+        assert dependency_index.signature(missing) is None
+        assert dependency_index.signature(raster) is None
+        assert dependency_index.signature(None) is None
+
+        index = DependencyIndex()
+        index.record("Elevation", [raster, os.path.join(gdb, "Roads")])
+        # Changes to the folder do not make the missing raster a change.
+        write(os.path.join(folder, "notes.txt"), "unrelated")
+        assert index.changed_services() == set()
+        write(raster, "raster")
+        assert index.changed_services() == set(["elevation"])
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_seed_does_not_replace_signatures():
+    """Seeding only indexes services that are not in the index."""
+    folder = tempfile.mkdtemp()
+    try:
+        gdb = make_gdb(folder)
+        source = os.path.join(gdb, "Roads")
+        index = DependencyIndex()
+        index.record_signatures("Roads", {source: [1, 2]})
+        index.record("Roads", [source], seed=True)
+        index.record("Streets", [source], seed=True)
+        assert index.contains("streets")
+        assert index.changed_services() == set(["roads"])
+        index.record_signatures("Roads", {source: [3, 4]}, seed=True)
+        index.record("Roads", [source])
+        assert index.changed_services() == set()
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_save_and_load():
+    """The index round trips through its file; an older index is signed again."""
+    folder = tempfile.mkdtemp()
+    try:
+        gdb = make_gdb(folder)
+        source = os.path.join(gdb, "Roads")
+        path = os.path.join(folder, "dependencies.json")
+        index = DependencyIndex(path)
+        index.record("Transport/Roads", [source])
+        index.save()
+        loaded = DependencyIndex(path)
+        assert loaded.sources("Transport/Roads") == [source]
+        assert loaded.changed_services() == set()
+
+        print("test an index saved before version 2")
+        write(path, json.dumps({"transport/roads": {source: [1000, 0]}}))
+        legacy = DependencyIndex(path)
+        assert legacy.sources("Transport/Roads") == [source]
+        assert legacy.changed_services() == set()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_edits_in_a_file_geodatabase_are_changes()
+    test_shapefile_attributes_are_changes()
+    test_missing_sources_are_not_their_folders()
+    test_seed_does_not_replace_signatures()
+    test_save_and_load()
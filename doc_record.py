@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+A lightweight record of a document to publish (or unpublish).
+
+Creating a `Doc` is relatively expensive (it checks the server configuration
+and may parse the *.ags connection file) and each one carries a lot of state.
+A DocRecord has just enough information for discovery and planning (names,
+paths, and cheap file system checks). It is converted to a `Doc` with
+materialize() only when there is work to do.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import fanout
+import uploads
+import util
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+
+class DocRecord(object):
+    """The source path, service folder and service name of a document, and its
+    settings (a dictionary) and overrides from the service_list (see
+    service_list.py)."""
+
+    # pylint: disable=too-many-arguments
+
+    __slots__ = (
+        "path",
+        "folder",
+        "service_name",
+        "config",
+        "settings",
+        "image_service",
+        "force",
+        "priority",
+    )
+
+    def __init__(
+        self,
+        path,
+        folder=None,
+        service_name=None,
+        config=None,
+        settings=None,
+        image_service=False,
+        force=False,
+        priority=0.0,
+    ):
+        self.path = path
+        self.folder = folder
+        self.service_name = service_name
+        self.config = config
+        self.settings = settings or {}
+        self.image_service = image_service
+        self.force = force
+        self.priority = priority
+
+    def __repr__(self):
+        return "DocRecord({0!r}, folder={1!r}, service_name={2!r})".format(
+            self.path, self.folder, self.service_name
+        )
+
+    @property
+    def name(self):
+        """Return the local name of this document (the same as Doc.name)."""
+        if self.path is not None:
+            name = os.path.splitext(os.path.basename(self.path))[0]
+        else:
+            name = self.service_name
+        if self.folder is not None and name is not None:
+            return self.folder + "/" + name
+        return name
+
+    @property
+    def service_folder(self):
+        """Return the folder on the server (the same as Doc.service_folder)."""
+        return util.sanitize_service_name(self.folder)
+
+    @property
+    def service_path(self):
+        """Return the service path for this document (the same as Doc.service_path)."""
+        name = self.service_name
+        if name is None and self.path is not None:
+            name = os.path.splitext(os.path.basename(self.path))[0]
+        name = util.sanitize_service_name(name)
+        if name is None:
+            return None
+        folder = self.service_folder
+        if folder is None:
+            return name
+        return folder + "/" + name
+
+    @property
+    def is_up_to_date(self):
+        """Return True if there is a service definition newer than the source document,
+        and it was not a failed (or missing) upload (see is_uploaded).
+
+        This uses the same files as Doc.is_up_to_date (or FanOut.stage when publishing
+        to targets), but it does not check the server when the uploads were not
+        recorded."""
+        if self.path is None or self.image_service:
+            return False
+        for _, service_definitions in self.__service_definitions():
+            if not service_definitions:
+                return False
+        return self.is_uploaded is not False
+
+    @property
+    def is_uploaded(self):
+        """Return True if a service definition newer than the source was the last one
+        uploaded to each server, False if it was not, or None if the uploads were not
+        recorded."""
+        if self.path is None:
+            return None
+        result = True
+        for server, service_definitions in self.__service_definitions():
+            current = [
+                uploads.is_current(self.path, server, service_definition)
+                for service_definition in service_definitions
+            ]
+            if True in current:
+                continue
+            if not current or False in current:
+                return False
+            result = None
+        return result
+
+    def __service_definitions(self):
+        """Return [(server, [service definitions newer than the source])] for the
+        servers the document is published to: the targets (see fanout.py), or the
+        server."""
+        targets = getattr(self.config, "target", None)
+        if targets:
+            candidates = fanout.variants(self.path)
+            servers = [fanout.target_server(target) for target in targets]
+        else:
+            candidates = [os.path.splitext(self.path)[0] + ".sd"]
+            servers = [uploads.connection(getattr(self.config, "server", None))]
+        try:
+            source_mtime = os.path.getmtime(self.path)
+        except OSError:
+            return [(server, []) for server in servers]
+        fresh = []
+        for candidate in candidates:
+            try:
+                if source_mtime < os.path.getmtime(candidate):
+                    fresh.append(candidate)
+            except OSError:
+                pass
+        return [(server, fresh) for server in servers]
+
+    @property
+    def is_rejected(self):
+        """Return True if the document was rolled back, and has not changed since (the
+        same as Doc.is_rejected)."""
+        return uploads.is_rejected(self.path)
+
+    def materialize(self, draft_templates=None):
+        """Return a new Doc for this record (see Doc for draft_templates)."""
+        # Imported here so that discovery and planning do not require arcpy.
+        from publishable_doc import Doc  # pylint: disable=import-outside-toplevel
+
+        return Doc(
+            self.path,
+            folder=self.folder,
+            service_name=self.service_name,
+            config=self.config,
+            settings=self.settings,
+            image_service=self.image_service,
+            draft_templates=draft_templates,
+        )
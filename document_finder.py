@@ -10,7 +10,9 @@ import logging
 import os
 import sys
 
-from publishable_doc import Doc
+from doc_record import DocRecord
+import service_list as service_lists
+import tracing
 import util
 
 logger = logging.getLogger(__name__)
@@ -53,6 +55,8 @@ class Documents(object):
         self.__service_list = None
         self.__filesystem_mxds = []
         self.__config = config
+        # (index, count) where index is 1 based; None to process all documents.
+        self.__shard = getattr(config, "shard", None)
 
         if path is not None:
             self.path = path
@@ -132,16 +136,16 @@ class Documents(object):
 
     @property
     def service_list(self):
-        """Returns a list of tuples [(source_path,service_folder,service_name),..]
-        These are services that have been previously published, and not deleted"""
+        """Returns the services to publish, and their settings (a ServiceList, see
+        service_list.py), or None."""
         return self.__service_list
 
     @service_list.setter
     def service_list(self, new_value):
         """set the service list. Can be a path, or a list of tuples.
 
-        If it is a path, then it should contain a csv file with
-        source_path,service_folder,service_name
+        If it is a path, then it should be a csv file in the format described
+        in service_list.py. The tuples are (source_path,service_folder,service_name)
         """
         if new_value == self.__service_list:
             return
@@ -155,6 +159,7 @@ class Documents(object):
             if len(new_value) == 0 or (
                 isinstance(new_value[0], tuple) and len(new_value[0]) == 3
             ):
+                self.__service_list = service_lists.from_tuples(new_value)
                 return
             self.__service_list = None
             logger.warning(
@@ -162,66 +167,119 @@ class Documents(object):
             )
         else:
             if os.path.isfile(new_value):
-                self.__service_list = self.__get_server_list_from_file(new_value)
+                self.__service_list = service_lists.load(new_value)
+            else:
+                logger.warning("Service list %s not found, ignoring it", new_value)
+                self.__service_list = None
 
     @property
     def items_to_publish(self):
-        """Return a list of document objects to publish
+        """Generate a DocRecord for each document to publish
 
+        Use DocRecord.materialize() to get a publishable Doc.
         Files are based on ArcGIS Desktop mxd files and not ArcGIS Pro project files
         """
-        # TODO: Enhance document creation with details from a spreadsheet
-        # TODO: created additional documents (image services) based on data in spreadsheet
-        mxds = self.__filesystem_mxds
-        logger.debug("Found %s documents to publish", len(mxds))
-        docs = [Doc(mxd, folder=folder, config=self.__config) for folder, mxd in mxds]
-        return docs
+        count = 0
+        for record, skip in self.__planned_records():
+            if skip:
+                logger.info("Skipping %s (see the service_list)", record.name)
+                continue
+            if self.__in_shard_path(record.service_path):
+                count += 1
+                yield record
+        logger.debug("Found %s documents to publish", count)
 
     @property
     def items_to_unpublish(self):
-        """Returns a list documents to un-publish."""
+        """Generate a DocRecord for each document to un-publish."""
 
         # TODO: unpublish documents flagged in the spreadsheet
         if self.history is None:
-            return []
-        mxds = self.__filesystem_mxds
-        if len(mxds) == 0:
+            return
+        # Skipped documents are neither published nor unpublished.
+        source_paths = set()
+        service_paths = set()
+        for record, _ in self.__planned_records():
+            source_paths.add(service_lists.normalize_path(record.path))
+            service_paths.add((record.service_path or "").lower())
+        if len(source_paths) == 0:
             logger.warning(
                 "No *.mxd files found, Unwilling to unpublish all without an override."
             )
             # TODO: support an override to unpublish all?
-            return []
-        docs = []
-        # pylint: disable=consider-using-set-comprehension
-        # not available in Python2
-        source_paths = set([path for _, path in mxds])
-        service_paths = [util.service_path(path, folder) for folder, path in mxds]
-        service_paths = [
-            (name if folder is None else folder + "/" + name).lower()
-            for folder, name in service_paths
-        ]
-        service_paths = set(service_paths)
+            return
+        count = 0
         for path, folder, name in self.history:
+            if not self.__in_shard(folder, name):
+                continue
             if path is None:
                 # check if folder/name matches what would come from one of
                 # our mxds, if so, then keep it.
                 service_path = (name if folder is None else folder + "/" + name).lower()
                 if service_path not in service_paths:
-                    docs.append(
-                        Doc(
-                            path, folder=folder, service_name=name, config=self.__config
-                        )
+                    count += 1
+                    yield DocRecord(
+                        path, folder=folder, service_name=name, config=self.__config
                     )
             else:
-                if path not in source_paths:
-                    docs.append(
-                        Doc(
-                            path, folder=folder, service_name=name, config=self.__config
-                        )
+                if service_lists.normalize_path(path) not in source_paths:
+                    count += 1
+                    yield DocRecord(
+                        path, folder=folder, service_name=name, config=self.__config
                     )
-        logger.debug("Found %s documents to UN-publish", len(docs))
-        return docs
-
+        logger.debug("Found %s documents to UN-publish", count)
+
+    def __planned_records(self):
+        """Generate (DocRecord, skip) for the documents in the root_directory and the
+        service_list, with the settings in the service_list for each. The records are
+        made as they are needed, not all at once."""
+        found = set()
+        for folder, mxd in self.__filesystem_mxds:
+            found.add(service_lists.normalize_path(mxd))
+            entry = None
+            if self.service_list is not None:
+                folder_name, name = util.service_path(mxd, folder)
+                entry = self.service_list.find(
+                    mxd, service_lists.service_path_key(folder_name, name)
+                )
+            yield self.__record(mxd, folder, entry)
+        if self.service_list is not None:
+            for entry in self.service_list.sources():
+                if service_lists.normalize_path(entry.source_path) not in found:
+                    yield self.__record(entry.source_path, None, entry)
+
+    def __record(self, path, folder, entry):
+        """Return (DocRecord, skip) for the document at path in folder (the subfolder
+        of root_directory or None), with the settings in entry (may be None)."""
+        if entry is None:
+            return DocRecord(path, folder=folder, config=self.__config), False
+        record = DocRecord(
+            path,
+            folder=entry.folder or folder,
+            service_name=entry.name,
+            config=self.__config,
+            settings=dict(entry.settings),
+            image_service=entry.image_service,
+            force=entry.force,
+            priority=entry.priority,
+        )
+        return record, entry.skip
+
+    def __in_shard(self, folder, name):
+        """Return True if the service folder/name is processed by this shard."""
+        folder = util.sanitize_service_name(folder)
+        name = util.sanitize_service_name(name)
+        service_path = name if folder is None else folder + "/" + name
+        return self.__in_shard_path(service_path)
+
+    def __in_shard_path(self, service_path):
+        """Return True if the service_path is processed by this shard."""
+        if self.__shard is None:
+            return True
+        index, count = self.__shard
+        return util.shard_index(service_path, count) == index - 1
+
+    @tracing.traced("discover")
     def __get_filesystem_mxds(self):
         """Looks in the filesystem for map documents to publish
         creates a private list of (folder,fullpath) for each mxd found"""
@@ -238,6 +296,7 @@ class Documents(object):
                 mxds += [(folder, mxd) for mxd in self.__find_mxds_in_folder(path)]
         return mxds
 
+    @tracing.traced("history")
     def __get_history_from_server(self):
         """Get a list of services on the server provided in the configuration settings"""
         server = None
@@ -295,31 +354,6 @@ class Documents(object):
             logger.warning("Unable to parse the file %s: %s", path, ex)
             return None
 
-    @staticmethod
-    def __get_server_list_from_file(path):
-        """Read a list of services to publish from a csv file.
-
-        The first row of the file will be skipped (assumed to be a header row).
-        The file must have at least X columns which will be interpreted as text for ..."""
-
-        # TODO: define the service list file format
-        try:
-            services = []
-            with Documents.__open_csv(path, "r") as csv_file:
-                csv_reader = csv.reader(csv_file)
-                header = csv_reader.next()
-                # We do not need to decode the binary Python 2 header.
-                if len(header) < 3:
-                    raise IndexError("file does not have at least 3 rows")
-                for row in csv_reader:
-                    if sys.version_info[0] < 3:
-                        row = [s.decode("utf-8") for s in row]
-                    services.append(row[:3])
-            return services
-        except Exception as ex:
-            logger.warning("Unable to parse the file %s: %s", path, ex)
-            return None
-
     @staticmethod
     def __open_csv(filename, mode):
         """Open a file for CSV mode that is compatible with unicode and Python 2/3"""
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Share the draft service definition of a document with its identical copies.
+
+The same map document is often copied into several folders of the
+root_directory, to publish it in several service folders. Creating and
+analyzing a draft (arcpy.mapping.CreateMapSDDraft) is the slowest part of
+publishing, and the result for each copy differs only in the service name and
+folder in the manifest.
+
+Copies are planned before the run: the documents to publish that have the same
+size are read, and the ones with the same SHA-1 of their content are copies.
+Only the copies get a template, keyed by the SHA-1, the data sources (resolved
+by arcpy; identical documents with relative paths may use different data) and
+the server, summary and tags. The first copy to be drafted in a run saves its
+(unmodified) draft, analysis results and data sources in a DraftTemplate; each
+of the other copies writes the template with its own name and folder (see
+patch_manifest()), and continues from there (pooling settings, replacement,
+staging) as if it had created the draft itself. If the name or folder can not be
+found in the manifest, the copy is drafted from its source as usual.
+
+The templates are kept in memory until the last planned copy is drafted, or
+finishes without a draft (i.e. it failed the preflight checks, see done()), or
+the run ends (see free()); nothing is saved.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import copy
+import hashlib
+from io import open
+import logging
+import os
+import threading
+import xml.dom.minidom
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# Elements in the manifest with the service name (if their parent is one of these)
+NAME_TAGS = ("Name", "Title")
+NAME_PARENTS = ("SVCManifest", "SVCConfiguration", "ItemInfo")
+
+# Elements in the manifest with the service folder
+FOLDER_TAGS = ("Folder", "FolderName", "ServerFolderName")
+
+READ_SIZE = 1024 * 1024
+
+
+class DraftTemplates(object):
+    """The draft templates of a run, one for each distinct document with copies."""
+
+    def __init__(self, paths):
+        """paths are the documents that will be drafted in the run."""
+        self.__lock = threading.Lock()
+        self.__templates = {}
+        self.__digests = {}  # (path, mtime, size): digest
+        self.__copies = {}  # digest: number of planned documents
+        self.__remaining = {}  # digest: planned documents not yet drafted
+        self.__finished = set()  # the (path, mtime, size) of drafted documents
+        self.__documents = 0
+        self.__plan(paths)
+
+    def has_copies(self, path):
+        """Return True if there are planned copies of the document at path."""
+        digest = self.__digests.get(_file_key(path))
+        return digest is not None and self.__copies[digest] > 1
+
+    def template(self, path, *properties):
+        """Return the DraftTemplate for the document at path, shared with the copies
+        of the document with the same properties (i.e. data sources, server,
+        summary and tags). Call release() when the document is drafted.
+
+        Returns None if the document has no planned copies."""
+        with self.__lock:
+            self.__documents += 1
+            if not self.has_copies(path):
+                return None
+            digest = self.__digests[_file_key(path)]
+            key = (digest,) + tuple(properties)
+            if key not in self.__templates:
+                self.__templates[key] = DraftTemplate(path, digest)
+            self.__finish(path)
+            template = self.__templates[key]
+            template.documents += 1
+            template.users += 1
+            return template
+
+    def release(self, template):
+        """Free the templates of a document after its last planned copy is drafted."""
+        with self.__lock:
+            template.users -= 1
+            if self.__remaining[template.digest] > 0:
+                return
+            self.__free(template.digest)
+
+    def done(self, path):
+        """Record that the document at path is finished with (drafted or not, i.e. it
+        was up to date, or failed before it was drafted), so the templates are freed
+        once all its planned copies are done."""
+        with self.__lock:
+            digest = self.__finish(path)
+            if digest is not None and self.__remaining[digest] <= 0:
+                self.__free(digest)
+
+    def free(self):
+        """Free all the templates (i.e. at the end of the run, when the copies that
+        were deferred will not be drafted)."""
+        with self.__lock:
+            for template in self.__templates.values():
+                template.free()
+
+    def summary(self):
+        """Return a dictionary of the number of documents, drafts and shared drafts."""
+        with self.__lock:
+            templates = list(self.__templates.values())
+            documents = self.__documents
+        return {
+            "documents": documents,
+            "drafted": sum(1 for template in templates if template.drafted),
+            "shared": sum(template.shared for template in templates),
+        }
+
+    def __finish(self, path):
+        """Count the document at path as drafted (once). Returns its digest, or None
+        if it has no planned copies. The caller holds the lock."""
+        file_key = _file_key(path)
+        digest = self.__digests.get(file_key)
+        if digest is None or file_key in self.__finished:
+            return digest
+        self.__finished.add(file_key)
+        self.__remaining[digest] -= 1
+        return digest
+
+    def __free(self, digest):
+        """Free the templates for digest that are not in use. The caller holds the
+        lock."""
+        for template in self.__templates.values():
+            if template.digest == digest and template.users <= 0:
+                template.free()
+
+    def __plan(self, paths):
+        """Find the copies in paths; only documents with the same size are read."""
+        by_size = {}
+        for path in paths:
+            file_key = _file_key(path)
+            if file_key is not None:
+                by_size.setdefault(file_key[2], set()).add(file_key)
+        for file_keys in by_size.values():
+            if len(file_keys) < 2:
+                continue
+            for file_key in file_keys:
+                try:
+                    digest = content_digest(file_key[0])
+                except (IOError, OSError) as ex:
+                    logger.debug("Unable to read %s: %s", file_key[0], ex)
+                    continue
+                self.__digests[file_key] = digest
+                self.__copies[digest] = self.__copies.get(digest, 0) + 1
+        self.__remaining = dict(self.__copies)
+        logger.info(
+            "Found %s documents with copies",
+            sum(1 for count in self.__copies.values() if count > 1),
+        )
+
+
+class DraftTemplate(object):
+    """The draft, analysis results and data sources of the first copy of a document.
+
+    Hold the lock while checking for (and creating) the draft, so that copies that
+    are published at the same time wait for the first one rather than repeat it."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, source, digest=None):
+        self.source = source
+        self.digest = digest
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.users = 0  # documents that have the template, and are not drafted
+        self.shared = 0
+        self.drafted = False
+        self.draft = None  # the contents of the draft file
+        self.__name = None
+        self.__folder = None
+        self.__analysis = None
+        self.__data_sources = None
+
+    @property
+    def analysis(self):
+        """Return a copy of the (simplified) analysis results of the draft."""
+        return copy.deepcopy(self.__analysis)
+
+    @property
+    def data_sources(self):
+        """Return a copy of the list of data sources in the document (or None)."""
+        if self.__data_sources is None:
+            return None
+        return list(self.__data_sources)
+
+    def save(self, draft_path, name, folder, analysis, data_sources):
+        """Keep the draft at draft_path (for the service folder/name) and its results."""
+        try:
+            with open(draft_path, "rb") as in_file:
+                self.draft = in_file.read()
+        except (IOError, OSError) as ex:
+            logger.warning("Unable to keep the draft %s: %s", draft_path, ex)
+            return
+        self.source = draft_path
+        self.__name = name
+        self.__folder = folder
+        self.__analysis = copy.deepcopy(analysis)
+        self.__data_sources = None if data_sources is None else list(data_sources)
+        self.drafted = True
+
+    def free(self):
+        """Drop the draft and its results (there are no more copies to draft)."""
+        self.draft = None
+        self.__analysis = None
+        self.__data_sources = None
+
+    def apply(self, draft_path, name, folder):
+        """Write the draft for the service folder/name to draft_path.
+
+        Returns False if there is no draft, or it could not be changed."""
+        if self.draft is None:
+            return False
+        try:
+            x_doc = xml.dom.minidom.parseString(self.draft)
+        except Exception as ex:
+            logger.warning("Unable to read the draft from %s: %s", self.source, ex)
+            return False
+        try:
+            if not patch_manifest(x_doc, (self.__name, self.__folder), (name, folder)):
+                logger.info(
+                    "Unable to find the service name and folder in the draft from %s",
+                    self.source,
+                )
+                return False
+            with open(draft_path, "wb") as out_file:
+                out_file.write(x_doc.toxml(encoding="utf-8"))
+        except (IOError, OSError) as ex:
+            logger.warning("Unable to write the draft %s: %s", draft_path, ex)
+            return False
+        finally:
+            x_doc.unlink()
+        self.shared += 1
+        return True
+
+
+def _file_key(path):
+    """Return (path, mtime, size) for the file at path, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (path, stat.st_mtime, stat.st_size)
+
+
+def content_digest(path):
+    """Return the SHA-1 (hex) of the contents of the file at path."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as in_file:
+        chunk = in_file.read(READ_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = in_file.read(READ_SIZE)
+    return digest.hexdigest()
+
+
+def patch_manifest(x_doc, old, new):
+    """Replace the service (name, folder) old with new in a parsed draft.
+
+    Returns False if the name is not found, or the folder changed but is not found."""
+    old_name, old_folder = old
+    new_name, new_folder = new
+    found_name = found_folder = False
+    for node in x_doc.getElementsByTagName("*"):
+        if node.tagName in NAME_TAGS and node.parentNode.tagName in NAME_PARENTS:
+            if _text(node) == old_name:
+                _set_text(x_doc, node, new_name)
+                found_name = found_name or node.tagName == "Name"
+        elif node.tagName in FOLDER_TAGS:
+            if _text(node) == (old_folder or ""):
+                _set_text(x_doc, node, new_folder or "")
+                found_folder = True
+    return found_name and (found_folder or old_folder == new_folder)
+
+
+def _text(node):
+    return "".join(
+        child.data for child in node.childNodes if child.nodeType == child.TEXT_NODE
+    )
+
+
+def _set_text(x_doc, node, text):
+    for child in list(node.childNodes):
+        node.removeChild(child)
+    if text:
+        node.appendChild(x_doc.createTextNode(text))
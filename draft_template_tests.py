@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for sharing drafts between identical documents.
+
+Run with: python -m pytest draft_template_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import os
+import shutil
+import tempfile
+import xml.dom.minidom
+
+from draft_template import DraftTemplate, DraftTemplates
+
+DRAFT = """<?xml version="1.0" encoding="utf-8"?>
+<SVCManifest>
+  <Name>Roads</Name>
+  <Type>esriServiceDefinitionType_New</Type>
+  <Configurations>
+    <SVCConfiguration>
+      <Name>Roads</Name>
+      <FolderName>Transport</FolderName>
+      <Definition><TypeName>MapServer</TypeName></Definition>
+    </SVCConfiguration>
+  </Configurations>
+  <ItemInfo><Title>Roads</Title><Snippet>Roads</Snippet></ItemInfo>
+</SVCManifest>
+"""
+
+
+def write(path, text):
+    """Write text to a new file at path."""
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write(text)
+
+
+def element_text(path, parent, tag):
+    """Return the text of the tag in parent in the XML file at path."""
+    x_doc = xml.dom.minidom.parse(path)
+    for node in x_doc.getElementsByTagName(tag):
+        if node.parentNode.tagName == parent:
+            return node.firstChild.data if node.firstChild else ""
+    return None
+
+
+def test_copies_share_a_template():
+    """Identical documents (with the same properties) share a template."""
+    folder = tempfile.mkdtemp()
+    try:
+        names = ("a.mxd", "b.mxd", "c.mxd", "d.mxd")
+        paths = [os.path.join(folder, name) for name in names]
+        write(paths[0], "map")
+        write(paths[1], "map")
+        write(paths[2], "another map")
+        write(paths[3], "mop")  # the same size, different content
+        templates = DraftTemplates(paths)
+        assert templates.has_copies(paths[0])
+        assert not templates.has_copies(paths[2])
+        assert not templates.has_copies(paths[3])
+        first = templates.template(paths[0], "server.ags", "summary")
+        assert templates.template(paths[1], "server.ags", "summary") is first
+        assert templates.template(paths[1], "other.ags", "summary") is not first
+        assert templates.template(paths[2], "server.ags", "summary") is None
+        assert templates.template(os.path.join(folder, "missing.mxd")) is None
+        assert templates.summary()["documents"] == 5
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_template_freed_after_last_copy():
+    """A template keeps its draft until the last planned copy is drafted."""
+    folder = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(folder, name) for name in ("a.mxd", "b.mxd")]
+        write(paths[0], "map")
+        write(paths[1], "map")
+        draft = os.path.join(folder, "a.sddraft")
+        write(draft, DRAFT)
+        templates = DraftTemplates(paths)
+        first = templates.template(paths[0], "c:/roads.shp")
+        first.save(draft, "Roads", "Transport", {}, ["c:/roads.shp"])
+        templates.release(first)
+        assert first.draft is not None
+        second = templates.template(paths[1], "c:/roads.shp")
+        assert second is first
+        assert second.apply(os.path.join(folder, "b.sddraft"), "B", "Transport")
+        templates.release(second)
+        assert first.draft is None and first.data_sources is None
+        assert templates.summary() == {"documents": 2, "drafted": 1, "shared": 1}
+
+        print("test a copy that is not drafted frees the template")
+        templates = DraftTemplates(paths)
+        first = templates.template(paths[0], "c:/roads.shp")
+        first.save(draft, "Roads", "Transport", {}, ["c:/roads.shp"])
+        templates.release(first)
+        templates.done(paths[0])
+        assert first.draft is not None
+        templates.done(paths[1])
+        assert first.draft is None
+
+        print("test the templates are freed at the end of the run")
+        templates = DraftTemplates(paths)
+        first = templates.template(paths[0], "c:/roads.shp")
+        first.save(draft, "Roads", "Transport", {}, ["c:/roads.shp"])
+        templates.release(first)
+        assert first.draft is not None
+        templates.free()
+        assert first.draft is None
+
+        print("test copies with different data sources do not share a template")
+        templates = DraftTemplates(paths)
+        first = templates.template(paths[0], "c:/a/roads.shp")
+        assert templates.template(paths[1], "c:/b/roads.shp") is not first
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_apply_patches_name_and_folder():
+    """The template is written with the name and folder of each copy."""
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "Roads.mxd")
+        write(mxd, "map")
+        first_draft = os.path.join(folder, "first.sddraft")
+        write(first_draft, DRAFT)
+        template = DraftTemplate(mxd)
+        copy_draft = os.path.join(folder, "copy.sddraft")
+        assert not template.apply(copy_draft, "Roads", "Maintenance")
+        analysis = {"warnings": [{"text": "No metadata", "code": 1, "layers": []}]}
+        template.save(first_draft, "Roads", "Transport", analysis, ["c:/roads.shp"])
+
+        assert template.apply(copy_draft, "Streets", "Maintenance")
+        print(open(copy_draft, encoding="utf-8").read())
+        assert element_text(copy_draft, "SVCManifest", "Name") == "Streets"
+        assert element_text(copy_draft, "SVCConfiguration", "Name") == "Streets"
+        assert element_text(copy_draft, "SVCConfiguration", "FolderName") == (
+            "Maintenance"
+        )
+        assert element_text(copy_draft, "ItemInfo", "Title") == "Streets"
+        assert element_text(copy_draft, "ItemInfo", "Snippet") == "Roads"
+        assert template.analysis == analysis
+        assert template.analysis is not template.analysis
+        assert template.data_sources == ["c:/roads.shp"]
+        assert template.shared == 1
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_apply_fails_without_folder():
+    """A draft without a folder element can not be moved to another folder."""
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "Roads.mxd")
+        write(mxd, "map")
+        first_draft = os.path.join(folder, "first.sddraft")
+        write(first_draft, DRAFT.replace("<FolderName>Transport</FolderName>", ""))
+        template = DraftTemplate(mxd)
+        template.save(first_draft, "Roads", "Transport", {}, None)
+        copy_draft = os.path.join(folder, "copy.sddraft")
+        assert not template.apply(copy_draft, "Roads", "Maintenance")
+        assert template.apply(copy_draft, "Streets", "Transport")
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_copies_share_a_template()
+    test_template_freed_after_last_copy()
+    test_apply_patches_name_and_folder()
+    test_apply_fails_without_folder()
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Publish each document to several ArcGIS Servers (targets) at once.
+
+A document is drafted and analyzed once. A service definition is staged for at
+most two variants: 'new' (for targets without the service) and 'replacement'
+(for targets with the service), which differ only in the SVCManifest Type of the
+draft. The service definition is then uploaded to all the targets (one thread
+per target). A failure on one target does not stop the uploads to the other
+targets. arcpy is not thread safe, so the arcpy uploads are made one at a time
+(see Doc.upload()), while the rest of each target's work (the catalog and the
+record of the upload) overlaps; staging is kept apart from the uploads (see
+stage() and upload()).
+
+Whether a service exists on a target is decided with a snapshot of the target's
+catalog taken when the FanOut is created (and updated after each upload), not
+with a catalog query for each document. The service definition uploaded to each
+target is recorded (see uploads.py), so a target that failed is uploaded to on
+the next run, even though the service definition is no longer new.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import os
+import threading
+import time
+
+import uploads
+import util
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+
+class Target(object):
+    """An ArcGIS Server to publish to."""
+
+    def __init__(self, server, name=None, server_url=None):
+        """server is the path to a connection (*.ags) file for the server.
+        name defaults to the name of the connection file, and server_url defaults
+        to the URL in the connection file."""
+        self.server = server
+        if name is None:
+            name = os.path.splitext(os.path.basename(server))[0]
+        self.name = name
+        if server_url is None:
+            server_url = util.get_service_url_from_ags_file(server)
+        self.server_url = server_url
+
+    def __repr__(self):
+        return "Target({0!r}, name={1!r})".format(self.server, self.name)
+
+
+def parse_target(text):
+    """Return a Target for text like 'prod=c:/connections/prod.ags' or 'c:/prod.ags'."""
+    name = None
+    if "=" in text:
+        name, text = text.split("=", 1)
+        name = name.strip() or None
+    return Target(text.strip(), name=name)
+
+
+def target_server(text):
+    """Return the connection file of the target in text (see parse_target), without
+    reading it."""
+    return text.split("=", 1)[-1].strip()
+
+
+def variants(source_path):
+    """Return the paths of the service definitions staged for a document (see
+    Doc.stage())."""
+    base = os.path.splitext(source_path)[0]
+    return [base + ".new.sd", base + ".replacement.sd"]
+
+
+class CatalogSnapshot(object):
+    """The (lower case) service paths on a target."""
+
+    def __init__(self, server_url):
+        self.__server_url = server_url
+        self.__services = None
+        self.refresh()
+
+    @property
+    def is_known(self):
+        """Return True if the catalog was read from the server."""
+        return self.__services is not None
+
+    def refresh(self):
+        """Read the list of services from the server."""
+        self.__services = None
+        if self.__server_url is None:
+            return
+        services = util.get_services_from_server(self.__server_url)
+        if services is None:
+            return
+        self.__services = set()
+        for folder, service in services:
+            try:
+                # In a folder, the service name includes the folder.
+                name = service["name"]
+            except (TypeError, KeyError):
+                name = "{0}".format(service)
+                if folder is not None:
+                    name = folder + "/" + name
+            self.__services.add(name.lower())
+
+    def contains(self, service_path):
+        """Return True if service_path is on the server.
+
+        If the catalog is unknown, assume it is (a replacement is safer than a new)."""
+        if self.__services is None:
+            return True
+        return (service_path or "").lower() in self.__services
+
+    def add(self, service_path):
+        """Record that service_path was published to the server."""
+        if self.__services is not None:
+            self.__services.add((service_path or "").lower())
+
+
+class FanOut(object):
+    """Stages documents once and uploads them to several targets."""
+
+    def __init__(self, targets, max_workers=None):
+        """targets is a list of Target. max_workers limits the number of concurrent
+        uploads (the default is one per target)."""
+        self.__targets = targets
+        self.__limit = threading.BoundedSemaphore(max_workers or len(targets) or 1)
+        self.__snapshots = {}
+        for target in targets:
+            self.__snapshots[target.name] = CatalogSnapshot(target.server_url)
+            if not self.__snapshots[target.name].is_known:
+                logger.warning(
+                    "Unable to read the catalog of %s; assuming services exist",
+                    target.name,
+                )
+
+    @property
+    def targets(self):
+        """Return the list of targets."""
+        return self.__targets
+
+    def publish(self, doc, force=False, dry_run=False):
+        """Publish doc to all the targets.
+
+        Returns a dictionary of {target name: {"status": text, "seconds": number,
+        "message": text or None}}. Status is one of 'published', 'up_to_date',
+        'not_publishable', 'failed', or 'dry_run'."""
+        staging = self.stage(doc, force=force, dry_run=dry_run)
+        return self.upload(doc, staging, force=force, dry_run=dry_run)
+
+    def stage(self, doc, force=False, dry_run=False):
+        """Stage the variants of doc needed by the targets.
+
+        When documents are published concurrently (see mutation_scheduler.py) this
+        is called on the main thread, and upload() on a worker. Returns the staging
+        to pass to upload()."""
+        staging = {"start": time.time(), "plan": {}, "staged": {}, "results": {}}
+        results = staging["results"]
+        plan = staging["plan"]
+        for target in self.__targets:
+            plan[target.name] = self.__snapshots[target.name].contains(doc.service_path)
+
+        # Variants staged since the document last changed need no arcpy at all
+        needed = []
+        for replacement in sorted(set(plan.values())):
+            service_definition = None if force else doc.staged_file(replacement)
+            if service_definition is None:
+                needed.append(replacement)
+            else:
+                staging["staged"][replacement] = (service_definition, False)
+        if not needed:
+            return staging
+
+        if not doc.is_publishable:
+            for target in self.__targets:
+                results[target.name] = _result(
+                    "not_publishable", time.time() - staging["start"], doc.errors
+                )
+            return staging
+
+        for replacement in needed:
+            if dry_run:
+                staging["staged"][replacement] = (None, True)
+                continue
+            try:
+                staging["staged"][replacement] = doc.stage(
+                    replacement=replacement, force=force
+                )
+            except Exception as ex:
+                logger.error("Unable to stage %s: %s", doc.name, ex)
+                for name, is_live in plan.items():
+                    if is_live == replacement:
+                        results[name] = _result(
+                            "failed", time.time() - staging["start"], ex
+                        )
+        return staging
+
+    def upload(self, doc, staging, force=False, dry_run=False):
+        """Upload the service definitions staged by stage() to the targets that need
+        them. Returns the results (see publish())."""
+        start = staging["start"]
+        results = dict(staging["results"])
+
+        # Upload to each target (that needs it) in its own thread
+        threads = []
+        for target in self.__targets:
+            if target.name in results:
+                continue
+            is_live = staging["plan"][target.name]
+            service_definition, is_new = staging["staged"][is_live]
+            uploaded = _is_uploaded(doc, target.server, service_definition, is_new)
+            if not force and uploaded and is_live:
+                results[target.name] = _result("up_to_date", time.time() - start)
+                continue
+            if dry_run:
+                variant = "a replacement" if is_live else "a new"
+                print(
+                    "{0} would be uploaded to {1} as {2} service".format(
+                        doc.service_path, target.name, variant
+                    )
+                )
+                results[target.name] = _result("dry_run", time.time() - start)
+                continue
+            thread = threading.Thread(
+                target=self.__upload,
+                args=(doc, target, service_definition, results),
+                name="upload-" + target.name,
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def __upload(self, doc, target, service_definition, results):
+        """Upload service_definition to target, and save the outcome in results."""
+        with self.__limit:
+            start = time.time()
+            try:
+                doc.upload(service_definition, target.server)
+            except Exception as ex:
+                logger.error(
+                    "Unable to publish %s to %s: %s", doc.name, target.name, ex
+                )
+                results[target.name] = _result("failed", time.time() - start, ex)
+                return
+            uploads.record(doc.path, target.server, service_definition)
+            snapshot = self.__snapshots[target.name]
+            snapshot.add(doc.service_path)
+            results[target.name] = _result("published", time.time() - start)
+
+
+def _is_uploaded(doc, server, service_definition, is_new):
+    """Return True if service_definition, or the other variant (staged from the same
+    draft), was the last service definition uploaded to server.
+
+    Without a record of the uploads (published by an older version), a service
+    definition that is not new is assumed to be uploaded."""
+    if is_new:
+        return False
+    if uploads.is_current(doc.path, server, service_definition) is not False:
+        return True
+    # i.e. a new service was created on the last run; it is now a replacement.
+    other = _other_variant(service_definition)
+    if other is None or not uploads.is_current(doc.path, server, other):
+        return False
+    try:
+        return os.path.getmtime(doc.path) < os.path.getmtime(other)
+    except OSError:
+        return False
+
+
+def _other_variant(service_definition):
+    """Return the path of the other variant of service_definition (see Doc.stage())."""
+    for variant, other in (
+        (".new.sd", ".replacement.sd"),
+        (".replacement.sd", ".new.sd"),
+    ):
+        if service_definition.endswith(variant):
+            return service_definition[: -len(variant)] + other
+    return None
+
+
+def _result(status, seconds, message=None):
+    if message is not None:
+        message = "{0}".format(message)
+    return {"status": status, "seconds": seconds, "message": message}
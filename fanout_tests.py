@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for publishing a document to several servers at once.
+
+Run with: python -m pytest fanout_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+
+from fanout import FanOut, Target
+import http_replay
+import rest
+import uploads
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+
+class FakeCatalogs(object):
+    """A transport with the catalog of each server: {server_url: [service names]}."""
+
+    def __init__(self, catalogs):
+        self.catalogs = catalogs
+
+    def request(self, method, url, **kwargs):
+        """Return the root folder of the catalog for the server in url."""
+        # pylint: disable=unused-argument
+        server_url = url.split("/rest/services")[0]
+        services = [
+            {"name": name, "type": "MapServer"} for name in self.catalogs[server_url]
+        ]
+        body = json.dumps({"folders": [], "services": services})
+        return http_replay.ReplayResponse(200, body, url, "application/json")
+
+
+class FakeDoc(object):
+    """A publishable document that stages service definitions without arcpy."""
+
+    def __init__(self, path, failing=()):
+        self.path = path
+        self.name = self.service_path = "Roads"
+        self.errors = None
+        self.failing = failing
+        self.checked = 0
+        self.staged = []
+        self.uploaded = []
+
+    @property
+    def is_publishable(self):
+        """Count the checks (which draft and analyze with arcpy)."""
+        self.checked += 1
+        return True
+
+    def staged_file(self, replacement=False):
+        """Return the staged variant, if it exists."""
+        sd_file = self.sd_file(replacement)
+        return sd_file if os.path.exists(sd_file) else None
+
+    def sd_file(self, replacement):
+        """Return the service definition file of the variant."""
+        variant = "replacement" if replacement else "new"
+        return os.path.splitext(self.path)[0] + "." + variant + ".sd"
+
+    def stage(self, replacement=False, force=False):
+        """Stage the variant (once, unless forced) beside the document."""
+        variant = "replacement" if replacement else "new"
+        sd_file = self.sd_file(replacement)
+        if os.path.exists(sd_file) and not force:
+            return sd_file, False
+        with open(sd_file, "w", encoding="utf-8") as out_file:
+            out_file.write("{0} {1}".format(variant, len(self.staged)))
+        self.staged.append(variant)
+        return sd_file, True
+
+    def upload(self, service_definition, server):
+        """Upload to server, unless it is failing."""
+        if server in self.failing:
+            raise IOError("{0} is unavailable".format(server))
+        self.uploaded.append((os.path.basename(service_definition), server))
+
+
+def targets():
+    """Return a dev and prod target with the service, and a test target without."""
+    return [
+        Target("dev.ags", server_url="https://dev/arcgis"),
+        Target("prod.ags", server_url="https://prod/arcgis"),
+        Target("test.ags", server_url="https://test/arcgis"),
+    ]
+
+
+def statuses(results):
+    """Return {target name: status}."""
+    return dict((name, result["status"]) for name, result in results.items())
+
+
+def test_failed_target_is_uploaded_on_the_next_run():
+    """Each target is up to date (or not) by the service definition uploaded to it,
+    not by whether the shared service definition is new."""
+    folder = tempfile.mkdtemp()
+    catalogs = {
+        "https://dev/arcgis": ["Roads"],
+        "https://prod/arcgis": ["Roads"],
+        "https://test/arcgis": [],
+    }
+    previous = rest.set_transport(FakeCatalogs(catalogs))
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        with open(mxd, "w", encoding="utf-8") as out_file:
+            out_file.write("map")
+        os.utime(mxd, (1000, 1000))
+
+        print("test run 1; prod fails")
+        doc = FakeDoc(mxd, failing=("prod.ags",))
+        results = FanOut(targets()).publish(doc)
+        assert statuses(results) == {
+            "dev": "published",
+            "prod": "failed",
+            "test": "published",
+        }
+        assert sorted(doc.staged) == ["new", "replacement"]
+        # The new service on test is a replacement from now on.
+        catalogs["https://test/arcgis"].append("Roads")
+
+        print("test run 2; only prod is uploaded")
+        doc = FakeDoc(mxd)
+        results = FanOut(targets()).publish(doc)
+        assert statuses(results) == {
+            "dev": "up_to_date",
+            "prod": "published",
+            "test": "up_to_date",
+        }
+        assert doc.staged == []
+        assert doc.checked == 0
+        assert doc.uploaded == [("roads.replacement.sd", "prod.ags")]
+
+        print("test run 3; forced")
+        doc = FakeDoc(mxd)
+        results = FanOut(targets()).publish(doc, force=True)
+        assert set(statuses(results).values()) == set(["published"])
+    finally:
+        rest.set_transport(previous)
+        shutil.rmtree(folder)
+
+
+def test_stage_apart_from_upload():
+    """All the staging is done by stage(); upload() only uploads."""
+    folder = tempfile.mkdtemp()
+    catalogs = {"https://dev/arcgis": ["Roads"], "https://test/arcgis": []}
+    previous = rest.set_transport(FakeCatalogs(catalogs))
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        with open(mxd, "w", encoding="utf-8") as out_file:
+            out_file.write("map")
+        os.utime(mxd, (1000, 1000))
+        fan_out = FanOut(
+            [
+                Target("dev.ags", server_url="https://dev/arcgis"),
+                Target("test.ags", server_url="https://test/arcgis"),
+            ]
+        )
+        doc = FakeDoc(mxd)
+        staging = fan_out.stage(doc)
+        assert sorted(doc.staged) == ["new", "replacement"]
+        assert doc.uploaded == []
+        results = fan_out.upload(doc, staging)
+        assert statuses(results) == {"dev": "published", "test": "published"}
+        assert sorted(doc.staged) == ["new", "replacement"]
+        assert sorted(doc.uploaded) == [
+            ("roads.new.sd", "test.ags"),
+            ("roads.replacement.sd", "dev.ags"),
+        ]
+    finally:
+        rest.set_transport(previous)
+        shutil.rmtree(folder)
+
+
+def test_unrecorded_uploads():
+    """Without a record of the uploads, a live service with an older service
+    definition is up to date, and a new service definition is uploaded."""
+    folder = tempfile.mkdtemp()
+    previous = rest.set_transport(FakeCatalogs({"https://dev/arcgis": ["Roads"]}))
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        with open(mxd, "w", encoding="utf-8") as out_file:
+            out_file.write("map")
+        fan_out = FanOut([Target("dev.ags", server_url="https://dev/arcgis")])
+        results = fan_out.publish(FakeDoc(mxd), dry_run=True)
+        assert statuses(results) == {"dev": "dry_run"}
+        FakeDoc(mxd).stage(replacement=True)
+        assert statuses(fan_out.publish(FakeDoc(mxd))) == {"dev": "up_to_date"}
+        assert not os.path.exists(uploads.path_for(mxd))
+    finally:
+        rest.set_transport(previous)
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_failed_target_is_uploaded_on_the_next_run()
+    test_stage_apart_from_upload()
+    test_unrecorded_uploads()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+A fingerprint of the inputs to a publishing run, to skip runs with nothing to do.
+
+The fingerprint is a hash of:
+  * the modification time and number of entries of the root directory and each
+    of its sub folders (adding, removing or renaming a document changes these),
+  * the modification time and size of each map document (editing one in place
+    does not change its folder),
+  * the modification time and size of the service_list and history_file,
+  * the list of services on the server (a cheap catalog checksum).
+If the fingerprint matches the one saved after the last successful run, and no
+data source in the dependency index has changed, there is nothing to do.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import hashlib
+import json
+import logging
+import os
+
+import util
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+DOCUMENT_EXTENSIONS = (".mxd",)
+
+
+def compute(root_directory, files=None, server_url=None):
+    """Return a fingerprint (hex digest) of the root_directory tree, files and server.
+
+    files is a list of additional file paths (i.e. the service_list).
+    server_url may be a list of URLs (when publishing to several servers).
+    Returns None if a server catalog could not be read."""
+    digest = hashlib.sha1()
+    if root_directory is not None and os.path.isdir(root_directory):
+        _add_folder(digest, root_directory, recurse=True)
+    for path in files or []:
+        _add_file(digest, path)
+    server_urls = server_url if isinstance(server_url, list) else [server_url]
+    for url in server_urls:
+        if url is None:
+            continue
+        services = util.get_services_from_server(url)
+        if services is None:
+            return None
+        names = sorted(
+            "{0}/{1}".format(folder, _service_name(service))
+            for folder, service in services
+        )
+        _update(digest, "catalog", json.dumps(names))
+    return digest.hexdigest()
+
+
+def load(path):
+    """Return the fingerprint saved at path, or None."""
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as in_file:
+            return in_file.read().strip() or None
+    except Exception as ex:
+        logger.warning("Unable to read the fingerprint %s: %s", path, ex)
+        return None
+
+
+def save(fingerprint, path):
+    """Save the fingerprint to path."""
+    if path is None or fingerprint is None:
+        return
+    try:
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(fingerprint)
+    except Exception as ex:
+        logger.warning("Unable to save the fingerprint %s: %s", path, ex)
+
+
+def _add_folder(digest, folder, recurse=False):
+    try:
+        names = sorted(os.listdir(folder))
+        _update(digest, folder, os.path.getmtime(folder), len(names))
+    except OSError as ex:
+        _update(digest, folder, "error", ex)
+        return
+    for name in names:
+        path = os.path.join(folder, name)
+        if os.path.splitext(name)[1].lower() in DOCUMENT_EXTENSIONS:
+            _add_file(digest, path)
+        elif recurse and os.path.isdir(path):
+            # Documents are only found in the root and its (first level) sub folders.
+            _add_folder(digest, path)
+
+
+def _add_file(digest, path):
+    if path is None:
+        return
+    try:
+        stat = os.stat(path)
+        _update(digest, path, stat.st_mtime, stat.st_size)
+    except OSError:
+        _update(digest, path, "missing")
+
+
+def _service_name(service):
+    """Services are dictionaries in a folder, but may be names in the root."""
+    try:
+        return "{0}.{1}".format(service["name"], service["type"])
+    except (TypeError, KeyError):
+        return "{0}".format(service)
+
+
+def _update(digest, *values):
+    text = "|".join("{0!r}".format(value) for value in values) + "\n"
+    digest.update(text.encode("utf-8"))
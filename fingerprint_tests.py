@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the fingerprint of the inputs to a publishing run.
+
+Run with: python -m pytest fingerprint_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+
+import fingerprint
+import http_replay
+import rest
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+URL = "https://gis/arcgis"
+
+
+class FakeCatalog(object):
+    """A transport for a server with services in the root and a Transport folder;
+    the folder can not be read if broken is True."""
+
+    def __init__(self, services):
+        self.services = services  # the names of the services in Transport
+        self.broken = False
+
+    def request(self, method, url, **kwargs):
+        """Answer a request for the root or Transport folder of the catalog."""
+        # pylint: disable=unused-argument
+        url = url.split("?", 1)[0]
+        if url == URL + "/rest/services":
+            body = {
+                "folders": ["Transport"],
+                "services": [{"name": "Base", "type": "MapServer"}],
+            }
+        elif url == URL + "/rest/services/Transport" and not self.broken:
+            body = {
+                "services": [
+                    {"name": "Transport/" + name, "type": "MapServer"}
+                    for name in self.services
+                ]
+            }
+        else:
+            return http_replay.ReplayResponse(500, "", url)
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+def write(path, text, mtime):
+    """Write text to path, and set its modified time."""
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def make_tree(root):
+    """Make a root_directory with a document in the root and a sub folder, and a
+    service_list beside it. Returns the path of the service_list."""
+    os.mkdir(os.path.join(root, "maps"))
+    write(os.path.join(root, "maps", "roads.mxd"), "roads", 1000)
+    write(os.path.join(root, "base.mxd"), "base", 1000)
+    service_list = os.path.join(os.path.dirname(root), "services.csv")
+    write(service_list, "source_path,service_folder", 1000)
+    return service_list
+
+
+def test_stable_and_detects_changes():
+    """The fingerprint is the same for an unchanged tree, and changes when a
+    document (in the root or a sub folder) or the service_list changes."""
+    folder = tempfile.mkdtemp()
+    try:
+        root = os.path.join(folder, "root")
+        os.mkdir(root)
+        service_list = make_tree(root)
+        first = fingerprint.compute(root, [service_list])
+        assert first == fingerprint.compute(root, [service_list])
+
+        changes = [
+            ("edit a document", os.path.join(root, "maps", "roads.mxd"), "rails"),
+            ("edit the service_list", service_list, "source_path,folder"),
+        ]
+        previous = first
+        for name, path, text in changes:
+            print("test", name)
+            write(path, text, 2000)
+            current = fingerprint.compute(root, [service_list])
+            assert current != previous, name
+            previous = current
+
+        print("test adding a document to a sub folder")
+        write(os.path.join(root, "maps", "rails.mxd"), "rails", 1000)
+        current = fingerprint.compute(root, [service_list])
+        assert current != previous
+        previous = current
+
+        print("test files in the sub folder's sub folders are not documents")
+        os.mkdir(os.path.join(root, "maps", "old"))
+        os.utime(os.path.join(root, "maps"), (3000, 3000))
+        current = fingerprint.compute(root, [service_list])
+        assert current != previous  # the sub folder changed
+        previous = current
+        write(os.path.join(root, "maps", "old", "roads.mxd"), "old", 1000)
+        os.utime(os.path.join(root, "maps"), (3000, 3000))
+        assert fingerprint.compute(root, [service_list]) == previous
+
+        print("test a missing file is part of the fingerprint")
+        missing = os.path.join(folder, "missing.csv")
+        assert fingerprint.compute(root, [missing]) != fingerprint.compute(root, [])
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_server_catalog():
+    """The services on each server are part of the fingerprint; an unreadable
+    catalog has no fingerprint (the run is not skipped)."""
+    folder = tempfile.mkdtemp()
+    catalog = FakeCatalog(["Roads"])
+    previous = rest.set_transport(catalog)
+    try:
+        first = fingerprint.compute(folder, server_url=URL)
+        assert first is not None
+        assert first == fingerprint.compute(folder, server_url=[URL])
+        assert first != fingerprint.compute(folder)
+        catalog.services.append("Rails")
+        assert first != fingerprint.compute(folder, server_url=URL)
+        catalog.broken = True
+        assert fingerprint.compute(folder, server_url=URL) is None
+    finally:
+        rest.set_transport(previous)
+        shutil.rmtree(folder)
+
+
+def test_save_and_load():
+    """A saved fingerprint is loaded; an empty one (a failed run) is None."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "fingerprint.txt")
+        assert fingerprint.load(path) is None
+        fingerprint.save("abc123", path)
+        assert fingerprint.load(path) == "abc123"
+        fingerprint.save(None, path)  # an unknown fingerprint is not saved
+        assert fingerprint.load(path) == "abc123"
+        fingerprint.save("", path)
+        assert fingerprint.load(path) is None
+        assert fingerprint.load(None) is None
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_stable_and_detects_changes()
+    test_server_catalog()
+    test_save_and_load()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Record the ReST requests of a run, and replay them without a server.
+
+A Recorder is a transport (see rest.set_transport()) that sends each request
+with another transport (by default, to the server with `requests`), and saves
+the response and the time it took, one JSON object per line:
+
+  {"method": "GET", "url": "https://server/arcgis/rest/services",
+   "params": [["f", "json"]], "status": 200, "seconds": 0.214,
+   "content_type": "application/json", "text": "{...}"}
+
+A Replayer is a transport that serves the recorded responses from that file,
+after the recorded latency (multiplied by latency_scale; 0 for no delay). A
+fraction (failure_rate) of the requests fail, with a failure_status response
+(i.e. 503), or, if failure_status is None, a connection error. This makes
+slow and failing servers reproducible for tests and benchmarks of the code that
+uses the ReST API (i.e. catalog crawls, unpublishing, the adaptive limits),
+without ArcGIS Server.
+
+Requests are matched by method, URL and parameters (from the query string, the
+params and the form data). Credentials and tokens are not saved, and are not
+part of the match. When a request was recorded more than once, the responses
+are replayed in the recorded order (and then again from the first).
+
+    rest.set_transport(http_replay.Recorder("run.jsonl"))
+    rest.set_transport(http_replay.Replayer("run.jsonl", latency_scale=2.0))
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import base64
+from io import open
+import json
+import logging
+import random
+import threading
+import time
+
+try:
+    from urllib.parse import parse_qsl, urlsplit, urlunsplit
+except ImportError:
+    from urlparse import parse_qsl, urlsplit, urlunsplit  # Python 2
+
+import rest
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# Parameters that are not saved, or used to match requests
+SECRET_PARAMETERS = ("token", "username", "password")
+REDACTED = "REDACTED"
+
+# Responses with other content types are saved as base64
+TEXT_CONTENT_TYPES = ("json", "text", "xml", "javascript")
+
+
+class Recorder(object):
+    """A transport that saves the responses (and their timing) to a file."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, path, transport=None):
+        """Responses are saved to path (replacing the file). transport sends the
+        requests (the default sends them to the server)."""
+        self.__path = path
+        self.__transport = transport or rest.RequestsTransport()
+        self.__lock = threading.Lock()
+        with open(path, "w", encoding="utf-8"):
+            pass
+
+    def request(self, method, url, **kwargs):
+        """Send the request, and save the response."""
+        start = time.time()
+        response = self.__transport.request(method, url, **kwargs)
+        seconds = time.time() - start
+        record = {
+            "method": method.upper(),
+            "url": _base_url(url),
+            "params": _parameters(url, kwargs),
+            "status": response.status_code,
+            "seconds": round(seconds, 4),
+        }
+        content_type = _content_type(response)
+        record["content_type"] = content_type
+        if any(kind in content_type for kind in TEXT_CONTENT_TYPES):
+            record["text"] = _redact(response.text)
+        else:
+            record["base64"] = base64.b64encode(response.content).decode("ascii")
+        line = json.dumps(record, sort_keys=True)
+        with self.__lock:
+            with open(self.__path, "a", encoding="utf-8") as out_file:
+                out_file.write(line + "\n")
+        return response
+
+
+class Replayer(object):
+    """A transport that serves the responses saved by a Recorder."""
+
+    # pylint: disable=too-few-public-methods,too-many-arguments
+
+    def __init__(
+        self, path, latency_scale=1.0, failure_rate=0.0, failure_status=503, seed=None
+    ):
+        self.__latency_scale = latency_scale
+        self.__failure_rate = failure_rate
+        self.__failure_status = failure_status
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__responses = {}  # key: list of records
+        self.__next = {}  # key: index of the next record to replay
+        with open(path, "r", encoding="utf-8") as in_file:
+            for line in in_file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                key = _key(record["method"], record["url"], record["params"])
+                self.__responses.setdefault(key, []).append(record)
+        logger.info(
+            "Replaying %s recorded requests from %s",
+            sum(len(records) for records in self.__responses.values()),
+            path,
+        )
+
+    def request(self, method, url, **kwargs):
+        """Return the recorded response for the request, after its latency."""
+        key = _key(method.upper(), _base_url(url), _parameters(url, kwargs))
+        with self.__lock:
+            records = self.__responses.get(key)
+            if not records:
+                raise rest.RequestException(
+                    "No recorded response for {0} {1}".format(method, _base_url(url))
+                )
+            index = self.__next.get(key, 0)
+            self.__next[key] = (index + 1) % len(records)
+            record = records[index]
+            fail = self.__random.random() < self.__failure_rate
+        delay = record["seconds"] * self.__latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            if self.__failure_status is None:
+                raise rest.RequestException(
+                    "Injected connection error for {0}".format(record["url"])
+                )
+            return ReplayResponse(
+                self.__failure_status, "Injected failure", record["url"], "text/plain"
+            )
+        if "base64" in record:
+            body = base64.b64decode(record["base64"])
+        else:
+            body = record.get("text", "")
+        return ReplayResponse(
+            record["status"], body, record["url"], record.get("content_type", "")
+        )
+
+
+class ReplayResponse(object):
+    """A stand-in for the parts of a requests.Response used by this tool."""
+
+    def __init__(self, status_code, body, url, content_type=""):
+        self.status_code = status_code
+        self.url = url
+        self.headers = {"Content-Type": content_type}
+        if isinstance(body, bytes):
+            self.content = body
+        else:
+            self.content = body.encode("utf-8")
+
+    @property
+    def text(self):
+        """Return the body as text."""
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        """Return the body parsed as JSON."""
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """Raise rest.HTTPError if the status is an error (4xx or 5xx)."""
+        if 400 <= self.status_code < 600:
+            raise rest.HTTPError(
+                "{0} Error for url: {1}".format(self.status_code, self.url)
+            )
+
+
+def _base_url(url):
+    """Return url without the query string (it is in the parameters)."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def _parameters(url, kwargs):
+    """Return a sorted list of the [name, value] parameters of a request (from the
+    query string, params and data), without the secret parameters."""
+    parameters = parse_qsl(urlsplit(url).query, keep_blank_values=True)
+    for name in ("params", "data"):
+        values = kwargs.get(name)
+        if isinstance(values, dict):
+            parameters.extend(values.items())
+        elif values:
+            parameters.extend(parse_qsl("{0}".format(values), keep_blank_values=True))
+    return sorted(
+        ["{0}".format(name), "{0}".format(value)]
+        for name, value in parameters
+        if name not in SECRET_PARAMETERS
+    )
+
+
+def _key(method, url, parameters):
+    return method, url, tuple(tuple(parameter) for parameter in parameters)
+
+
+def _content_type(response):
+    try:
+        return response.headers.get("Content-Type", "") or ""
+    except AttributeError:
+        return ""
+
+
+def _redact(text):
+    """Replace the tokens in a JSON response (i.e. from generateToken)."""
+    if "token" not in text:
+        return text
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if not isinstance(data, dict) or "token" not in data:
+        return text
+    data["token"] = REDACTED
+    return json.dumps(data)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+A write-ahead journal of the progress of a publishing run.
+
+Each stage transition of each document is appended to the journal file as a
+line of JSON, and the file is flushed to disk (fsync) before the run continues.
+If a run dies (reboot, crash, killed task), the next run can be started with
+--resume to read the journal, skip the work that was finished, and repair the
+work that was interrupted.
+
+Each line is a dictionary like:
+    {"time": 1600000000.0, "run": "<run id>", "stage": "staged",
+     "service_path": "folder/name", "details": {...}}
+A run begins with a 'run_started' line and ends with a 'run_finished' line.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# Run markers
+RUN_STARTED = "run_started"
+RUN_FINISHED = "run_finished"
+
+# Document stages (in order). All but STARTED are reported by Doc.add_listener()
+STARTED = "started"
+DRAFTED = "drafted"
+ANALYZED = "analyzed"
+STAGED = "staged"
+UPLOADED = "uploaded"
+VERIFIED = "verified"
+UPDATED = "updated"
+ROLLED_BACK = "rolled_back"
+DELETED = "deleted"
+
+# Recorded by the publisher for each server when publishing to several (see fanout.py)
+TARGET_UPLOADED = "target_uploaded"
+
+# Stages after which there is nothing left to do for the document.
+FINISHED_STAGES = (UPLOADED, VERIFIED, UPDATED, ROLLED_BACK, DELETED)
+
+# What a resumed run does first for a document (see resume_step())
+SKIP = "skip"
+CHECK_LIVE = "check_live"
+UPLOAD = "upload"
+DISCARD_DRAFT = "discard_draft"
+DISCARD_SERVICE_DEFINITION = "discard_service_definition"
+
+
+def resume_step(stage, details):
+    """Return what a resumed run must do first for a document, given the last stage
+    (and its details) recorded for it in the interrupted run, or None.
+
+    SKIP: the document was finished.
+    CHECK_LIVE: a new service was staged; the upload may have completed, so the
+        document is finished if the service is live.
+    UPLOAD: a replacement was staged; the old service is live, so the upload must
+        not be skipped.
+    DISCARD_DRAFT, DISCARD_SERVICE_DEFINITION: the file may be partially written.
+    """
+    if stage in FINISHED_STAGES:
+        return SKIP
+    if stage == STAGED:
+        return UPLOAD if (details or {}).get("replacement") else CHECK_LIVE
+    if stage == STARTED:
+        return DISCARD_DRAFT
+    if stage in (DRAFTED, ANALYZED):
+        return DISCARD_SERVICE_DEFINITION
+    return None
+
+
+class Journal(object):
+    """An append only, fsync'd log of document stage transitions."""
+
+    def __init__(self, path):
+        self.__path = path
+        self.__run = None
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    @property
+    def path(self):
+        """Return the filesystem path to the journal."""
+        return self.__path
+
+    def incomplete_run(self):
+        """Return the progress of the last run if it did not finish, else an empty dict.
+
+        The progress is a dictionary of {service_path: (stage, details)} with the
+        last stage recorded for each document (service paths are lower case)."""
+        progress = {}
+        for entry in self.__read():
+            stage = entry.get("stage")
+            if stage == RUN_FINISHED or (
+                stage == RUN_STARTED and not entry.get("details", {}).get("resume")
+            ):
+                progress = {}
+            elif stage == RUN_STARTED:
+                # A resumed run continues the progress of the interrupted run.
+                continue
+            elif entry.get("service_path") is not None:
+                key = entry["service_path"].lower()
+                progress[key] = (stage, entry.get("details", {}))
+        return progress
+
+    def start_run(self, resume=False):
+        """Start a new run. Unless resuming, the old journal is discarded."""
+        mode = "a" if resume else "w"
+        self.__file = open(self.__path, mode, encoding="utf-8")
+        self.__run = uuid.uuid4().hex
+        self.record(RUN_STARTED, resume=resume)
+
+    def finish_run(self):
+        """Mark the run as finished and close the journal."""
+        if self.__file is None:
+            return
+        self.record(RUN_FINISHED)
+        self.__file.close()
+        self.__file = None
+
+    def record(self, stage, service_path=None, **details):
+        """Append a stage transition to the journal, and flush it to disk."""
+        if self.__file is None:
+            logger.warning(
+                "Journal %s is not open; %s not recorded", self.__path, stage
+            )
+            return
+        entry = {
+            "time": time.time(),
+            "run": self.__run,
+            "stage": stage,
+            "service_path": service_path,
+            "details": details,
+        }
+        # Stages may be recorded by several upload threads (see fanout.py)
+        with self.__lock:
+            self.__file.write(json.dumps(entry) + "\n")
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+
+    def listener(self, doc, stage, details):
+        """A Doc stage listener (see Doc.add_listener) that records to this journal."""
+        self.record(stage, doc.service_path, **details)
+
+    def __read(self):
+        if not os.path.exists(self.__path):
+            return
+        with open(self.__path, "r", encoding="utf-8") as in_file:
+            for line in in_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if we crashed while writing it.
+                    logger.warning("Ignoring an invalid line in %s", self.__path)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the journal of a publishing run, and resuming an interrupted run.
+
+Run with: python -m pytest journal_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import os
+import shutil
+import tempfile
+
+import journal
+from journal import Journal
+
+
+def test_incomplete_run():
+    """The progress of an interrupted run is the last stage of each document."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "journal.jsonl")
+        run = Journal(path)
+        assert run.incomplete_run() == {}
+        run.start_run()
+        run.record(journal.STARTED, "Transport/Roads")
+        run.record(journal.STAGED, "Transport/Roads", replacement=True)
+        run.record(journal.STARTED, "Parks")
+        run.record(journal.UPLOADED, "Parks")
+        # The run dies here, while writing a line.
+        with open(path, "a", encoding="utf-8") as out_file:
+            out_file.write('{"stage": "dra')
+        progress = Journal(path).incomplete_run()
+        print(progress)
+        assert progress == {
+            "transport/roads": (journal.STAGED, {"replacement": True}),
+            "parks": (journal.UPLOADED, {}),
+        }
+        run.finish_run()
+        assert Journal(path).incomplete_run() == {}
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_resumed_run_continues_progress():
+    """A resumed run keeps the progress of the run it resumed; a new run does not."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "journal.jsonl")
+        first = Journal(path)
+        first.start_run()
+        first.record(journal.STARTED, "Roads")
+        first.record(journal.STARTED, "Parks")
+
+        second = Journal(path)
+        progress = second.incomplete_run()
+        second.start_run(resume=True)
+        second.record(journal.DRAFTED, "Parks")
+        assert sorted(Journal(path).incomplete_run()) == ["parks", "roads"]
+        assert Journal(path).incomplete_run()["parks"][0] == journal.DRAFTED
+        assert progress["parks"][0] == journal.STARTED
+
+        third = Journal(path)
+        third.start_run()
+        assert third.incomplete_run() == {}
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_resume_step():
+    """An interrupted replacement is uploaded again, even though the service is live."""
+    assert journal.resume_step(None, {}) is None
+    assert journal.resume_step(journal.UPLOADED, {}) == journal.SKIP
+    assert journal.resume_step(journal.ROLLED_BACK, {}) == journal.SKIP
+    assert journal.resume_step(journal.STARTED, {}) == journal.DISCARD_DRAFT
+    assert (
+        journal.resume_step(journal.ANALYZED, {}) == journal.DISCARD_SERVICE_DEFINITION
+    )
+    assert (
+        journal.resume_step(journal.STAGED, {"replacement": False})
+        == journal.CHECK_LIVE
+    )
+    assert journal.resume_step(journal.STAGED, {"replacement": True}) == journal.UPLOAD
+    # Some targets were finished; the rest are retried (see fanout.py).
+    assert journal.resume_step(journal.TARGET_UPLOADED, {"target": "prod"}) is None
+
+
+if __name__ == "__main__":
+    test_incomplete_run()
+    test_resumed_run_continues_progress()
+    test_resume_step()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the memory used by each document and stage of a publishing run.
+
+When profiling is on, the process memory (the resident set size, RSS) and the
+Python allocations (with tracemalloc) are read at each Doc stage (see
+Doc.add_listener), and when each document starts and ends. The growth in each
+stage, and over each document, is added to the run report, with the source
+lines that allocated the most memory that was not freed over the run, so a
+leak can be traced to a map and a stage.
+
+The memory of a process is shared by all its threads, so the growth can only be
+attributed to a document when the documents are published one at a time (i.e.
+--folder_workers 1, or a queue worker). Otherwise only the growth over the run
+is reported.
+
+tracemalloc slows Python down, and is not available in Python 2; without it
+only the RSS is reported. The RSS is read with psutil (if it is installed), or
+from /proc on Linux.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import logging
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+MEGABYTE = 1024 * 1024
+
+# Stack frames saved with each allocation
+TRACE_FRAMES = 5
+
+
+class MemoryProfiler(object):
+    """Reads the memory use at each stage of each document."""
+
+    def __init__(self, top=10, serial=True):
+        """top is the number of allocation sites to report. serial is False if
+        documents are published concurrently (the growth of each is not reported)."""
+        self.__top = top
+        self.__serial = serial
+        self.__lock = threading.Lock()
+        self.__documents = {}  # service_path: {"stages": [...], ...}
+        self.__order = []
+        self.__baseline = None
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+            self.__baseline = tracemalloc.take_snapshot()
+        if tracemalloc is None and rss() is None:
+            logger.warning("Unable to measure memory on this platform")
+        self.__start = self.__read()
+
+    def begin(self, doc):
+        """Take the first reading for doc (before it is drafted)."""
+        if not self.__serial:
+            return
+        reading = self.__read()
+        with self.__lock:
+            if doc.service_path not in self.__documents:
+                self.__order.append(doc.service_path)
+            self.__documents[doc.service_path] = {
+                "service_path": doc.service_path,
+                "start": reading,
+                "last": reading,
+                "stages": [],
+            }
+
+    def listener(self, doc, stage, _):
+        """A Doc stage listener (see Doc.add_listener) that reads the memory use."""
+        self.__add(doc, stage)
+
+    def end(self, doc):
+        """Take the last reading for doc (after it is published)."""
+        self.__add(doc, "end")
+
+    def results(self):
+        """Return a dictionary with the growth over the run, a list of the growth for
+        each document (in MB; empty if not serial) and the allocation sites that grew
+        the most over the run."""
+        with self.__lock:
+            documents = [
+                self.__summarize(self.__documents[key]) for key in self.__order
+            ]
+        end = self.__read()
+        result = {
+            "run": {
+                "start_mb": self.__start["rss_mb"],
+                "end_mb": end["rss_mb"],
+                "growth_mb": _difference(end, self.__start),
+            },
+            "serial": self.__serial,
+            "documents": documents,
+            "top_allocations": [],
+        }
+        if self.__baseline is not None and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            stats = snapshot.compare_to(self.__baseline, "lineno")
+            result["top_allocations"] = [
+                {
+                    "location": "{0}:{1}".format(
+                        stat.traceback[0].filename, stat.traceback[0].lineno
+                    ),
+                    "size_mb": _megabytes(stat.size),
+                    "growth_mb": _megabytes(stat.size_diff),
+                    "count": stat.count,
+                }
+                for stat in stats[: self.__top]
+            ]
+        return result
+
+    def add_to_report(self, report):
+        """Add the results to report (a RunReport) as the 'memory' section."""
+        result = self.results()
+        report.set_section("memory", result)
+        for document in result["documents"]:
+            growth = document["growth_mb"]
+            if growth is not None and growth > 0:
+                logger.info(
+                    "%s grew the process by %s MB", document["service_path"], growth
+                )
+
+    def __add(self, doc, stage):
+        if not self.__serial:
+            return
+        reading = self.__read()
+        with self.__lock:
+            document = self.__documents.get(doc.service_path)
+            if document is None:
+                return
+            entry = dict(reading, stage=stage)
+            entry["growth_mb"] = _difference(reading, document["last"])
+            document["stages"].append(entry)
+            document["last"] = reading
+
+    @staticmethod
+    def __read():
+        traced = None
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            traced = _megabytes(tracemalloc.get_traced_memory()[0])
+        memory = rss()
+        return {
+            "rss_mb": None if memory is None else _megabytes(memory),
+            "traced_mb": traced,
+        }
+
+    @staticmethod
+    def __summarize(document):
+        return {
+            "service_path": document["service_path"],
+            "start_mb": document["start"]["rss_mb"],
+            "end_mb": document["last"]["rss_mb"],
+            "growth_mb": _difference(document["last"], document["start"]),
+            "stages": document["stages"],
+        }
+
+
+def rss():
+    """Return the resident set size of this process in bytes (or None if unknown)."""
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception as ex:
+            logger.debug("Unable to read the RSS with psutil: %s", ex)
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as in_file:
+            pages = int(in_file.read().split()[1])
+        # Imported here because resource is not available on Windows.
+        import resource  # pylint: disable=import-outside-toplevel
+
+        return pages * resource.getpagesize()
+    except Exception:
+        return None
+
+
+def _difference(reading, earlier):
+    """Return the growth from earlier to reading (RSS if known, else traced)."""
+    for key in ("rss_mb", "traced_mb"):
+        if reading[key] is not None and earlier[key] is not None:
+            return round(reading[key] - earlier[key], 1)
+    return None
+
+
+def _megabytes(size):
+    return round(size / MEGABYTE, 1)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the memory profile of a publishing run.
+
+Run with: python -m pytest memory_profile_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import memory_profile
+from memory_profile import MemoryProfiler
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+
+class FakeDoc(object):
+    """A document with a service path."""
+
+    def __init__(self, service_path):
+        self.service_path = service_path
+
+
+class StubReadings(object):
+    """Replaces the RSS reading (and tracemalloc) with a list of readings in MB."""
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+        self.saved = None
+
+    def rss(self):
+        """Return the next reading in bytes."""
+        return self.readings.pop(0) * memory_profile.MEGABYTE
+
+    def __enter__(self):
+        self.saved = memory_profile.rss, memory_profile.tracemalloc
+        memory_profile.rss = self.rss
+        memory_profile.tracemalloc = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        memory_profile.rss, memory_profile.tracemalloc = self.saved
+
+
+def test_results_by_document_and_stage():
+    """The growth of each stage and document is reported when serial."""
+    roads, parks = FakeDoc("Roads"), FakeDoc("Parks")
+    # init (twice: the warning check and the start), begin, 2 stages, end, ...
+    readings = [100, 100, 100, 150, 160, 160, 160, 170, 200]
+    with StubReadings(readings):
+        profiler = MemoryProfiler()
+        profiler.begin(roads)
+        profiler.listener(roads, "drafted", {})
+        profiler.listener(roads, "staged", {})
+        profiler.end(roads)
+        profiler.begin(parks)
+        profiler.end(parks)
+        result = profiler.results()
+    print(result)
+    assert result["serial"]
+    assert result["run"] == {"start_mb": 100.0, "end_mb": 200.0, "growth_mb": 100.0}
+    assert [document["service_path"] for document in result["documents"]] == [
+        "Roads",
+        "Parks",
+    ]
+    first = result["documents"][0]
+    assert first["growth_mb"] == 60.0
+    assert [(stage["stage"], stage["growth_mb"]) for stage in first["stages"]] == [
+        ("drafted", 50.0),
+        ("staged", 10.0),
+        ("end", 0.0),
+    ]
+    assert result["documents"][1]["growth_mb"] == 10.0
+    assert result["top_allocations"] == []
+
+
+def test_results_when_not_serial():
+    """Documents published concurrently are not reported, only the run."""
+    doc = FakeDoc("Roads")
+    with StubReadings([100, 100, 130]):
+        profiler = MemoryProfiler(serial=False)
+        profiler.begin(doc)
+        profiler.listener(doc, "drafted", {})
+        profiler.end(doc)
+        result = profiler.results()
+    assert not result["serial"]
+    assert result["documents"] == []
+    assert result["run"]["growth_mb"] == 30.0
+
+
+if __name__ == "__main__":
+    test_results_by_document_and_stage()
+    test_results_when_not_serial()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Run changes to a server (publishes and deletes) in parallel, one folder at a time.
+
+ArcGIS Server does not cope well with concurrent changes in the same folder:
+two uploads may both try to create the folder, and the folder's configuration
+is locked while a service in it is changed. The MutationScheduler runs the work
+for each folder in the order it was submitted, one at a time, while the work
+for different folders runs concurrently on a pool of worker threads.
+
+Only the requests to the server belong on the workers: arcpy is not thread
+safe, so drafting, analysis and staging are done before a task is submitted,
+and the arcpy uploads on the workers take turns (see Doc.upload()); the admin
+requests (edits, deletes and checks) run concurrently.
+The missing folders are created (see FolderCreator) before the first task.
+
+With one worker, the work is done immediately by submit(), in order, as if
+there was no scheduler. With more, submit() waits while there are twice as many
+tasks as workers waiting or running, so the tasks are not all queued at once
+(i.e. the scheduler.py time budget is checked as the run goes).
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import deque
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+
+class MutationScheduler(object):
+    """Runs tasks serially within a folder and concurrently across folders."""
+
+    def __init__(self, workers=1):
+        self.__workers = max(1, workers)
+        self.__lock = threading.Condition()
+        self.__lanes = {}  # folder key: deque of tasks
+        self.__ready = deque()  # folder keys with tasks and no running task
+        self.__pending = 0
+        self.__closed = False
+        self.__threads = []
+        if self.__workers > 1:
+            for index in range(self.__workers):
+                thread = threading.Thread(
+                    target=self.__work, name="mutation-{0}".format(index)
+                )
+                thread.daemon = True
+                thread.start()
+                self.__threads.append(thread)
+
+    def submit(self, folder, function, *args, **kwargs):
+        """Call function(*args, **kwargs) after the earlier tasks in folder."""
+        task = (folder, function, args, kwargs)
+        if self.__workers == 1:
+            self.__run(task)
+            return
+        key = (folder or "").lower()
+        with self.__lock:
+            while self.__pending >= 2 * self.__workers:
+                self.__lock.wait()
+            lane = self.__lanes.get(key)
+            if lane is None:
+                lane = deque()
+                self.__lanes[key] = lane
+                self.__ready.append(key)
+            lane.append(task)
+            self.__pending += 1
+            self.__lock.notify_all()
+
+    def wait(self):
+        """Wait for all the submitted tasks, and stop the workers."""
+        with self.__lock:
+            while self.__pending:
+                self.__lock.wait()
+            self.__closed = True
+            self.__lock.notify_all()
+        for thread in self.__threads:
+            thread.join()
+
+    def __work(self):
+        while True:
+            with self.__lock:
+                while not self.__ready and not self.__closed:
+                    self.__lock.wait()
+                if not self.__ready:
+                    return
+                key = self.__ready.popleft()
+                task = self.__lanes[key].popleft()
+            try:
+                self.__run(task)
+            except Exception as ex:
+                logger.error("Task in folder %s failed: %s", task[0], ex)
+            with self.__lock:
+                self.__pending -= 1
+                if self.__lanes[key]:
+                    # Go to the back of the line, so other folders get a turn.
+                    self.__ready.append(key)
+                else:
+                    del self.__lanes[key]
+                self.__lock.notify_all()
+
+    @staticmethod
+    def __run(task):
+        _, function, args, kwargs = task
+        function(*args, **kwargs)
+
+
+class FolderCreator(object):
+    """Creates the service folders that are missing on a server."""
+
+    def __init__(self, server_url, username, password):
+        self.__server_url = server_url
+        self.__username = username
+        self.__password = password
+        self.__token = None
+        self.__folders = None
+        self.__lock = threading.Lock()
+
+    def __call__(self, folder):
+        """Create folder on the server (if it is not None and does not exist)."""
+        if folder is None or self.__server_url is None:
+            return
+        # Imported here so that the scheduler can be used without requests.
+        import rest  # pylint: disable=import-outside-toplevel
+
+        with self.__lock:
+            if self.__folders is None and not self.__login():
+                return
+            if folder.lower() in self.__folders:
+                return
+            url = self.__server_url + "/admin/services/createFolder"
+            data = {"f": "json", "token": self.__token, "folderName": folder}
+            try:
+                logger.info("Creating the folder %s", folder)
+                response = rest.post(url, data=data)
+                response.raise_for_status()
+                json_response = response.json()
+            except Exception as ex:
+                logger.warning("Unable to create the folder %s: %s", folder, ex)
+                return
+            if json_response.get("status") != "success":
+                logger.warning(
+                    "Unable to create the folder %s: %s", folder, json_response
+                )
+                return
+            self.__folders.add(folder.lower())
+
+    def __login(self):
+        """Get a token and the list of existing folders. Returns True if successful."""
+        # Imported here so that the scheduler can be used without requests.
+        import rest  # pylint: disable=import-outside-toplevel
+        import util  # pylint: disable=import-outside-toplevel
+
+        if self.__username is None or self.__password is None:
+            logger.info("No credentials provided. Folders will not be created.")
+            self.__server_url = None
+            return False
+        self.__token = util.get_token(
+            self.__server_url, self.__username, self.__password
+        )
+        if self.__token is None:
+            logger.warning("Unable to login to server. Can't create folders.")
+            self.__server_url = None
+            return False
+        url = self.__server_url + "/admin/services"
+        try:
+            response = rest.get(url, params={"f": "json", "token": self.__token})
+            response.raise_for_status()
+            folders = response.json()["folders"]
+        except Exception as ex:
+            logger.warning("Unable to list the folders: %s", ex)
+            self.__server_url = None
+            return False
+        self.__folders = set(name.lower() for name in folders)
+        return True
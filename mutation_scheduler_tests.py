@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the per folder mutation scheduler.
+
+Run with: python -m pytest mutation_scheduler_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+import time
+
+from mutation_scheduler import MutationScheduler
+
+
+class Recorder(object):
+    """Records the tasks run in each folder, and the most running at once."""
+
+    # pylint: disable=useless-object-inheritance
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.order = {}
+        self.running = {}
+        self.most_in_folder = 0
+        self.most = 0
+
+    def task(self, folder, index):
+        """A task that takes a little while."""
+        with self.lock:
+            self.running[folder] = self.running.get(folder, 0) + 1
+            self.most_in_folder = max(self.most_in_folder, self.running[folder])
+            self.most = max(self.most, sum(self.running.values()))
+        time.sleep(0.01)
+        with self.lock:
+            self.running[folder] -= 1
+            self.order.setdefault(folder, []).append(index)
+
+
+def test_serial_in_folder_parallel_across():
+    """Tasks in a folder run in order, one at a time; folders run at once."""
+    recorder = Recorder()
+    scheduler = MutationScheduler(workers=4)
+    for index in range(5):
+        for folder in ("a", "b", "c", None):
+            scheduler.submit(folder, recorder.task, folder, index)
+    scheduler.wait()
+    for folder in ("a", "b", "c", None):
+        assert recorder.order[folder] == [0, 1, 2, 3, 4]
+    assert recorder.most_in_folder == 1
+    assert recorder.most > 1
+
+
+def test_one_worker_runs_in_submit():
+    """With one worker, tasks run immediately, in order."""
+    recorder = Recorder()
+    scheduler = MutationScheduler(workers=1)
+    scheduler.submit("a", recorder.task, "a", 0)
+    assert recorder.order["a"] == [0]
+    scheduler.submit("b", recorder.task, "b", 1)
+    scheduler.wait()
+    assert recorder.order == {"a": [0], "b": [1]}
+
+
+def test_failed_task_does_not_stop_folder():
+    """A task that raises is logged, and the next task in the folder runs."""
+    recorder = Recorder()
+    scheduler = MutationScheduler(workers=2)
+
+    def fail():
+        raise ValueError("failed")
+
+    scheduler.submit("a", fail)
+    scheduler.submit("a", recorder.task, "a", 1)
+    scheduler.wait()
+    assert recorder.order["a"] == [1]
+
+
+if __name__ == "__main__":
+    test_serial_in_folder_parallel_across()
+    test_one_worker_runs_in_submit()
+    test_failed_task_does_not_stop_folder()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Service instance, pooling and timeout settings from the service_list.
+
+Each setting is an optional column in the service_list. A setting is written to
+the draft service definition (*.sddraft) before it is staged, or, for a live
+service, changed with the admin API (services/<service>/edit) without
+republishing the service (see service_properties.py). Blank settings are left at
+the server's defaults.
+
+| service_list column     | sddraft key           | admin API key         |
+|-------------------------|-----------------------|-----------------------|
+| min_instances           | MinInstances          | minInstancesPerNode   |
+| max_instances           | MaxInstances          | maxInstancesPerNode   |
+| instances_per_container | InstancesPerContainer | instancesPerContainer |
+| isolation (high or low) | Isolation             | isolationLevel        |
+| max_wait_time (seconds) | MaxWaitTime           | maxWaitTime           |
+| max_idle_time (seconds) | MaxIdleTime           | maxIdleTime           |
+| max_usage_time (secs)   | MaxUsageTime          | maxUsageTime          |
+| max_startup_time (secs) | MaxStartupTime        | maxStartupTime        |
+| recycle_interval (hrs)  | RecycleInterval       | recycleInterval       |
+| recycle_start_time      | RecycleStartTime      | recycleStartTime      |
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import re
+import xml.dom.minidom
+
+import rest
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# service_list column: (sddraft key, admin API key)
+SETTINGS = {
+    "min_instances": ("MinInstances", "minInstancesPerNode"),
+    "max_instances": ("MaxInstances", "maxInstancesPerNode"),
+    "instances_per_container": ("InstancesPerContainer", "instancesPerContainer"),
+    "isolation": ("Isolation", "isolationLevel"),
+    "max_wait_time": ("MaxWaitTime", "maxWaitTime"),
+    "max_idle_time": ("MaxIdleTime", "maxIdleTime"),
+    "max_usage_time": ("MaxUsageTime", "maxUsageTime"),
+    "max_startup_time": ("MaxStartupTime", "maxStartupTime"),
+    "recycle_interval": ("RecycleInterval", "recycleInterval"),
+    "recycle_start_time": ("RecycleStartTime", "recycleStartTime"),
+}
+
+
+def from_settings(settings):
+    """Return the pooling settings in settings (a row from the service_list).
+
+    The result has a key for each column in SETTINGS. Blank and invalid values are
+    None; numbers are int, isolation is 'high' or 'low', and recycle_start_time is
+    'HH:MM'."""
+    pooling = {}
+    for name in SETTINGS:
+        value = (settings or {}).get(name)
+        if value is not None:
+            value = value.strip() or None
+        if value is not None:
+            try:
+                value = _convert(name, value)
+            except ValueError:
+                logger.warning("Ignoring the invalid %s (%s)", name, value)
+                value = None
+        pooling[name] = value
+    if (
+        pooling["min_instances"] is not None
+        and pooling["max_instances"] is not None
+        and pooling["min_instances"] > pooling["max_instances"]
+    ):
+        logger.warning(
+            "Ignoring min_instances (%s) > max_instances (%s)",
+            pooling["min_instances"],
+            pooling["max_instances"],
+        )
+        pooling["min_instances"] = None
+    return pooling
+
+
+def invalid_settings(settings):
+    """Return the names of the settings in settings (a row from the service_list)
+    with a value that is not valid."""
+    invalid = []
+    for name in SETTINGS:
+        value = ((settings or {}).get(name) or "").strip()
+        if value:
+            try:
+                _convert(name, value)
+            except ValueError:
+                invalid.append(name)
+    return invalid
+
+
+def patch_draft(draft_path, pooling):
+    """Write the pooling settings (with a value) into the draft at draft_path.
+
+    Returns the list of settings that were not found in the draft."""
+    wanted = dict(
+        (SETTINGS[name][0], value)
+        for name, value in pooling.items()
+        if name in SETTINGS and value is not None
+    )
+    if not wanted:
+        return []
+    x_doc = xml.dom.minidom.parse(draft_path)
+    found = set()
+    for props in x_doc.getElementsByTagName("Props"):
+        if props.parentNode.tagName != "Definition":
+            continue
+        for prop in props.getElementsByTagName("PropertySetProperty"):
+            keys = prop.getElementsByTagName("Key")
+            values = prop.getElementsByTagName("Value")
+            if not keys or not values or not keys[0].hasChildNodes():
+                continue
+            key = keys[0].firstChild.data
+            if key not in wanted:
+                continue
+            text = "{0}".format(wanted[key])
+            logger.debug("Setting %s to %s in %s", key, text, draft_path)
+            if values[0].hasChildNodes():
+                values[0].firstChild.data = text
+            else:
+                values[0].appendChild(x_doc.createTextNode(text))
+            found.add(key)
+    with open(draft_path, "w", encoding="utf-8") as out_file:
+        x_doc.writexml(out_file)
+    x_doc.unlink()
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        logger.warning("Settings %s not found in the draft %s", missing, draft_path)
+    return missing
+
+
+def edit_service(server_url, service, token, pooling):
+    """Change the pooling settings of service (i.e. 'folder/name.MapServer').
+
+    Settings without a value are not changed.
+    Returns True if the server accepted the change."""
+    changes = dict(
+        (SETTINGS[name][1], _admin_value(name, value))
+        for name, value in pooling.items()
+        if name in SETTINGS and value is not None
+    )
+    if not changes:
+        return True
+    url = server_url + "/admin/services/" + service
+    try:
+        response = rest.get(url, params={"f": "json", "token": token})
+        response.raise_for_status()
+        properties = response.json()
+    except Exception as ex:
+        logger.error("Unable to get the properties of %s: %s", service, ex)
+        return False
+    if "error" in properties or properties.get("status") == "error":
+        logger.error("Unable to get the properties of %s: %s", service, properties)
+        return False
+    properties.update(changes)
+    data = {"f": "json", "token": token, "service": json.dumps(properties)}
+    try:
+        logger.info("Editing the pooling settings of %s: %s", service, changes)
+        response = rest.post(url + "/edit", data=data)
+        response.raise_for_status()
+        json_response = response.json()
+    except Exception as ex:
+        logger.error("Unable to edit the properties of %s: %s", service, ex)
+        return False
+    logger.debug("Edit service response: %s", json_response)
+    if json_response.get("status") != "success":
+        logger.error("Unable to edit the properties of %s: %s", service, json_response)
+        return False
+    return True
+
+
+def _convert(name, text):
+    """Return the value of text for the setting name; raise ValueError if invalid."""
+    if name == "isolation":
+        value = text.lower()
+        if value not in ("high", "low"):
+            raise ValueError(text)
+        return value
+    if name == "recycle_start_time":
+        if not re.match(r"^([01]?\d|2[0-3]):[0-5]\d$", text):
+            raise ValueError(text)
+        return text
+    value = int(text)
+    if value < 0:
+        raise ValueError(text)
+    return value
+
+
+def _admin_value(name, value):
+    if name == "isolation":
+        return value.upper()
+    return value
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the service instance, pooling and timeout settings.
+
+Run with: python -m pytest pooling_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import xml.dom.minidom
+
+import http_replay
+import pooling
+import rest
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+URL = "https://gis/arcgis"
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+class FakeAdmin(object):
+    """A transport for the properties of a service, and the edits to them."""
+
+    def __init__(self, properties, edit_status="success"):
+        self.properties = properties
+        self.edit_status = edit_status
+        self.edits = []  # the service properties of each edit
+
+    def request(self, method, url, **kwargs):
+        """Return the service properties, or save an edit."""
+        if url.endswith("/edit"):
+            assert method == "POST" and kwargs["data"]["token"] == "secret"
+            self.edits.append(json.loads(kwargs["data"]["service"]))
+            body = {"status": self.edit_status}
+        else:
+            assert url == URL + "/admin/services/Transport/Roads.MapServer"
+            body = self.properties
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+def draft_values(draft_path):
+    """Return {parent tag: {key: value}} of the properties in the draft."""
+    result = {}
+    x_doc = xml.dom.minidom.parse(draft_path)
+    for props in x_doc.getElementsByTagName("Props"):
+        values = result.setdefault(props.parentNode.tagName, {})
+        for prop in props.getElementsByTagName("PropertySetProperty"):
+            key = prop.getElementsByTagName("Key")[0].firstChild.data
+            value = prop.getElementsByTagName("Value")[0]
+            values[key] = value.firstChild.data if value.hasChildNodes() else ""
+    x_doc.unlink()
+    return result
+
+
+def test_from_settings():
+    """Values are converted, and blank or invalid ones are None."""
+    settings = {
+        "min_instances": " 1 ",
+        "max_instances": "4",
+        "isolation": "LOW",
+        "max_wait_time": "",
+        "recycle_start_time": "02:30",
+        "recycle_interval": "-1",
+    }
+    result = pooling.from_settings(settings)
+    assert sorted(result) == sorted(pooling.SETTINGS)
+    assert result["min_instances"] == 1 and result["max_instances"] == 4
+    assert result["isolation"] == "low"
+    assert result["recycle_start_time"] == "02:30"
+    assert result["max_wait_time"] is None and result["recycle_interval"] is None
+    assert result["max_idle_time"] is None  # not in the service_list
+    print("test min_instances is dropped if it is more than max_instances")
+    result = pooling.from_settings({"min_instances": "5", "max_instances": "2"})
+    assert result["min_instances"] is None and result["max_instances"] == 2
+    assert set(pooling.from_settings(None).values()) == set([None])
+
+
+def test_invalid_settings():
+    """Only the settings with a (non blank) invalid value are reported."""
+    settings = {
+        "min_instances": "one",
+        "isolation": "medium",
+        "recycle_start_time": "24:00",
+        "max_wait_time": " ",
+        "max_idle_time": "60",
+        "other": "x",
+    }
+    assert sorted(pooling.invalid_settings(settings)) == [
+        "isolation",
+        "min_instances",
+        "recycle_start_time",
+    ]
+    assert pooling.invalid_settings(None) == []
+
+
+def test_patch_draft():
+    """The settings are written to the service definition's properties (not the
+    extensions'), and the settings missing from the draft are returned."""
+    folder = tempfile.mkdtemp()
+    try:
+        draft_path = os.path.join(folder, "roads.sddraft")
+        shutil.copy(os.path.join(TEST_DATA, "pooling.sddraft"), draft_path)
+        settings = pooling.from_settings(
+            {
+                "max_instances": "6",
+                "isolation": "low",
+                "max_wait_time": "90",
+                "max_idle_time": "600",
+            }
+        )
+        assert pooling.patch_draft(draft_path, settings) == ["MaxIdleTime"]
+        values = draft_values(draft_path)
+        assert values["Definition"] == {
+            "MinInstances": "1",
+            "MaxInstances": "6",
+            "Isolation": "low",
+            "MaxWaitTime": "90",  # was empty
+            "RecycleStartTime": "00:00",
+        }
+        assert values["SVCExtension"] == {"MaxInstances": "2"}
+
+        print("test a draft is not changed without settings")
+        before = os.path.getmtime(draft_path)
+        os.utime(draft_path, (before - 10, before - 10))
+        assert pooling.patch_draft(draft_path, pooling.from_settings({})) == []
+        assert os.path.getmtime(draft_path) == before - 10
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_edit_service():
+    """The settings with a value are merged into the service properties, with the
+    admin API's keys and values."""
+    admin = FakeAdmin({"serviceName": "Roads", "maxInstancesPerNode": 2})
+    previous = rest.set_transport(admin)
+    try:
+        service = "Transport/Roads.MapServer"
+        settings = pooling.from_settings({"max_instances": "6", "isolation": "low"})
+        assert pooling.edit_service(URL, service, "secret", settings)
+        assert admin.edits == [
+            {"serviceName": "Roads", "maxInstancesPerNode": 6, "isolationLevel": "LOW"}
+        ]
+        print("test nothing is sent without settings")
+        assert pooling.edit_service(URL, service, "secret", pooling.from_settings({}))
+        assert len(admin.edits) == 1
+        print("test a rejected edit fails")
+        admin.edit_status = "error"
+        assert not pooling.edit_service(URL, service, "secret", settings)
+        admin.properties = {"status": "error", "messages": ["No such service"]}
+        assert not pooling.edit_service(URL, service, "secret", settings)
+        assert len(admin.edits) == 2
+    finally:
+        rest.set_transport(previous)
+
+
+if __name__ == "__main__":
+    test_from_settings()
+    test_invalid_settings()
+    test_patch_draft()
+    test_edit_service()
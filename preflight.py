@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap (pure python) checks for a document before it is handed to arcpy.
+
+Creating and analyzing a draft service definition with arcpy is slow.  Many of
+the reasons a document can not be published are predictable without arcpy;
+missing or empty source documents, unsupported source types, bad service names,
+and data sources that no longer exist.  The functions in this module find those
+problems and report them in the same (simplified) format that `Doc` uses for the
+arcpy analysis results, i.e.
+  {"errors":[{"text":str,"code":int,"layers":[str,...]},...], "warnings":[...]}
+
+The codes are in the range 90000-90999 so that they will not be confused with
+the codes returned by arcpy.mapping.AnalyzeForSD().
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import os
+import xml.dom.minidom
+
+import util
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# Issue codes
+MISSING_SOURCE = 90001
+EMPTY_SOURCE = 90002
+UNSUPPORTED_SOURCE = 90003
+INVALID_SERVICE_NAME = 90004
+RENAMED_SERVICE = 90005
+TRUNCATED_SERVICE_NAME = 90006
+RESERVED_FOLDER = 90007
+INVALID_DRAFT = 90008
+MISSING_DATA_SOURCE = 90009
+
+# The maximum length of a service name, see util.sanitize_service_name()
+MAX_NAME_LENGTH = 120
+
+# Source documents that can be published with arcpy.mapping.CreateMapSDDraft()
+MAP_EXTENSIONS = (".mxd",)
+
+# ArcGIS Server reserves these folder names for its own services.
+RESERVED_FOLDERS = ("system", "utilities")
+
+# Cache of existence checks. Many documents share the same data sources.
+_exists_cache = {}
+
+
+def clear_cache():
+    """Forget all the cached existence checks (i.e. if the file system has changed)."""
+    _exists_cache.clear()
+
+
+def path_exists(path):
+    """Return True if path exists, checking the file system only once per path."""
+    if path is None:
+        return False
+    key = os.path.normcase(os.path.abspath(path))
+    if key not in _exists_cache:
+        _exists_cache[key] = os.path.exists(path)
+    return _exists_cache[key]
+
+
+def check_document(path, name=None, folder=None, is_image_service=False):
+    """Check the source document and the names it will be published with.
+
+    path is the filesystem path of the source document, name and folder are the
+    un-sanitized service name and service folder (name defaults to the base name
+    of path). Returns a dictionary of issues (which may be empty).
+    """
+    issues = {}
+    if path is None or not path_exists(path):
+        _add(issues, "errors", MISSING_SOURCE, "Source document {0} not found", path)
+        return issues
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    if not is_image_service:
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in MAP_EXTENSIONS:
+            _add(
+                issues,
+                "errors",
+                UNSUPPORTED_SOURCE,
+                "Source document type {0} is not supported",
+                ext,
+            )
+        else:
+            try:
+                if os.path.getsize(path) == 0:
+                    _add(issues, "errors", EMPTY_SOURCE, "Source document is empty")
+            except OSError as ex:
+                _add(issues, "errors", MISSING_SOURCE, "Unable to read source: {0}", ex)
+    _check_name(issues, name, "service name")
+    if folder is not None:
+        _check_name(issues, folder, "folder name")
+        if util.sanitize_service_name(folder).lower() in RESERVED_FOLDERS:
+            _add(
+                issues,
+                "errors",
+                RESERVED_FOLDER,
+                "Folder {0} is reserved by ArcGIS Server",
+                folder,
+            )
+    return issues
+
+
+def check_draft(draft_path):
+    """Check the data sources referenced in the manifest of a *.sddraft file.
+
+    Only file based data sources (file geodatabases, shapefile folders, etc.) are
+    checked.  Enterprise geodatabase connections can not be checked cheaply.
+    Returns a dictionary of issues (which may be empty).
+    """
+    issues = {}
+    try:
+        x_doc = xml.dom.minidom.parse(draft_path)
+    except Exception as ex:
+        _add(issues, "errors", INVALID_DRAFT, "Unable to read the draft: {0}", ex)
+        return issues
+    for workspace in data_sources(x_doc):
+        if not path_exists(workspace):
+            _add(
+                issues,
+                "errors",
+                MISSING_DATA_SOURCE,
+                "Data source {0} not found",
+                workspace,
+            )
+    return issues
+
+
+def data_sources(x_doc):
+    """Return a list of the file based workspaces in a parsed sddraft manifest.
+
+    The manifest has a list of SVCDatabase elements, each with an
+    OnPremiseConnectionString like 'DATABASE=C:\\data\\roads.gdb'.
+    """
+    workspaces = []
+    for node in x_doc.getElementsByTagName("OnPremiseConnectionString"):
+        if not node.hasChildNodes():
+            continue
+        properties = _parse_connection_string(node.firstChild.data)
+        if "SERVER" in properties or "INSTANCE" in properties:
+            # Enterprise geodatabase
+            continue
+        workspace = properties.get("DATABASE")
+        if workspace and workspace not in workspaces:
+            workspaces.append(workspace)
+    return workspaces
+
+
+def merge(*issue_sets):
+    """Combine several dictionaries of issues into one."""
+    result = {}
+    for issues in issue_sets:
+        if not issues:
+            continue
+        for key in ("messages", "warnings", "errors"):
+            if key in issues and issues[key]:
+                result.setdefault(key, []).extend(issues[key])
+    return result
+
+
+def _check_name(issues, name, kind):
+    """Check that name will make an acceptable service or folder name."""
+    clean_name = util.sanitize_service_name(name)
+    if not clean_name or clean_name.strip("_") == "":
+        _add(issues, "errors", INVALID_SERVICE_NAME, "Invalid {0}: {1}", kind, name)
+        return
+    if len(name) > MAX_NAME_LENGTH:
+        _add(
+            issues,
+            "warnings",
+            TRUNCATED_SERVICE_NAME,
+            "The {0} {1} will be truncated to {2}",
+            kind,
+            name,
+            clean_name,
+        )
+    elif clean_name != name:
+        _add(
+            issues,
+            "warnings",
+            RENAMED_SERVICE,
+            "The {0} {1} will be changed to {2}",
+            kind,
+            name,
+            clean_name,
+        )
+
+
+def _parse_connection_string(text):
+    """Convert 'KEY1=value1;KEY2=value2' into a dictionary with uppercase keys."""
+    properties = {}
+    for item in text.split(";"):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            properties[key.strip().upper()] = value.strip()
+    return properties
+
+
+def _add(issues, key, code, text, *args):
+    """Add an issue to the dictionary of issues in the simplified analysis format."""
+    issue = {"text": text.format(*args), "code": code, "layers": []}
+    issues.setdefault(key, []).append(issue)
+    logger.debug("Preflight %s: %s", key[:-1], issue["text"])
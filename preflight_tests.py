@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the preflight checks made before a document is handed to arcpy.
+
+Run with: python -m pytest preflight_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import os
+import shutil
+import tempfile
+
+import preflight
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+DRAFT = """<?xml version="1.0" encoding="utf-8"?>
+<SVCManifest>
+  <Databases>
+    <SVCDatabase>
+      <OnPremiseConnectionString>DATABASE={gdb}</OnPremiseConnectionString>
+    </SVCDatabase>
+    <SVCDatabase>
+      <OnPremiseConnectionString>DATABASE={missing}</OnPremiseConnectionString>
+    </SVCDatabase>
+    <SVCDatabase>
+      <OnPremiseConnectionString>SERVER=gis;INSTANCE=sde:sqlserver:gis;DATABASE=parks</OnPremiseConnectionString>
+    </SVCDatabase>
+    <SVCDatabase><OnPremiseConnectionString/></SVCDatabase>
+  </Databases>
+</SVCManifest>
+"""
+
+
+def codes(issues, key):
+    """Return the list of issue codes in issues[key]."""
+    return [issue["code"] for issue in issues.get(key, [])]
+
+
+def test_check_document():
+    """Missing, empty and unsupported documents are errors; odd names are warnings."""
+    preflight.clear_cache()
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        with open(mxd, "wb") as out_file:
+            out_file.write(b"not really a map")
+
+        assert preflight.check_document(mxd) == {}
+        print("test missing and empty sources")
+        missing = preflight.check_document(os.path.join(folder, "missing.mxd"))
+        assert codes(missing, "errors") == [preflight.MISSING_SOURCE]
+        empty = preflight.check_document(os.path.join(TEST_DATA, "test.mxd"))
+        assert codes(empty, "errors") == [preflight.EMPTY_SOURCE]
+        lyr = preflight.check_document(os.path.join(TEST_DATA, "test.lyr"))
+        assert codes(lyr, "errors") == [preflight.UNSUPPORTED_SOURCE]
+        # Image services are published from rasters, not map documents.
+        assert (
+            preflight.check_document(
+                os.path.join(TEST_DATA, "test.lyr"), is_image_service=True
+            )
+            == {}
+        )
+
+        print("test service and folder names")
+        renamed = preflight.check_document(mxd, name="my roads!")
+        assert codes(renamed, "warnings") == [preflight.RENAMED_SERVICE]
+        truncated = preflight.check_document(mxd, name="r" * 121)
+        assert codes(truncated, "warnings") == [preflight.TRUNCATED_SERVICE_NAME]
+        reserved = preflight.check_document(mxd, folder="System")
+        assert codes(reserved, "errors") == [preflight.RESERVED_FOLDER]
+        invalid = preflight.check_document(mxd, name="!!!")
+        assert codes(invalid, "errors") == [preflight.INVALID_SERVICE_NAME]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_existence_checks_are_cached():
+    """Each path is checked once, until the cache is cleared."""
+    preflight.clear_cache()
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "late.mxd")
+        assert not preflight.path_exists(mxd)
+        with open(mxd, "wb") as out_file:
+            out_file.write(b"map")
+        assert not preflight.path_exists(mxd)
+        preflight.clear_cache()
+        assert preflight.path_exists(mxd)
+        assert not preflight.path_exists(None)
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_check_draft():
+    """Missing file workspaces in the draft are errors; enterprise ones are not
+    checked."""
+    preflight.clear_cache()
+    folder = tempfile.mkdtemp()
+    try:
+        gdb = os.path.join(folder, "roads.gdb")
+        os.mkdir(gdb)
+        missing = os.path.join(folder, "parks.gdb")
+        draft = os.path.join(folder, "roads.sddraft")
+        with open(draft, "w", encoding="utf-8") as out_file:
+            out_file.write(DRAFT.format(gdb=gdb, missing=missing))
+
+        issues = preflight.check_draft(draft)
+        print(issues)
+        assert codes(issues, "errors") == [preflight.MISSING_DATA_SOURCE]
+        assert missing in issues["errors"][0]["text"]
+
+        broken = os.path.join(folder, "broken.sddraft")
+        with open(broken, "w", encoding="utf-8") as out_file:
+            out_file.write("<SVCManifest>")
+        assert codes(preflight.check_draft(broken), "errors") == [
+            preflight.INVALID_DRAFT
+        ]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_merge():
+    """Issues are combined by kind, skipping empty sets."""
+    first = {"errors": [{"text": "a", "code": 1, "layers": []}]}
+    second = {
+        "warnings": [{"text": "b", "code": 2, "layers": []}],
+        "errors": [{"text": "c", "code": 3, "layers": []}],
+    }
+    merged = preflight.merge(first, None, {}, second)
+    assert codes(merged, "errors") == [1, 3]
+    assert codes(merged, "warnings") == [2]
+    assert "messages" not in merged
+    assert preflight.merge() == {}
+
+
+if __name__ == "__main__":
+    test_check_document()
+    test_existence_checks_are_cached()
+    test_check_draft()
+    test_merge()
@@ -9,11 +9,18 @@ from io import open
 import json
 import os
 import logging
+import threading
 import xml.dom.minidom
 
 import arcpy
-import requests
 
+import adaptive_limit
+import pooling
+import preflight
+import rest
+import service_properties
+import tracing
+import uploads
 import util
 
 logger = logging.getLogger(__name__)
@@ -23,6 +30,11 @@ logger.addHandler(logging.NullHandler())
 # broad exception catching will be logged; reraise-from is not available in Python2
 # pylint: disable=broad-except,raise-missing-from
 
+# arcpy is not thread safe. Drafting, analysis and staging are done on the main
+# thread, but uploads run on the folder workers (see mutation_scheduler.py) and the
+# target threads (see fanout.py), so every arcpy call holds this lock.
+_ARCPY_LOCK = threading.RLock()
+
 
 class PublishException(Exception):
     """Raise when unable to Make a change on the server"""
@@ -45,23 +57,32 @@ class Doc(object):
         server=None,
         server_url=None,
         config=None,
+        settings=None,
+        image_service=False,
+        draft_templates=None,
     ):
+        """If image_service is True, path is published as an image service.
+        draft_templates (see draft_template.py) shares the draft with identical copies
+        of this document; if None, the draft is always made from the source."""
         logger.debug(
-            "Doc.__init__(path=%s, folder=%s, service_name=%s, server=%s, server_url=%s, config=%s",
+            "Doc.__init__(path=%s, folder=%s, service_name=%s, server=%s, server_url=%s, config=%s, settings=%s",
             path,
             folder,
             service_name,
             server,
             server_url,
             config,
+            settings,
         )
         self.__config = config
         self.__basename = None
         self.__ext = None
         self.__draft_file_name = None
         self.__sd_file_name = None
+        self.__previous_sd_file_name = None
         self.__issues_file_name = None
-        self.__is_image_service = False
+        self.__properties_file_name = None
+        self.__is_image_service = bool(image_service)
         # All instance attributes should be defined in __init__()
         # (even if they are set in a property setter)
         self.__path = None  # (re)set in path.setter
@@ -75,12 +96,22 @@ class Doc(object):
         self.__service_copy_data_to_server = False
         self.__service_server_type = None
         self.__service_connection_file_path = None
-        self.__service_summary = None  # or string
-        self.__service_tags = None  # or string with comma separated tags
+        # summary (string), tags (string with comma separated tags) from the service_list
+        properties = service_properties.from_settings(settings)
+        self.__service_summary = properties["summary"]
+        self.__service_tags = properties["tags"]
+        self.__pooling = pooling.from_settings(settings)
         self.__have_draft = False
+        self.__draft_properties = None  # the properties used to create the draft
         self.__draft_analysis_result = None
+        self.__preflight_issues = None
+        self.__data_sources = None
+        self.__draft_templates = draft_templates
+        self.__listeners = []
         self.__have_service_definition = False
         self.__have_new_service_definition = False
+        self.__have_forced_draft = False  # stage() redrafts once, for all variants
+        self.__is_prepared = False  # publish() only uploads (see prepare())
         self.__service_is_live = None
 
         if server is not None:
@@ -139,7 +170,9 @@ class Doc(object):
                 # TODO: This will not work for image services
                 self.__draft_file_name = base + ".sddraft"
                 self.__sd_file_name = base + ".sd"
+                self.__previous_sd_file_name = base + ".previous.sd"
                 self.__issues_file_name = base + ".issues.json"
+                self.__properties_file_name = base + ".properties.json"
                 self.service_name = self.__basename
             else:
                 logger.warning(
@@ -174,6 +207,11 @@ class Doc(object):
             self.__folder = None
             self.__service_folder_name = None
 
+    @property
+    def service_folder(self):
+        """Returns the (sanitized) name of the folder on the server, or None."""
+        return self.__service_folder_name
+
     @property
     def service_name(self):
         """Returns the name of the ArcGIS service for this document."""
@@ -266,6 +304,66 @@ class Doc(object):
             return self.__service_folder_name + "/" + self.__service_name
         return self.__service_name
 
+    @property
+    def data_sources(self):
+        """Return the data sources used by this document's layers.
+
+        This is only known (not None) if a draft was created by this object."""
+        return self.__data_sources
+
+    def list_data_sources(self):
+        """Return the data sources used by this document's layers, reading them from
+        the map document if a draft was not created by this object (i.e. it is up to
+        date). Returns None for image services, or if the document can not be read."""
+        if self.__data_sources is not None or self.__is_image_service:
+            return self.__data_sources
+        try:
+            with _ARCPY_LOCK:
+                map_document = arcpy.mapping.MapDocument(self.path)
+        except Exception as ex:
+            logger.warning("Unable to read the data sources of %s: %s", self.path, ex)
+            return None
+        return self.__list_data_sources(map_document)
+
+    @property
+    def properties(self):
+        """Return the properties (from the service_list) that can be changed without
+        republishing (see service_properties.py and pooling.py)."""
+        properties = {"summary": self.__service_summary, "tags": self.__service_tags}
+        properties.update(self.__pooling)
+        return properties
+
+    @property
+    def previous_service_definition(self):
+        """Return the path to the service definition that was replaced by the last
+        publish (see rollback()), or None if there is not one."""
+        if self.__previous_sd_file_name is None:
+            return None
+        if not os.path.exists(self.__previous_sd_file_name):
+            return None
+        return self.__previous_sd_file_name
+
+    @property
+    def is_up_to_date(self):
+        """Return True if there is a service definition newer than the source document,
+        and it was uploaded to the server (see uploads.py). If the uploads were not
+        recorded, the service must be live."""
+        if self.__is_image_service or not self.__file_exists_and_is_newer(
+            self.__sd_file_name, self.path
+        ):
+            return False
+        uploaded = uploads.is_current(
+            self.path, self.__connection(), self.__sd_file_name
+        )
+        if uploaded is None:
+            return bool(self.is_live)
+        return uploaded
+
+    @property
+    def is_rejected(self):
+        """Return True if this version of the document was rolled back (see rollback())."""
+        return uploads.is_rejected(self.path)
+
     @property
     def is_live(self):
         "Return true if the service for this document exists."
@@ -295,8 +393,20 @@ class Doc(object):
                 self.__have_service_definition = True
                 return True
 
+        # The analysis of an unchanged document is cached; arcpy is slow.
+        if self.__draft_analysis_result is None:
+            self.__get_analysis_result_from_cache()
+        if (
+            self.__draft_analysis_result is not None
+            and self.__draft_analysis_result.get("errors")
+        ):
+            logger.debug("The cached analysis has errors, NOT ready to publish.")
+            return False
+
         # I need to create a sd file, so I need to check for/create a draft file
         if not self.__file_exists_and_is_newer(self.__draft_file_name, self.path):
+            if not self.__preflight_document():
+                return False
             try:
                 self.__create_draft_service_definition()
             except PublishException as ex:
@@ -305,6 +415,8 @@ class Doc(object):
 
         # I may have a draft file, but it may not be publishable, make sure I have analysis results.
         if self.__draft_analysis_result is None:
+            if not self.__preflight_draft():
+                return False
             try:
                 self.__analyze_draft_service_definition()
             except PublishException as ex:
@@ -362,11 +474,192 @@ class Doc(object):
 
     # Public Methods
 
-    def publish(self):
-        """Publish the document to the server."""
+    def add_listener(self, listener):
+        """Call listener(doc, stage, details) when this document reaches a new stage.
+
+        stage is one of 'drafted', 'analyzed', 'staged', 'uploaded', 'verified',
+        'updated', 'rolled_back', or 'deleted'; details is a dictionary (possibly empty) with more
+        information.
+        """
+        self.__listeners.append(listener)
+
+    def discard_artifacts(self, draft=False, service_definition=False):
+        """Delete the draft and/or service definition files for this document.
+
+        Used to clean up files that may be incomplete (i.e. after a crash)."""
+        if draft and self.__draft_file_name is not None:
+            self.__delete_file(self.__draft_file_name)
+            self.__have_draft = False
+        if service_definition and self.__sd_file_name is not None:
+            self.__delete_file(self.__sd_file_name)
+            self.__have_service_definition = False
+
+    def require_upload(self):
+        """Upload the service definition on the next publish(), even if it is not
+        new (i.e. the upload of a replacement was interrupted)."""
+        self.__have_new_service_definition = True
+
+    @tracing.traced("publish")
+    def publish(self, force=False):
+        """Publish the document to the server.
+
+        If force is True, the service definition is rebuilt and uploaded even if
+        there is one that is newer than the source document (i.e. the data changed).
+        """
+
+        self.__publish_service(force=force)
+
+    def prepare(self, force=False):
+        """Draft, analyze and stage the service definition for publish(), without
+        uploading it.
+
+        When documents are published concurrently (see mutation_scheduler.py), this
+        is called on the main thread, and publish() on a worker only uploads the
+        service definition and edits the service. The uploads still take turns with
+        the other arcpy calls (arcpy is not thread safe)."""
+
+        if (
+            not force
+            and self.__file_exists_and_is_newer(self.__sd_file_name, self.path)
+            and self.__properties_changed()
+            and not self.__can_edit_service()
+        ):
+            # The changes can only be published in a new service definition (see
+            # __update_service_properties()), which must be staged here.
+            force = True
+        if force or not self.__have_service_definition:
+            self.__create_service_definition(force=force)
+        self.__is_prepared = True
+
+    @tracing.traced("rollback")
+    def rollback(self):
+        """Replace the live service with the previous service definition.
+
+        The previous service definition is the one that was live before the last
+        publish replaced it (see previous_service_definition). The rejected service
+        definition is deleted, and the document is marked as rejected (see
+        is_rejected), so it is not republished until it changes."""
+
+        previous = self.previous_service_definition
+        if previous is None:
+            raise PublishException(
+                "There is no previous service definition to roll back to"
+            )
+        conn = self.__connection()
+        try:
+            logger.info("Rolling back %s to %s", self.service_path, previous)
+            self.__upload_service_definition(previous, conn)
+        except Exception as ex:
+            # An older service definition may not be valid as a replacement;
+            # remove the current service and publish the previous one as new.
+            logger.warning("Unable to replace the service (%s); recreating it", ex)
+            if not self.unpublish():
+                raise PublishException(
+                    "Unable to roll back: the service could not be replaced ({0}), "
+                    "or deleted".format(ex)
+                )
+            try:
+                self.__upload_service_definition(previous, conn)
+            except Exception as ex2:
+                raise PublishException("Unable to roll back: {0}".format(ex2))
+        logger.info("Done rolling back %s", self.service_path)
+        uploads.record(self.path, conn, previous)
+        uploads.reject(self.path)
+        self.__delete_file(self.__sd_file_name)
+        self.__delete_file(self.__properties_file_name)
+        self.__have_service_definition = False
+        self.__have_new_service_definition = False
+        self.__service_is_live = None
+        self.__notify("rolled_back", service_definition=previous)
+
+    @tracing.traced("stage")
+    def stage(self, replacement=False, force=False):
+        """Create a service definition for a new (or a replacement) service.
 
-        self.__publish_service()
+        Unlike publish(), the service definition does not depend on the server
+        for this document, so it can be uploaded to any server (see fanout.py).
+        The service definition is saved beside the document as <name>.new.sd or
+        <name>.replacement.sd, and is reused if it is newer than the document
+        (unless force is True).
+        Returns a tuple of the path to the service definition, and True if it was
+        created by this call."""
+
+        if self.__sd_file_name is None:
+            raise PublishException(
+                "This document cannot be published.  There is no path to the source."
+            )
+        sd_file_name = self.__variant_file_name(replacement)
+        base = os.path.splitext(sd_file_name)[0]
+        if not force and self.__file_exists_and_is_newer(sd_file_name, self.path):
+            logger.debug("%s is newer than the source, skipping stage", sd_file_name)
+            return sd_file_name, False
+        if force and not self.__have_forced_draft:
+            self.discard_artifacts(draft=True)
+            self.__draft_analysis_result = None
+            self.__have_forced_draft = True
+        if not self.is_publishable:
+            raise PublishException(
+                "Draft Service Definition has issues and is not ready to publish"
+            )
+        if not self.__have_draft:
+            self.__create_draft_service_definition()
+
+        draft_file_name = base + ".sddraft"
+        new_type = "esriServiceDefinitionType_New"
+        if replacement:
+            new_type = "esriServiceDefinitionType_Replacement"
+        self.__set_draft_service_type(new_type, draft_file_name)
+        self.__delete_file(sd_file_name)
+        try:
+            logger.info(
+                "Begin arcpy.StageService_server(%s, %s)", draft_file_name, sd_file_name
+            )
+            with _ARCPY_LOCK:
+                arcpy.StageService_server(draft_file_name, sd_file_name)
+            logger.info("Done arcpy.StageService_server()")
+        except Exception as ex:
+            raise PublishException(
+                "Unable to create the service definition file: {0}".format(ex)
+            )
+        self.__delete_file(draft_file_name)
+        self.__notify(
+            "staged", replacement=replacement, service_definition=sd_file_name
+        )
+        return sd_file_name, True
+
+    def staged_file(self, replacement=False):
+        """Return the path of the service definition for the variant (see stage()) if
+        it is newer than the document, or None if it must be staged."""
+        sd_file_name = self.__variant_file_name(replacement)
+        if sd_file_name is None:
+            return None
+        if not self.__file_exists_and_is_newer(sd_file_name, self.path):
+            return None
+        return sd_file_name
+
+    @tracing.traced("upload")
+    def upload(self, service_definition, server):
+        """Upload a service definition (see stage()) to server (a *.ags file path).
+
+        This may be called from several threads (i.e. one per server), but the
+        uploads are made one at a time (arcpy is not thread safe). Progress is not
+        reported to the listeners; the caller knows when the
+        document is finished on all the servers."""
+
+        try:
+            logger.info(
+                "Begin arcpy.UploadServiceDefinition_server(%s, %s)",
+                service_definition,
+                server,
+            )
+            self.__upload_service_definition(service_definition, server)
+            logger.info("Done arcpy.UploadServiceDefinition_server(%s)", server)
+        except Exception as ex:
+            raise PublishException(
+                "Unable to upload the service to {0}: {1}".format(server, ex)
+            )
 
+    @tracing.traced("unpublish")
     def unpublish(self, dry_run=False):
         """Stop and delete a service that is already published
 
@@ -375,6 +668,9 @@ class Doc(object):
         The ags connection file cannot by used with arcpy to admin the server
         ref: http://resources.arcgis.com/en/help/rest/apiref/index.html
         of: http://resources.arcgis.com/en/help/arcgis-rest-api/index.html
+
+        Returns True if the service was deleted (or would be, if dry_run), or False
+        if it can not be deleted (i.e. there are no credentials).
         """
         # TODO: self.service_path is not valid if source path doesn't exist
         # (typical case for delete)
@@ -383,24 +679,24 @@ class Doc(object):
             logger.warning(
                 "URL to server, or path to service is unknown. Can't unpublish."
             )
-            return
+            return False
 
         username = getattr(self.__config, "admin_username", None)
         password = getattr(self.__config, "admin_password", None)
         if username is None or password is None:
             logger.warning("No credentials provided. Can't unpublish.")
-            return
+            return False
         # TODO: check if service type is in the extended properties provided by the caller
         # (from CSV file)
         service_type = self.__get_service_type_from_server()
         if service_type is None:
             logger.warning("Unable to find service on server. Can't unpublish.")
-            return
+            return False
 
-        token = self.__get_token(self.server_url, username, password)
+        token = util.get_token(self.server_url, username, password)
         if token is None:
             logger.warning("Unable to login to server. Can't unpublish.")
-            return
+            return False
 
         url = (
             self.server_url
@@ -416,21 +712,24 @@ class Doc(object):
         if dry_run:
             msg = "Prepared to delete {0} from the {1}"
             print(msg.format(self.service_path, self.server_url))
-            return
+            return True
         try:
             logger.info("Attempting to delete %s from the server", self.service_path)
-            response = requests.post(url, data=data)
+            response = rest.post(url, data=data)
             response.raise_for_status()
-        except requests.exceptions.RequestException as ex:
+        except rest.RequestException as ex:
             logger.error(ex)
             raise PublishException("Failed to unpublish: {0}".format(ex))
         json_response = response.json()
         logger.debug("Unpublish Response: %s", json_response)
+        self.__notify("deleted")
+        return True
         # TODO: info or error Log response
         # TODO: If folder is empty delete it?
 
     # Private Methods
 
+    @tracing.traced("draft")
     def __create_draft_service_definition(self, force=False):
         """Create a service definition draft from a mxd/lyr
 
@@ -471,41 +770,115 @@ class Doc(object):
         if os.path.exists(self.__draft_file_name):
             self.__delete_file(self.__draft_file_name)
 
+        template = None
+        map_document = None
+        templates = self.__draft_templates
+        if (
+            templates is not None
+            and not self.__is_image_service
+            and templates.has_copies(self.path)
+        ):
+            # Copies with relative paths may use different data, so the (resolved)
+            # data sources are part of the template's key.
+            map_document = self.__open_map_document()
+            if map_document is not None:
+                template = templates.template(
+                    self.path,
+                    tuple(sorted(self.__list_data_sources(map_document))),
+                    self.__service_server_type,
+                    self.__service_connection_file_path,
+                    self.__service_summary,
+                    self.__service_tags,
+                )
+        if template is None:
+            self.__create_draft_from_source(map_document=map_document)
+        else:
+            try:
+                # Copies drafted at the same time wait for the first one.
+                with template.lock:
+                    if not self.__create_draft_from_template(template):
+                        self.__create_draft_from_source(template, map_document)
+            finally:
+                templates.release(template)
+
+        if self.is_live:
+            self.__create_replacement_service_draft()
+        self.__notify("drafted")
+        self.__notify("analyzed")
+
+    def __create_draft_from_source(self, template=None, map_document=None):
+        """Create the draft with arcpy, and save it in template (if it has no draft).
+
+        map_document is the opened document (if it was opened for the template)."""
         source = self.path
         if self.__is_image_service:
             create_sddraft = arcpy.CreateImageSDDraft
         else:
             create_sddraft = arcpy.mapping.CreateMapSDDraft
-            try:
-                source = arcpy.mapping.MapDocument(self.path)
-            except Exception as ex:
-                PublishException(ex)
+            if map_document is None:
+                map_document = self.__open_map_document()
+            if map_document is not None:
+                source = map_document
+            self.__data_sources = self.__list_data_sources(source)
 
         try:
             logger.info("Begin arcpy.createSDDraft(%s)", self.path)
-            result = create_sddraft(
-                source,
-                self.__draft_file_name,
-                self.__service_name,
-                self.__service_server_type,
-                self.__service_connection_file_path,
-                self.__service_copy_data_to_server,
-                self.__service_folder_name,
-                self.__service_summary,
-                self.__service_tags,
-            )
+            with _ARCPY_LOCK:
+                result = create_sddraft(
+                    source,
+                    self.__draft_file_name,
+                    self.__service_name,
+                    self.__service_server_type,
+                    self.__service_connection_file_path,
+                    self.__service_copy_data_to_server,
+                    self.__service_folder_name,
+                    self.__service_summary,
+                    self.__service_tags,
+                )
             logger.info("Done arcpy.createSDDraft()")
             self.__draft_analysis_result = result
             self.__have_draft = True
-            self.__simplify_and_cache_analysis_results()
+            if self.__draft_analysis_result is not None:
+                self.__simplify_analysis_results()
+            if template is not None and template.draft is None:
+                template.save(
+                    self.__draft_file_name,
+                    self.__service_name,
+                    self.__service_folder_name,
+                    self.__draft_analysis_result,
+                    self.__data_sources,
+                )
+            pooling.patch_draft(self.__draft_file_name, self.__pooling)
+            self.__draft_properties = self.properties
+            self.__merge_and_cache_analysis_results()
         except Exception as ex:
             raise PublishException(
                 "Unable to create the draft service definition file: {0}".format(ex)
             )
 
-        if self.is_live:
-            self.__create_replacement_service_draft()
+    def __create_draft_from_template(self, template):
+        """Create the draft from the draft of an identical document.
 
+        Returns False if the template has no draft (or it can not be used)."""
+        if not template.apply(
+            self.__draft_file_name, self.__service_name, self.__service_folder_name
+        ):
+            return False
+        logger.info("Created the draft for %s from %s", self.path, template.source)
+        self.__data_sources = template.data_sources
+        self.__draft_analysis_result = template.analysis
+        self.__have_draft = True
+        try:
+            pooling.patch_draft(self.__draft_file_name, self.__pooling)
+            self.__draft_properties = self.properties
+            self.__merge_and_cache_analysis_results()
+        except Exception as ex:
+            raise PublishException(
+                "Unable to create the draft service definition file: {0}".format(ex)
+            )
+        return True
+
+    @tracing.traced("verify")
     def __check_server_for_service(self):
         """Check if this source is already published on the server
 
@@ -523,7 +896,7 @@ class Doc(object):
         if self.__service_folder_name is not None:
             # Check if the folder is valid
             try:
-                data = requests.get(url).json()
+                data = rest.get(url).json()
                 # sample response: {..., "folders":["folder1","folder2"], ...}
                 folders = [folder.lower() for folder in data["folders"]]
             except Exception as ex:
@@ -546,7 +919,7 @@ class Doc(object):
                 return False
         logger.debug("looking for services at: %s", url)
         try:
-            data = requests.get(url).json()
+            data = rest.get(url).json()
             # sample response: {..., "services":
             #  [{"name": "WebMercator/DENA_Final_IFSAR_WM", "type": "ImageServer"}]}
             services = [service["name"].lower() for service in data["services"]]
@@ -557,6 +930,7 @@ class Doc(object):
         logger.debug("services found: %s", services)
         return self.service_path.lower() in services
 
+    @tracing.traced("analyze")
     def __analyze_draft_service_definition(self):
         """Analyze a Service Definition Draft (.sddraft) files for readiness to publish
 
@@ -574,24 +948,65 @@ class Doc(object):
             return
         try:
             logger.info("Begin arcpy.mapping.AnalyzeForSD(%s)", self.__draft_file_name)
-            self.__draft_analysis_result = arcpy.mapping.AnalyzeForSD(
-                self.__draft_file_name
-            )
+            with _ARCPY_LOCK:
+                self.__draft_analysis_result = arcpy.mapping.AnalyzeForSD(
+                    self.__draft_file_name
+                )
             logger.info("Done arcpy.mapping.AnalyzeForSD()")
         except Exception as ex:
             raise PublishException(
                 "Unable to analyze the draft service definition file: {0}".format(ex)
             )
         self.__simplify_and_cache_analysis_results()
+        self.__notify("analyzed")
+
+    def __preflight_document(self):
+        """Check the source document before asking arcpy to create a draft.
+
+        Returns False (and records the issues) if the document can not be published."""
+        issues = preflight.check_document(
+            self.path, self.__basename, self.folder, self.__is_image_service
+        )
+        return self.__record_preflight_issues(issues)
+
+    def __preflight_draft(self):
+        """Check the data sources in the draft before asking arcpy to analyze it.
+
+        Returns False (and records the issues) if the document can not be published."""
+        issues = preflight.check_draft(self.__draft_file_name)
+        return self.__record_preflight_issues(issues)
+
+    def __record_preflight_issues(self, issues):
+        """Save the preflight issues; they are merged with the arcpy analysis results.
+
+        If there are errors, they become the analysis results, and False is returned."""
+        self.__preflight_issues = preflight.merge(self.__preflight_issues, issues)
+        if "errors" not in issues:
+            return True
+        logger.info("%s failed the preflight checks, skipping arcpy.", self.name)
+        self.__draft_analysis_result = self.__preflight_issues
+        self.__cache_analysis_results()
+        return False
 
     def __simplify_and_cache_analysis_results(self):
         if self.__draft_analysis_result is not None:
             self.__simplify_analysis_results()
-            try:
-                with open(self.__issues_file_name, "w", encoding="utf-8") as out_file:
-                    out_file.write(json.dumps(self.__draft_analysis_result))
-            except Exception as ex:
-                logger.warning("Unable to cache the analysis results: %s", ex)
+            self.__merge_and_cache_analysis_results()
+
+    def __merge_and_cache_analysis_results(self):
+        """Add the preflight issues to the (simplified) analysis results, and save them."""
+        if self.__draft_analysis_result is not None:
+            self.__draft_analysis_result = preflight.merge(
+                self.__draft_analysis_result, self.__preflight_issues
+            )
+            self.__cache_analysis_results()
+
+    def __cache_analysis_results(self):
+        try:
+            with open(self.__issues_file_name, "w", encoding="utf-8") as out_file:
+                out_file.write(json.dumps(self.__draft_analysis_result))
+        except Exception as ex:
+            logger.warning("Unable to cache the analysis results: %s", ex)
 
     def __get_analysis_result_from_cache(self):
         if self.__file_exists_and_is_newer(self.__issues_file_name, self.path):
@@ -643,6 +1058,7 @@ class Doc(object):
                             )
         return text
 
+    @tracing.traced("stage")
     def __create_service_definition(self, force=False):
         """Converts a service definition draft (.sddraft) into a service definition
 
@@ -652,7 +1068,11 @@ class Doc(object):
         http://desktop.arcgis.com/en/arcmap/latest/tools/server-toolbox/stage-service.htm
         """
         if force:
-            self.__delete_file(self.__sd_file_name)
+            self.__delete_file(self.__draft_file_name)
+            self.__retain_service_definition()
+            self.__have_draft = False
+            self.__draft_analysis_result = None
+            self.__have_service_definition = False
 
         if not self.is_publishable:
             raise PublishException(
@@ -663,21 +1083,45 @@ class Doc(object):
             # I do not have a service definition that is newer than the map/draft,
             # but I might have an old version
             # the arcpy method will fail if the sd file exists
-            self.__delete_file(self.__sd_file_name)
+            self.__retain_service_definition()
             try:
                 logger.info(
                     "Begin arcpy.StageService_server(%s, %s)",
                     self.__draft_file_name,
                     self.__sd_file_name,
                 )
-                arcpy.StageService_server(self.__draft_file_name, self.__sd_file_name)
+                with _ARCPY_LOCK:
+                    arcpy.StageService_server(
+                        self.__draft_file_name, self.__sd_file_name
+                    )
                 logger.info("Done arcpy.StageService_server()")
                 self.__have_service_definition = True
                 self.__have_new_service_definition = True
+                # If the draft was not created here, the properties are unknown (None)
+                service_properties.save(
+                    self.__draft_properties, self.__properties_file_name
+                )
             except Exception as ex:
                 raise PublishException(
                     "Unable to create the service definition file: {0}".format(ex)
                 )
+            self.__notify("staged", replacement=bool(self.is_live))
+
+    def __retain_service_definition(self):
+        """Move the old service definition out of the way, keeping it as the previous
+        service definition if it may be the one that is live (see rollback())."""
+
+        if self.__sd_file_name is None or not os.path.exists(self.__sd_file_name):
+            return
+        if not self.is_live:
+            self.__delete_file(self.__sd_file_name)
+            return
+        self.__delete_file(self.__previous_sd_file_name)
+        try:
+            logger.debug("Keeping %s as the previous version", self.__sd_file_name)
+            os.rename(self.__sd_file_name, self.__previous_sd_file_name)
+        except Exception:
+            raise PublishException("Unable to rename {0}".format(self.__sd_file_name))
 
     def __create_replacement_service_draft(self):
         """Modify the service definition draft to overwrite the existing service
@@ -688,9 +1132,15 @@ class Doc(object):
         logger.debug("Fixing draft file %s for replacement", self.__draft_file_name)
 
         new_type = "esriServiceDefinitionType_Replacement"
-        file_name = self.__draft_file_name
+        self.__set_draft_service_type(new_type, self.__draft_file_name)
+        logger.debug("Draft file fixed.")
+
+    def __set_draft_service_type(self, new_type, file_name):
+        """Write the draft with the SVCManifest Type set to new_type to file_name.
 
-        x_doc = xml.dom.minidom.parse(file_name)
+        file_name may be the draft file, or a new file for a variant of the draft."""
+
+        x_doc = xml.dom.minidom.parse(self.__draft_file_name)
         descriptions = x_doc.getElementsByTagName("Type")
         for desc in descriptions:
             if desc.parentNode.tagName == "SVCManifest":
@@ -705,7 +1155,8 @@ class Doc(object):
 
         with open(file_name, "w", encoding="utf-8") as out_file:
             x_doc.writexml(out_file)
-        logger.debug("Draft file fixed.")
+        # Free the (cyclic) DOM now, rather than when the garbage collector runs.
+        x_doc.unlink()
 
     def __publish_service(self, force=False):
         # TODO: Support the optional parameters to UploadServiceDefinition_server
@@ -744,31 +1195,143 @@ class Doc(object):
         AGOL/Portal services will be shared per the settings in the sd_file
         """
 
-        if not self.__have_service_definition:
+        if not self.__is_prepared and (force or not self.__have_service_definition):
             self.__create_service_definition(force=force)
         if not self.__have_service_definition:
             raise PublishException(
                 "Service Definition (*.sd) file is not ready to publish"
             )
 
-        if self.__service_connection_file_path is None:
-            # conn = ' '.join([word.capitalize() for word in self.__service_server_type.split('_')])
-            conn = "My Hosted Services"
-        else:
-            conn = self.__service_connection_file_path
+        conn = self.__connection()
 
         # only publish if we need to.
-        if force or not self.is_live or self.__have_new_service_definition:
+        uploaded = uploads.is_current(self.path, conn, self.__sd_file_name)
+        if (
+            force
+            or uploaded is False
+            or not self.is_live
+            or self.__have_new_service_definition
+        ):
             try:
                 logger.info(
                     "Begin arcpy.UploadServiceDefinition_server(%s, %s)",
                     self.__sd_file_name,
                     conn,
                 )
-                arcpy.UploadServiceDefinition_server(self.__sd_file_name, conn)
+                with tracing.span("upload", service=self.service_path):
+                    self.__upload_service_definition(self.__sd_file_name, conn)
                 logger.info("Done arcpy.UploadServiceDefinition_server()")
             except Exception as ex:
                 raise PublishException("Unable to upload the service: {0}".format(ex))
+            uploads.record(self.path, conn, self.__sd_file_name)
+            self.__notify("uploaded")
+            # Check the catalog to verify the upload
+            self.__service_is_live = None
+            if self.is_live:
+                self.__notify("verified")
+        self.__update_service_properties()
+
+    def __update_service_properties(self):
+        """Apply the changes to the properties that do not need a new service definition.
+
+        The properties in the (uploaded) service definition are recorded when it is
+        staged. If they are different from the current properties, the service is
+        edited with the admin API; if that is not possible, it is republished."""
+
+        if self.__properties_file_name is None:
+            return
+        recorded = service_properties.load(self.__properties_file_name)
+        changes = service_properties.changes(recorded, self.properties)
+        if not changes:
+            return
+        if self.__edit_service_properties(changes):
+            service_properties.save(self.properties, self.__properties_file_name)
+            self.__notify("updated", properties=sorted(changes))
+            return
+        if self.__have_new_service_definition:
+            # The recorded properties are the ones just uploaded.
+            return
+        if self.__is_prepared:
+            # Only prepare() stages; the edit is tried again on the next run.
+            raise PublishException(
+                "Unable to edit the properties {0} of the service".format(
+                    ", ".join(sorted(changes))
+                )
+            )
+        logger.warning("Unable to edit %s; republishing instead", self.service_path)
+        self.__publish_service(force=True)
+
+    def __properties_changed(self):
+        """Return True if the properties are not the ones recorded for the service."""
+        if self.__properties_file_name is None:
+            return False
+        recorded = service_properties.load(self.__properties_file_name)
+        return bool(service_properties.changes(recorded, self.properties))
+
+    def __can_edit_service(self):
+        """Return True if the service can be edited with the admin API (there is a
+        server URL and credentials)."""
+        if self.server_url is None or self.service_path is None:
+            logger.info("URL to server, or path to service is unknown. Can't edit.")
+            return False
+        username = getattr(self.__config, "admin_username", None)
+        password = getattr(self.__config, "admin_password", None)
+        if username is None or password is None:
+            logger.info("No credentials provided. Can't edit.")
+            return False
+        return True
+
+    def __edit_service_properties(self, changes):
+        """Edit the item info and pooling of the live service. Returns True if successful."""
+
+        if not self.__can_edit_service():
+            return False
+        username = getattr(self.__config, "admin_username", None)
+        password = getattr(self.__config, "admin_password", None)
+        service_type = self.__get_service_type_from_server()
+        if service_type is None:
+            logger.warning("Unable to find service on server. Can't edit.")
+            return False
+        token = util.get_token(self.server_url, username, password)
+        if token is None:
+            logger.warning("Unable to login to server. Can't edit.")
+            return False
+        service = self.service_path + "." + service_type
+        item_info = dict(
+            (key, value)
+            for key, value in changes.items()
+            if key in service_properties.ITEM_INFO
+        )
+        if item_info and not service_properties.edit_item_info(
+            self.server_url, service, token, item_info
+        ):
+            return False
+        settings = dict(
+            (key, value) for key, value in changes.items() if key in pooling.SETTINGS
+        )
+        return pooling.edit_service(self.server_url, service, token, settings)
+
+    def __variant_file_name(self, replacement):
+        """Return the service definition file for a variant (see stage())."""
+        if self.__sd_file_name is None:
+            return None
+        variant = "replacement" if replacement else "new"
+        return os.path.splitext(self.__sd_file_name)[0] + "." + variant + ".sd"
+
+    def __connection(self):
+        """Return the server (see upload()) to publish this document to."""
+        if self.__service_connection_file_path is None:
+            # conn = ' '.join([word.capitalize() for word in self.__service_server_type.split('_')])
+            return "My Hosted Services"
+        return self.__service_connection_file_path
+
+    def __notify(self, stage, **details):
+        """Tell the listeners that this document has reached stage."""
+        for listener in self.__listeners:
+            try:
+                listener(self, stage, details)
+            except Exception as ex:
+                logger.warning("Stage listener failed on %s: %s", stage, ex)
 
     def __get_service_type_from_server(self):
         # TODO: Implement
@@ -787,12 +1350,13 @@ class Doc(object):
         url = self.server_url + "/rest/services?f=json"
         name = self.__service_name.lower()
         if self.__service_folder_name is not None:
-            url = self.server_url + "/rest/services/folder?f=json"
+            url = self.server_url + "/rest/services/" + self.__service_folder_name
+            url += "?f=json"
             name = (
                 self.__service_folder_name.lower() + "/" + self.__service_name.lower()
             )
         try:
-            data = requests.get(url).json()
+            data = rest.get(url).json()
             logger.debug("Server response: %s", data)
             # sample response: {..., "services":
             #  [{"name": "WebMercator/DENA_Final_IFSAR_WM", "type": "ImageServer"}]}
@@ -817,8 +1381,44 @@ class Doc(object):
 
         return service_type
 
+    def __open_map_document(self):
+        """Return the arcpy MapDocument for this document, or None if it can not be
+        opened (drafting from the path will report why)."""
+        try:
+            with _ARCPY_LOCK:
+                return arcpy.mapping.MapDocument(self.path)
+        except Exception as ex:
+            logger.warning("Unable to open %s: %s", self.path, ex)
+            return None
+
     # Private Class Methods
 
+    @staticmethod
+    def __list_data_sources(map_document):
+        """Return a list of the data sources used by the layers in map_document."""
+        sources = []
+        try:
+            with _ARCPY_LOCK:
+                for layer in arcpy.mapping.ListLayers(map_document):
+                    if layer.supports("DATASOURCE") and layer.dataSource not in sources:
+                        sources.append(layer.dataSource)
+        except Exception as ex:
+            logger.warning("Unable to list the data sources: %s", ex)
+        return sources
+
+    @staticmethod
+    def __upload_service_definition(service_definition, server):
+        """Upload a service definition, waiting for the other arcpy calls, and if the
+        limit of concurrent uploads to server is reached (see adaptive_limit.py)."""
+        # Uploads are compared with uploads of a similar size
+        size = os.path.getsize(service_definition)
+        # The lock is taken first, so the wait for it is not timed as server latency.
+        with _ARCPY_LOCK:
+            with adaptive_limit.limiter("upload", server).slot(
+                adaptive_limit.size_class(size)
+            ):
+                arcpy.UploadServiceDefinition_server(service_definition, server)
+
     @staticmethod
     def __delete_file(path):
         if not os.path.exists(path):
@@ -844,42 +1444,3 @@ class Doc(object):
                 "Exception raised checking for file A newer than file B: %s", ex
             )
             return False
-
-    @staticmethod
-    def __get_token(url, username, password):
-        # TODO: use url/rest/info?f=json  resp['authInfo']['tokenServicesUrl'] + generateTokens
-        logger.debug("Generate admin token")
-        path = "/admin/generateToken"
-        # path = '/tokens/generateToken' requires https?
-        data = {
-            "f": "json",
-            "username": username,
-            "password": password,
-            "client": "request_ip",
-            "expiration": "60",
-        }
-        try:
-            response = requests.post(url + path, data=data)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as ex:
-            logger.error(ex)
-            return None
-        json_response = response.json()
-        logger.debug("Login Response: %s", json_response)
-        try:
-            if "token" in json_response:
-                return json_response["token"]
-            if "error" in json_response:
-                logger.debug("Server response: %s", json_response)
-                logger.error(
-                    "%s (%s)",
-                    json_response["error"]["message"],
-                    ";".join(json_response["error"]["details"]),
-                )
-            else:
-                raise TypeError
-        except (TypeError, KeyError):
-            logger.error(
-                "Invalid server response while generating token: %s", json_response
-            )
-        return None
@@ -8,13 +8,39 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import argparse
 import logging
 import logging.config
+import time
 
+import adaptive_limit
+import benchmark
+from benchmark import Benchmark
 import config_logger
 from config import Config
+import dependency_index
+from dependency_index import DependencyIndex
+from draft_template import DraftTemplates
 from document_finder import Documents
+from fanout import CatalogSnapshot, FanOut, parse_target
+import fingerprint
+import http_replay
+import journal as journal_stages
+from memory_profile import MemoryProfiler
+from mutation_scheduler import FolderCreator, MutationScheduler
+import queue_logging
+import rest
+from journal import Journal
+from doc_record import DocRecord
 from publishable_doc import PublishException
+from run_report import RunReport
+from scheduler import Scheduler
+from tile_cache import CacheJobs
+import tracing
+import usage
+import util
+from warmup import Warmup, WARMUP_REQUESTS, wait_until_ready
+from work_queue import LeaseKeeper, WorkQueue, worker_name
 
 logging.config.dictConfig(config_logger.config)
+queue_logging.start()
 logging.raiseExceptions = False
 logger = logging.getLogger("main")
 logger.info("Logging Started")
@@ -66,6 +92,16 @@ def get_configuration_settings():
             "The default is {0}"
         ).format(Config.service_list),
     )
+    parser.add_argument(
+        "--dependency_index",
+        default=getattr(Config, "dependency_index", None),
+        help=(
+            "The dependency_index is a path to a JSON file with the data sources "
+            "of the published services. Services with a data source that has "
+            "changed since it was published will be republished. "
+            "The default is {0}"
+        ).format(getattr(Config, "dependency_index", None)),
+    )
     parser.add_argument(
         "-s",
         "--server",
@@ -78,6 +114,21 @@ def get_configuration_settings():
             "The default is {0}"
         ).format(Config.server),
     )
+    parser.add_argument(
+        "-t",
+        "--target",
+        action="append",
+        # Not the config list: append would add to it (and change it).
+        default=None,
+        help=(
+            "Publish to several servers at once. Each target is a path to a "
+            "connection (*.ags) file, optionally with a name (i.e. prod=c:/prod.ags). "
+            "Repeat the option for each server. Each document is staged once, and "
+            "uploaded to each of the targets. When provided, --server and "
+            "--server_url are ignored. "
+            "The default is {0}"
+        ).format(getattr(Config, "targets", None)),
+    )
     parser.add_argument(
         "--server_url",
         default=Config.server_url,
@@ -107,9 +158,295 @@ def get_configuration_settings():
             "If not provided, the value in config.py is used"
         ),
     )
+    parser.add_argument(
+        "--shard",
+        type=shard_type,
+        default=None,
+        help=(
+            "Only process the shard i of n (i.e. 2/3) of the documents. "
+            "Each document is assigned to a shard by a hash of its service path, "
+            "so n publishing nodes can each process a different shard."
+        ),
+    )
+    parser.add_argument(
+        "--queue",
+        default=getattr(Config, "work_queue", None),
+        help=(
+            "The path to a shared SQLite work queue. With --enqueue, the documents "
+            "to publish and unpublish are added to the queue; with --worker, jobs "
+            "are taken from the queue until it is empty. Without either option, "
+            "the queue is ignored. "
+            "The default is {0}"
+        ).format(getattr(Config, "work_queue", None)),
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Add the work to the queue (see --queue), but do not do it.",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Do the work in the queue (see --queue) until it is empty.",
+    )
+    parser.add_argument(
+        "--max_runtime",
+        type=float,
+        default=getattr(Config, "max_runtime", None),
+        help=(
+            "The time budget (in minutes) for publishing. Documents are published "
+            "in priority order, and those that are not expected to finish in the "
+            "remaining time are deferred to the next run. "
+            "The default is {0}"
+        ).format(getattr(Config, "max_runtime", None)),
+    )
+    parser.add_argument(
+        "--schedule_file",
+        default=getattr(Config, "schedule_file", None),
+        help=(
+            "The path to a JSON file with the durations from previous runs and the "
+            "backlog of deferred documents. Used with --max_runtime. "
+            "The default is {0}"
+        ).format(getattr(Config, "schedule_file", None)),
+    )
+    parser.add_argument(
+        "--usage_database",
+        default=getattr(Config, "usage_database", None),
+        help=(
+            "The path to a SQLite database of the usage of each service. On each "
+            "run, the new usage statistics are collected from the server (requires "
+            "the admin credentials). Busier services are published first. "
+            "The default is {0}"
+        ).format(getattr(Config, "usage_database", None)),
+    )
+    parser.add_argument(
+        "--apply_usage",
+        action="store_true",
+        default=getattr(Config, "apply_usage", False),
+        help=(
+            "Set the min and max instances of each service from its usage (see "
+            "--usage_database), unless they are set in the service_list. "
+            "The default is {0}"
+        ).format(getattr(Config, "apply_usage", False)),
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        default=getattr(Config, "warmup", False),
+        help=(
+            "After each service is uploaded, wait for it to be ready, and send it "
+            "warm-up requests (in the background). The time to ready is added to "
+            "the report, and services that do not start are flagged. "
+            "The default is {0}"
+        ).format(getattr(Config, "warmup", False)),
+    )
+    parser.add_argument(
+        "--warmup_timeout",
+        type=float,
+        default=getattr(Config, "warmup_timeout", 300),
+        help=(
+            "The time (in seconds) to wait for a new service to be ready. "
+            "The default is {0}"
+        ).format(getattr(Config, "warmup_timeout", 300)),
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        default=getattr(Config, "benchmark", False),
+        help=(
+            "Benchmark each live service before and after it is replaced, and "
+            "treat a slower replacement as a failure (see --regression_action). "
+            "The default is {0}"
+        ).format(getattr(Config, "benchmark", False)),
+    )
+    parser.add_argument(
+        "--benchmark_requests",
+        default=getattr(Config, "benchmark_requests", None),
+        help=(
+            "The path to a JSON file of the requests to benchmark (see "
+            "benchmark.py). If None, the warm-up requests are used. "
+            "The default is {0}"
+        ).format(getattr(Config, "benchmark_requests", None)),
+    )
+    parser.add_argument(
+        "--benchmark_threshold",
+        type=float,
+        default=getattr(Config, "benchmark_threshold", 0.5),
+        help=(
+            "The fraction that the 90th percentile latency may increase before a "
+            "replacement is a regression. The default is {0}"
+        ).format(getattr(Config, "benchmark_threshold", 0.5)),
+    )
+    parser.add_argument(
+        "--benchmark_concurrency",
+        type=int,
+        default=getattr(Config, "benchmark_concurrency", 4),
+        help=(
+            "The number of benchmark requests to send at once. The default is {0}"
+        ).format(getattr(Config, "benchmark_concurrency", 4)),
+    )
+    parser.add_argument(
+        "--regression_action",
+        choices=["fail", "rollback"],
+        default=getattr(Config, "regression_action", "fail"),
+        help=(
+            "What to do when a replacement is a regression: fail (report it) or "
+            "rollback (republish the previous service definition). "
+            "The default is {0}"
+        ).format(getattr(Config, "regression_action", "fail")),
+    )
+    parser.add_argument(
+        "--folder_workers",
+        type=int,
+        default=getattr(Config, "folder_workers", 1),
+        help=(
+            "The number of server folders to publish to (or unpublish from) at once. "
+            "Documents in the same folder are always done one at a time, and all "
+            "documents are staged and uploaded (with arcpy) one at a time. "
+            "The default is {0}"
+        ).format(getattr(Config, "folder_workers", 1)),
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=getattr(Config, "max_concurrency", adaptive_limit.MAX_LIMIT),
+        help=(
+            "The most uploads (or ReST requests) to send to a server at once. The "
+            "limit starts lower, and adapts to the server's response times and "
+            "errors. The default is {0}"
+        ).format(getattr(Config, "max_concurrency", adaptive_limit.MAX_LIMIT)),
+    )
+    parser.add_argument(
+        "--memory_profile",
+        action="store_true",
+        default=getattr(Config, "memory_profile", False),
+        help=(
+            "Measure the memory used by each document and stage, and add it (with "
+            "the code that allocated the most memory) to the report. With "
+            "--folder_workers above 1, only the growth over the run is reported. "
+            "This slows the run. The default is {0}"
+        ).format(getattr(Config, "memory_profile", False)),
+    )
+    parser.add_argument(
+        "--cache_jobs",
+        default=getattr(Config, "cache_jobs", None),
+        help=(
+            "The path to a file for the queue of tile cache updates. When the data "
+            "of a cached service changes, the tiles that cover the changed data are "
+            "rebuilt in the cache_window. The default is {0}"
+        ).format(getattr(Config, "cache_jobs", None)),
+    )
+    parser.add_argument(
+        "--cache_window",
+        default=getattr(Config, "cache_window", None),
+        help=(
+            "The off-peak time (local HH:MM-HH:MM) to start tile cache updates in; "
+            "updates queued at other times wait for a later run. "
+            "The default is {0}"
+        ).format(getattr(Config, "cache_window", None)),
+    )
+    parser.add_argument(
+        "--cache_instances",
+        type=int,
+        default=getattr(Config, "cache_instances", 2),
+        help=(
+            "The number of caching service instances to use for each tile cache "
+            "update. The default is {0}"
+        ).format(getattr(Config, "cache_instances", 2)),
+    )
+    parser.add_argument(
+        "--http_record",
+        default=getattr(Config, "http_record", None),
+        help=(
+            "The path to a file to save the ReST responses (and their timing) of "
+            "this run in, for --http_replay. The default is {0}"
+        ).format(getattr(Config, "http_record", None)),
+    )
+    parser.add_argument(
+        "--http_replay",
+        default=getattr(Config, "http_replay", None),
+        help=(
+            "The path to a file saved with --http_record. The ReST responses are "
+            "served from the file instead of the server (arcpy is still used). "
+            "The default is {0}"
+        ).format(getattr(Config, "http_replay", None)),
+    )
+    parser.add_argument(
+        "--replay_latency_scale",
+        type=float,
+        default=getattr(Config, "replay_latency_scale", 1.0),
+        help=(
+            "With --http_replay, the recorded response times are multiplied by "
+            "this (0 for no delay). The default is {0}"
+        ).format(getattr(Config, "replay_latency_scale", 1.0)),
+    )
+    parser.add_argument(
+        "--replay_failure_rate",
+        type=float,
+        default=getattr(Config, "replay_failure_rate", 0.0),
+        help=(
+            "With --http_replay, the fraction (0 to 1) of the requests that fail "
+            "with a 503 response. The default is {0}"
+        ).format(getattr(Config, "replay_failure_rate", 0.0)),
+    )
+    parser.add_argument(
+        "--trace_file",
+        default=getattr(Config, "trace_file", None),
+        help=(
+            "The path to a file for a trace of this run (the time spent by each "
+            "worker in each stage and ReST request) in the Chrome trace format. "
+            "Open it in chrome://tracing or https://ui.perfetto.dev. "
+            "The default is {0}"
+        ).format(getattr(Config, "trace_file", None)),
+    )
+    parser.add_argument(
+        "--trace_otlp",
+        default=getattr(Config, "trace_otlp", None),
+        help=(
+            "The URL of an OpenTelemetry collector (OTLP/HTTP) to send the trace "
+            "of this run to (i.e. {0}). The default is {1}"
+        ).format(tracing.OTLP_ENDPOINT, getattr(Config, "trace_otlp", None)),
+    )
+    parser.add_argument(
+        "--journal",
+        default=getattr(Config, "journal", None),
+        help=(
+            "The path to a journal file. The progress of each document is "
+            "written to the journal, so that an interrupted run can be resumed. "
+            "The default is {0}"
+        ).format(getattr(Config, "journal", None)),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Resume the last run (if it was interrupted). Work recorded as finished "
+            "in the journal is skipped, and interrupted work is repaired."
+        ),
+    )
+    parser.add_argument(
+        "--fingerprint_file",
+        default=getattr(Config, "fingerprint_file", None),
+        help=(
+            "The path to a file with a fingerprint of the documents, service list, "
+            "history file and server catalog after the last successful run. If "
+            "nothing has changed, the run ends immediately. "
+            "The default is {0}"
+        ).format(getattr(Config, "fingerprint_file", None)),
+    )
+    parser.add_argument(
+        "--report",
+        default=getattr(Config, "run_report", None),
+        help=(
+            "The path to a JSON file for a report of this run. Reports from "
+            "each shard can be merged with run_report.py. "
+            "The default is {0}"
+        ).format(getattr(Config, "run_report", None)),
+    )
     parser.add_argument(
         "-n",
         "--dryrun",
+        dest="dry_run",
         action="store_true",
         help="Dry run. Do not make changes on the server",
     )
@@ -121,12 +458,14 @@ def get_configuration_settings():
     )
 
     args = parser.parse_args()
+    if args.target is None:
+        args.target = getattr(Config, "targets", None)
 
     if args.verbose:
-        logger.parent.handlers[0].setLevel(logging.INFO)
+        queue_logging.set_level(logging.INFO, "console")
         logger.info("Started logging at INFO level")
     if args.debug:
-        logger.parent.handlers[0].setLevel(logging.DEBUG)
+        queue_logging.set_level(logging.DEBUG, "console")
         logger.debug("Started logging at DEBUG level")
         redacted_password = args.admin_password
         args.admin_password = "XX_redacted_XX"
@@ -136,32 +475,733 @@ def get_configuration_settings():
     return args
 
 
-def main():
-    """Publish and Un-publish documents on the server based on command line options."""
+def shard_type(text):
+    """Convert the --shard command line option to an (index, count) tuple."""
+    try:
+        return util.parse_shard(text)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
 
-    settings = get_configuration_settings()
+
+def publish_doc(doc, settings, report, force=False):
+    """Publish doc (if it is publishable) and add the outcome to the run report."""
+
+    start = time.time()
+    done = prepare_doc(doc, settings, report, force=force)
+    if done is not None:
+        return done
+    return upload_doc(doc, report, force=force, start=start)
+
+
+def prepare_doc(doc, settings, report, force=False):
+    """Draft, analyze and stage doc (see Doc.prepare()) for upload_doc().
+
+    This is called on the main thread, and only upload_doc() on a folder worker
+    (see mutation_scheduler.py); the arcpy uploads there take turns, since arcpy is
+    not thread safe (see Doc.upload()). Returns None if doc
+    is ready to upload; otherwise the outcome is added to the run report, and the
+    result is the same as publish_doc()."""
+
+    start = time.time()
+    if doc.is_rejected and not force:
+        logger.info("%s was rolled back; skipping until it changes", doc.name)
+        report.add("publish", doc, "rejected", time.time() - start)
+        return True
+    if not doc.is_publishable:
+        logger.warning("Unable to publish %s because %s", doc.name, doc.errors)
+        report.add("publish", doc, "not_publishable", time.time() - start, doc.errors)
+        return False
+    if settings.dry_run:
+        print(
+            "{0} is publishable as {1} with the following issues:".format(
+                doc.name, doc.service_path
+            )
+        )
+        print(doc.all_issues)
+        report.add("publish", doc, "dry_run", time.time() - start)
+        return True
+    try:
+        doc.prepare(force=force)
+    except PublishException as ex:
+        logger.error("Unable to publish %s because %s", doc.name, ex)
+        report.add("publish", doc, "failed", time.time() - start, ex)
+        return False
+    return None
+
+
+def upload_doc(doc, report, force=False, start=None):
+    """Publish doc (prepared by prepare_doc()) and add the outcome to the run report.
+
+    start is the time the work on doc started (the default is now)."""
+
+    if start is None:
+        start = time.time()
+    try:
+        doc.publish(force=force)
+        report.add("publish", doc, "published", time.time() - start)
+    except PublishException as ex:
+        logger.error("Unable to publish %s because %s", doc.name, ex)
+        report.add("publish", doc, "failed", time.time() - start, ex)
+        return False
+    return True
+
+
+def fan_out_doc(
+    doc, fan_out, settings, report, journal=None, force=False, warmer=None, staging=None
+):
+    """Publish doc to all the targets and add the outcome for each to the run report.
+
+    If staging (from fan_out.stage()) is provided, only the uploads are done here.
+    Returns True if doc was published (or was up to date) on all the targets."""
+
+    done = True
+    if staging is None:
+        staging = fan_out.stage(doc, force=force, dry_run=settings.dry_run)
+    results = fan_out.upload(doc, staging, force=force, dry_run=settings.dry_run)
+    for target in fan_out.targets:
+        result = results[target.name]
+        report.add(
+            "publish",
+            doc,
+            result["status"],
+            result["seconds"],
+            result["message"],
+            target=target.name,
+        )
+        if result["status"] in ("failed", "not_publishable"):
+            done = False
+        elif result["status"] == "published":
+            if journal is not None:
+                journal.record(
+                    journal_stages.TARGET_UPLOADED, doc.service_path, target=target.name
+                )
+            if warmer is not None:
+                warmer.submit(doc, target.server_url, target.name)
+    if done and journal is not None and not settings.dry_run:
+        journal.record(journal_stages.UPLOADED, doc.service_path)
+    return done
+
+
+def benchmark_doc(doc, bench, settings, report, results, force=False):
+    """Publish doc (prepared by prepare_doc()), and if it replaced a live service,
+    check the replacement for a performance regression (see benchmark.py). The
+    benchmark results are appended to results.
+
+    Returns True if doc was published and is not a regression."""
+
+    before = None
+    if not settings.dry_run and (force or not doc.is_up_to_date) and doc.is_live:
+        before = bench.run(doc.server_url, doc.service_path)
+    if not upload_doc(doc, report, force=force):
+        return False
+    if before is None:
+        return True
+    start = time.time()
+    wait_until_ready(doc.server_url, doc.service_path, settings.warmup_timeout)
+    after = bench.run(doc.server_url, doc.service_path)
+    status, message = benchmark.gate(
+        before, after, settings.benchmark_threshold, settings.regression_action
+    )
+    if status != "passed":
+        logger.error("%s is slower after the replacement: %s", doc.name, message)
+    if status == "rollback":
+        try:
+            doc.rollback()
+            status = "rolled_back"
+        except PublishException as ex:
+            logger.error("Unable to roll back %s because %s", doc.name, ex)
+            message = "{0}; unable to roll back: {1}".format(message, ex)
+            status = "regressed"
+    report.add("benchmark", doc, status, time.time() - start, message)
+    results.append(
+        {
+            "service_path": doc.service_path,
+            "status": status,
+            "before": before,
+            "after": after,
+        }
+    )
+    return status == "passed"
+
+
+def unpublish_doc(doc, settings, report, target=None):
+    """Remove the service for doc and add the outcome to the run report.
+
+    If target (a fanout.Target) is provided, the service is removed from that server."""
+
+    target_name = None
+    if target is not None:
+        doc.server = target.server
+        doc.server_url = target.server_url
+        target_name = target.name
+    start = time.time()
+    try:
+        if not doc.unpublish(dry_run=settings.dry_run):
+            raise PublishException("the service could not be deleted (see the log)")
+        status = "dry_run" if settings.dry_run else "unpublished"
+        report.add("unpublish", doc, status, time.time() - start, target=target_name)
+    except PublishException as ex:
+        logger.error("Unable to remove service for %s because %s", doc.name, ex)
+        report.add(
+            "unpublish", doc, "failed", time.time() - start, ex, target=target_name
+        )
+        return False
+    return True
+
+
+def queue_cache_update(cache_jobs, doc, changed_sources, settings, fan_out=None):
+    """Queue an update of the tiles that cover the changed_sources of doc.
+
+    settings is the document's row in the service_list (for the cache_scales)."""
+
+    scales = settings.get("cache_scales")
+    if scales:
+        scales = [float(scale) for scale in scales.split(",") if scale.strip()]
+    if fan_out is not None:
+        servers = [(target.server, target.server_url) for target in fan_out.targets]
+    else:
+        servers = [(doc.server, doc.server_url)]
+    for server, server_url in servers:
+        if server == "MY_HOSTED_SERVICES":
+            continue
+        cache_jobs.add(doc.service_path, server, server_url, changed_sources, scales)
+
+
+def report_warmup(warmer, report):
+    """Wait for the warm-up of the published services and add the results to report."""
+
+    results = warmer.wait()
+    details = []
+    for result in results:
+        status = "ready" if result["ready"] else "not_ready"
+        report.add(
+            "warmup",
+            result["doc"],
+            status,
+            result["seconds_to_ready"],
+            target=result["target"],
+        )
+        details.append(
+            dict((key, value) for key, value in result.items() if key != "doc")
+        )
+    report.set_section("warmup", details)
+
+
+def server_urls(settings):
+    """Return a list of the URLs of the servers to publish to."""
+
+    if settings.target:
+        return [parse_target(target).server_url for target in settings.target]
+    server_url = settings.server_url
+    if server_url is None and settings.server not in (None, "MY_HOSTED_SERVICES"):
+        server_url = util.get_service_url_from_ags_file(settings.server)
+    return [server_url]
+
+
+def compute_fingerprint(settings):
+    """Return a fingerprint of the inputs to this run (see fingerprint.py)."""
+
+    files = [settings.service_list, settings.history_file]
+    urls = server_urls(settings)
+    if settings.target:
+        return fingerprint.compute(settings.root_directory, files, urls)
+    return fingerprint.compute(settings.root_directory, files, urls[0])
+
+
+def is_successful(report):
+    """Return True if the run in report did all the work it could."""
+
+    for entry in report.entries:
+        if entry["status"] in ("failed", "deferred", "regressed", "rolled_back"):
+            return False
+    return True
+
+
+def update_cache_jobs(cache_jobs, report):
+    """Check the running cache jobs, submit the queued jobs (if it is off-peak), and
+    add them to the run report. The jobs submitted by earlier runs are in the report
+    of the run that sees them finish, so this is done by every run."""
+
+    if cache_jobs is None:
+        return
+    cache_jobs.refresh()
+    cache_jobs.submit_due()
+    cache_jobs.save()
+    report.set_section("tile_cache", cache_jobs.status())
+
+
+def create_folders(records, settings):
+    """Create the service folders of records that are missing on all the servers.
+
+    Done once, before any document is published, so uploads in parallel (see
+    mutation_scheduler.py) do not race to create a folder."""
+
+    folders = {}
+    for record in records:
+        if record.service_folder is not None:
+            folders.setdefault(record.service_folder.lower(), record.service_folder)
+    if not folders:
+        return
+    for url in server_urls(settings):
+        if url is None:
+            continue
+        creator = FolderCreator(url, settings.admin_username, settings.admin_password)
+        for key in sorted(folders):
+            creator(folders[key])
+
+
+def start_doc(doc, action, journal, progress, report):
+    """Prepare to publish/unpublish doc. Returns False if there is nothing to do.
+
+    If there is a journal, the progress of doc in an interrupted run (progress) is
+    used to skip finished work, and to repair interrupted work."""
+
+    if journal is None:
+        return True
+    key = (doc.service_path or "").lower()
+    stage, details = progress.get(key, (None, {}))
+    step = journal_stages.resume_step(stage, details)
+    if step == journal_stages.SKIP:
+        logger.info("%s was finished (%s) in the interrupted run", doc.name, stage)
+        report.add(action, doc, "resumed")
+        return False
+    if step == journal_stages.CHECK_LIVE and doc.is_live:
+        logger.info("%s was uploaded in the interrupted run", doc.name)
+        journal.record(journal_stages.UPLOADED, doc.service_path, repaired=True)
+        report.add(action, doc, "resumed")
+        return False
+    if step == journal_stages.UPLOAD:
+        # The old service is live, so is_live can not tell if it was replaced.
+        doc.require_upload()
+    elif step == journal_stages.DISCARD_DRAFT:
+        doc.discard_artifacts(draft=True)
+    elif step == journal_stages.DISCARD_SERVICE_DEFINITION:
+        doc.discard_artifacts(service_definition=True)
+    doc.add_listener(journal.listener)
+    journal.record(journal_stages.STARTED, doc.service_path)
+    return True
+
+
+def collect_usage(settings):
+    """Add the latest usage statistics from the server to the usage database.
+
+    Returns the usage.UsageStore (or None if there is no usage database)."""
+
+    if settings.usage_database is None:
+        return None
+    store = usage.UsageStore(settings.usage_database)
+    server_url = settings.server_url
+    server = settings.server
+    if settings.target:
+        # Use the first target (i.e. production) for the usage statistics
+        target = parse_target(settings.target[0])
+        server_url, server = target.server_url, target.server
+    if server_url is None and server not in (None, "MY_HOSTED_SERVICES"):
+        server_url = util.get_service_url_from_ags_file(server)
+    if (
+        server_url is None
+        or settings.admin_username is None
+        or settings.admin_password is None
+    ):
+        logger.info("Unable to collect usage without a server URL and credentials")
+        return store
+    token = util.get_token(server_url, settings.admin_username, settings.admin_password)
+    services = util.get_services_from_server(server_url)
+    if token is None or services is None:
+        logger.warning("Unable to collect usage from %s", server_url)
+        return store
+    collector = usage.UsageCollector(server_url, token)
+    count = usage.collect(store, collector, services)
+    logger.info("Collected %s usage records from %s", count, server_url)
+    store.prune(days=usage.HISTORY_DAYS * 4)
+    return store
+
+
+def schedule_jobs(documents, settings, dependencies, changed, usage_store=None):
+    """Return a scheduler with the documents to publish in priority order.
+
+    If there is a usage_store, busier services get a higher priority, and (with
+    --apply_usage) the recommended instance settings are added to the documents."""
+
+    max_runtime = None
+    if settings.max_runtime is not None:
+        max_runtime = settings.max_runtime * 60
+    daily_requests = None
+    recommendations = {}
+    if usage_store is not None:
+        daily_requests = usage_store.daily_requests()
+        if settings.apply_usage:
+            recommendations = usage_store.recommendations()
+    scheduler = Scheduler(settings.schedule_file, max_runtime, usage=daily_requests)
+    catalog = None
+    for record in documents.items_to_publish:
+        key = (record.service_path or "").lower()
+        if key in recommendations:
+            record.settings = usage.apply_recommendation(
+                record.settings, recommendations[key]
+            )
+        force = record.force or dependencies.is_changed(record.service_path, changed)
+        needs_work = force or not (record.is_up_to_date or record.is_rejected)
+        if not needs_work and record.is_uploaded is None:
+            # Published before uploads were recorded; it must be on the server.
+            if catalog is None:
+                catalog = CatalogSnapshot(settings.server_url)
+            needs_work = not catalog.contains(record.service_path)
+        scheduler.add(
+            record, priority=record.priority, needs_work=needs_work, force=force
+        )
+    return scheduler
+
+
+def enqueue_jobs(documents, settings, dependencies, changed):
+    """Add a job to the work queue for each document to publish and unpublish."""
+
+    queue = WorkQueue(settings.queue)
+    count = 0
+    for record in documents.items_to_publish:
+        force = record.force or dependencies.is_changed(record.service_path, changed)
+        if queue.enqueue(
+            "publish", record.service_path, record.path, record.folder, force=force
+        ):
+            count += 1
+    for record in documents.items_to_unpublish:
+        if queue.enqueue(
+            "unpublish",
+            record.service_path,
+            record.path,
+            record.folder,
+            record.service_name,
+        ):
+            count += 1
+    logger.info("Added %s jobs to the queue %s", count, settings.queue)
+
+
+def collect_queue_results(settings, dependencies):
+    """Update the dependency index with the results of the finished queued jobs."""
+
+    queue = WorkQueue(settings.queue)
+    for action, service_path, result in queue.results():
+        if action == "publish":
+            if result is not None:
+                dependencies.record_signatures(
+                    service_path, result["signatures"], seed=result["seed"]
+                )
+        else:
+            dependencies.remove(service_path)
+
+
+def work_queued_jobs(settings, report):
+    """Claim and do the jobs in the work queue until there are none left."""
+
+    queue = WorkQueue(settings.queue)
+    worker = worker_name()
+    # A worker does one job at a time, so the growth of each document is known.
+    profiler = MemoryProfiler() if settings.memory_profile else None
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            break
+        # The jobs are not known ahead, so drafts are not shared (see draft_template.py)
+        doc = DocRecord(
+            job.source_path,
+            folder=job.folder,
+            service_name=job.service_name,
+            config=settings,
+        ).materialize()
+        if profiler is not None:
+            profiler.begin(doc)
+            doc.add_listener(profiler.listener)
+        with LeaseKeeper(queue, job, worker):
+            if job.action == "publish":
+                done = publish_doc(doc, settings, report, force=job.force)
+            else:
+                done = unpublish_doc(doc, settings, report)
+        if profiler is not None:
+            profiler.end(doc)
+        if done:
+            result = None
+            if job.action == "publish":
+                # An up to date document was not drafted; its sources only seed the
+                # index (they are not known to be the published ones).
+                seed = doc.data_sources is None
+                sources = doc.list_data_sources()
+                if sources is not None:
+                    result = {
+                        "signatures": dependency_index.signatures(sources),
+                        "seed": seed,
+                    }
+            queue.complete(job, worker, result)
+        else:
+            queue.fail(job, worker, report.entries[-1].get("message"))
+    logger.info("No more jobs in the queue. Counts: %s", queue.counts())
+    if profiler is not None:
+        profiler.add_to_report(report)
+
+
+def save_trace(settings):
+    """Save or export the trace of this run (if it was traced)."""
+
+    tracer = tracing.stop()
+    if tracer is None:
+        return
+    if settings.trace_file is not None:
+        try:
+            tracer.save_chrome_trace(settings.trace_file)
+        except (IOError, OSError) as ex:
+            logger.error("Unable to save the trace %s: %s", settings.trace_file, ex)
+    if settings.trace_otlp is not None:
+        tracer.export_otlp(settings.trace_otlp)
+
+
+def set_http_transport(settings):
+    """Record or replay the ReST requests of this run (see http_replay.py)."""
+
+    if settings.http_replay is not None:
+        rest.set_transport(
+            http_replay.Replayer(
+                settings.http_replay,
+                latency_scale=settings.replay_latency_scale,
+                failure_rate=settings.replay_failure_rate,
+            )
+        )
+    elif settings.http_record is not None:
+        rest.set_transport(http_replay.Recorder(settings.http_record))
+
+
+def publish(settings):
+    """Publish and Un-publish documents on the server based on settings."""
+
+    report = RunReport(shard=settings.shard)
+    adaptive_limit.configure(maximum=settings.max_concurrency)
+    if settings.queue is not None and settings.worker:
+        work_queued_jobs(settings, report)
+        report.save(settings.report)
+        return
+    dependencies = DependencyIndex(settings.dependency_index)
+    if settings.queue is not None and settings.enqueue:
+        collect_queue_results(settings, dependencies)
+    changed = dependencies.changed_services()
+    cache_jobs = None
+    if settings.cache_jobs is not None and not settings.dry_run:
+        cache_jobs = CacheJobs(
+            settings.cache_jobs,
+            window=settings.cache_window,
+            instances=settings.cache_instances,
+            username=settings.admin_username,
+            password=settings.admin_password,
+        )
+    check_fingerprint = settings.fingerprint_file is not None and not (
+        settings.dry_run or settings.resume or settings.enqueue
+    )
+    if check_fingerprint and not changed:
+        last_fingerprint = fingerprint.load(settings.fingerprint_file)
+        if last_fingerprint is not None:
+            if compute_fingerprint(settings) == last_fingerprint:
+                logger.info("Nothing has changed since the last successful run.")
+                # The queued and running cache jobs are not part of the fingerprint
+                update_cache_jobs(cache_jobs, report)
+                report.save(settings.report)
+                return
     documents = Documents(config=settings)
-    for doc in documents.items_to_publish:
-        if doc.is_publishable:
-            try:
-                if settings.dry_run:
-                    print(
-                        "{0} is publishable as {1} with the following issues:".format(
-                            doc.name, doc.service_path
-                        )
-                    )
-                    print(doc.issues)
-                else:
-                    doc.publish()
-            except PublishException as ex:
-                logger.error("Unable to publish %s because %s", doc.name, ex)
+    if settings.queue is not None and settings.enqueue:
+        enqueue_jobs(documents, settings, dependencies, changed)
+        dependencies.save()
+        return
+    journal = None
+    progress = {}
+    if settings.journal is not None:
+        journal = Journal(settings.journal)
+        if settings.resume:
+            progress = journal.incomplete_run()
+        journal.start_run(resume=settings.resume)
+    fan_out = None
+    if settings.target:
+        fan_out = FanOut([parse_target(target) for target in settings.target])
+    warmer = None
+    if settings.warmup and not settings.dry_run:
+        warmer = Warmup(
+            getattr(Config, "warmup_requests", WARMUP_REQUESTS),
+            timeout=settings.warmup_timeout,
+        )
+    bench = None
+    benchmarks = []
+    if settings.benchmark and not settings.dry_run:
+        if fan_out is not None:
+            logger.warning("Benchmarks are not supported with --target; skipping")
+        else:
+            bench = Benchmark(
+                benchmark.load_requests(settings.benchmark_requests),
+                concurrency=settings.benchmark_concurrency,
+            )
+    profiler = None
+    if settings.memory_profile:
+        # Folders published in parallel share the memory of the process.
+        profiler = MemoryProfiler(serial=settings.folder_workers <= 1)
+    usage_store = collect_usage(settings)
+    scheduler = schedule_jobs(documents, settings, dependencies, changed, usage_store)
+    if not settings.dry_run:
+        create_folders(scheduler.planned, settings)
+    mutations = MutationScheduler(settings.folder_workers)
+    # The copies of a document in the planned work share a draft
+    templates = DraftTemplates([record.path for record in scheduler.planned])
+
+    def prepare_record(record, force, start):
+        """Do the arcpy work (drafting, analysis and staging) for record on the main
+        thread, and submit the rest to the folder workers."""
+        doc = record.materialize(templates)
+        if not start_doc(doc, "publish", journal, progress, report):
+            return
+        if force:
+            logger.info(
+                "The data for %s has changed (or it is forced), republishing.", doc.name
+            )
+        if profiler is not None:
+            profiler.begin(doc)
+            doc.add_listener(profiler.listener)
+        staging = None
+        if fan_out is not None:
+            staging = fan_out.stage(doc, force=force, dry_run=settings.dry_run)
+        else:
+            done = prepare_doc(doc, settings, report, force=force)
+            if done is not None:
+                # Rejected, not publishable, failed or a dry run; nothing to upload.
+                sources = index_sources(doc) if done else None
+                finish_record(record, force, doc, done, sources, start)
+                return
+        mutations.submit(
+            record.service_folder,
+            upload_record,
+            record,
+            force,
+            doc,
+            staging,
+            index_sources(doc),
+            start,
+        )
+
+    def index_sources(doc):
+        """Return the data sources of doc to record in the dependency index; read
+        here (on the main thread) since it may need arcpy."""
+        if settings.dry_run or doc.data_sources is not None:
+            return doc.data_sources
+        if dependencies.contains(doc.service_path):
+            return None
+        # Index the up to date services published before the index was kept
+        return doc.list_data_sources()
+
+    def upload_record(record, force, doc, staging, sources, start):
+        """Upload doc (prepared by prepare_record()); runs on a folder worker."""
+        if fan_out is not None:
+            done = fan_out_doc(
+                doc,
+                fan_out,
+                settings,
+                report,
+                journal,
+                force=force,
+                warmer=warmer,
+                staging=staging,
+            )
         else:
-            logger.warning("Unable to publish %s because %s", doc.name, doc.errors)
-    for doc in documents.items_to_unpublish:
+            if warmer is not None:
+                doc.add_listener(warmer.listener)
+            if bench is not None:
+                done = benchmark_doc(doc, bench, settings, report, benchmarks, force)
+            else:
+                done = upload_doc(doc, report, force=force, start=start)
+        finish_record(record, force, doc, done, sources, start)
+
+    def finish_record(record, force, doc, done, sources, start):
+        """Record the outcome of publishing doc (may run on a folder worker)."""
+        if profiler is not None:
+            profiler.end(doc)
+        if done and not settings.dry_run:
+            if force and cache_jobs is not None:
+                changed_sources = dependencies.changed_sources(doc.service_path)
+                if changed_sources:
+                    queue_cache_update(
+                        cache_jobs, doc, changed_sources, record.settings, fan_out
+                    )
+            dependencies.record(doc.service_path, sources)
+            scheduler.finished(doc, time.time() - start)
+        elif not settings.dry_run and doc.is_rejected:
+            # Rolled back; only later changes to the data are worth another try.
+            dependencies.record(doc.service_path, doc.data_sources)
+
+    for record, force in scheduler.jobs():
         try:
-            doc.unpublish(dry_run=settings.dry_run)
-        except PublishException as ex:
-            logger.error("Unable to remove service for %s because %s", doc.name, ex)
+            prepare_record(record, force, time.time())
+        finally:
+            # Drafted or not (i.e. rejected), its copies no longer wait for it.
+            templates.done(record.path)
+    # i.e. the copies deferred by the time budget
+    templates.free()
+    mutations.wait()
+    for record in scheduler.deferred:
+        report.add("publish", record, "deferred")
+    mutations = MutationScheduler(settings.folder_workers)
+
+    def unpublish_record(record):
+        doc = record.materialize()
+        if not start_doc(doc, "unpublish", journal, progress, report):
+            return
+        if fan_out is not None:
+            done = all(
+                [
+                    unpublish_doc(doc, settings, report, target)
+                    for target in fan_out.targets
+                ]
+            )
+        else:
+            done = unpublish_doc(doc, settings, report)
+        if done and not settings.dry_run:
+            dependencies.remove(doc.service_path)
+
+    for record in documents.items_to_unpublish:
+        mutations.submit(record.service_folder, unpublish_record, record)
+    mutations.wait()
+    if warmer is not None:
+        report_warmup(warmer, report)
+    if benchmarks:
+        report.set_section("benchmark", benchmarks)
+    if profiler is not None:
+        profiler.add_to_report(report)
+    report.set_section("concurrency", adaptive_limit.summaries())
+    report.set_section("drafts", templates.summary())
+    if documents.service_list is not None and documents.service_list.issues:
+        report.set_section(
+            "service_list",
+            [
+                {"line": line, "message": message}
+                for line, message in documents.service_list.issues
+            ],
+        )
+    update_cache_jobs(cache_jobs, report)
+    dependencies.save()
+    scheduler.save()
+    if journal is not None:
+        journal.finish_run()
+    if check_fingerprint:
+        if is_successful(report):
+            fingerprint.save(compute_fingerprint(settings), settings.fingerprint_file)
+        else:
+            # Make sure the next run does not skip the unfinished work.
+            fingerprint.save("", settings.fingerprint_file)
+    report.save(settings.report)
+    logger.info("Run summary: %s", report.summary())
+
+
+def main():
+    """Publish and Un-publish documents on the server based on command line options."""
+
+    settings = get_configuration_settings()
+    set_http_transport(settings)
+    if settings.trace_file is not None or settings.trace_otlp is not None:
+        tracing.start()
+    try:
+        publish(settings)
+    finally:
+        save_trace(settings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Move the log handlers off the publishing threads.
+
+After logging is configured (i.e. with logging.config.dictConfig), start()
+replaces the handlers on the root logger with a single QueueHandler, and
+forwards the queued records to the original handlers on a background thread.
+A thread that logs only puts the record on a queue; writing to a (network) log
+file, or sending email, never blocks it. The records in the queue are written
+when the process exits (or when stop() is called).
+
+Python 2 does not have QueueHandler and QueueListener, so simple versions are
+provided here.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import atexit
+import logging
+import logging.handlers
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+_listener = None
+
+
+if hasattr(logging.handlers, "QueueListener"):
+    QueueHandler = logging.handlers.QueueHandler
+
+    def _make_listener(records, handlers):
+        return logging.handlers.QueueListener(
+            records, *handlers, respect_handler_level=True
+        )
+
+else:
+
+    class QueueHandler(logging.Handler):
+        """Put log records on a queue (see logging.handlers.QueueHandler)."""
+
+        def __init__(self, records):
+            logging.Handler.__init__(self)
+            self.queue = records
+
+        def prepare(self, record):
+            """Merge the args and exception into the message, so the record can
+            be handled later (or in another thread)."""
+            self.format(record)
+            record.msg = record.message
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class _QueueListener(object):
+        """Handle the records on a queue in a background thread (see
+        logging.handlers.QueueListener)."""
+
+        _sentinel = None
+
+        def __init__(self, records, handlers):
+            self.queue = records
+            self.handlers = handlers
+            self.__thread = None
+
+        def start(self):
+            """Start handling the queued records."""
+            self.__thread = threading.Thread(target=self.__monitor)
+            self.__thread.daemon = True
+            self.__thread.start()
+
+        def stop(self):
+            """Handle the remaining records, and stop the background thread."""
+            self.queue.put_nowait(self._sentinel)
+            self.__thread.join()
+            self.__thread = None
+
+        def __monitor(self):
+            while True:
+                record = self.queue.get()
+                if record is self._sentinel:
+                    break
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+    def _make_listener(records, handlers):
+        return _QueueListener(records, handlers)
+
+
+def start():
+    """Put the handlers of the root logger behind a queue. Does nothing if they
+    already are."""
+    global _listener  # pylint: disable=global-statement
+
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if not handlers:
+        return
+    records = queue.Queue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    _listener = _make_listener(records, handlers)
+    _listener.start()
+    atexit.register(stop)
+
+
+def stop():
+    """Write the queued records, and put the handlers back on the root logger."""
+    global _listener  # pylint: disable=global-statement
+
+    if _listener is None:
+        return
+    listener = _listener
+    _listener = None
+    listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
+
+
+def set_level(level, handler_name):
+    """Set the level of the handler named handler_name (in the logging config).
+
+    The root logger's level is lowered if needed, so that the records reach it."""
+    if _listener is not None:
+        handlers = _listener.handlers
+    else:
+        handlers = logging.getLogger().handlers
+    for handler in handlers:
+        if handler.name == handler_name:
+            handler.setLevel(level)
+    root = logging.getLogger()
+    if level < root.level:
+        root.setLevel(level)
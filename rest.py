@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+The HTTP client for the ArcGIS Server ReST and admin APIs.
+
+All the requests to ArcGIS Server go through get() and post() (thin wrappers of
+the same functions in `requests`), so that every request is traced (see
+tracing.py), and the number of concurrent requests to each server is limited
+(see adaptive_limit.py). Admin requests (edits and deletes) and ReST requests
+(catalog and service requests) have separate limits, and the latency of each
+request is compared with earlier requests to the same endpoint (see _endpoint()).
+ArcGIS answers most errors with a 200 status and a JSON error, so the body of
+an admin response is checked too (see is_server_error()).
+
+The requests are sent by a transport: an object with a request() method like
+requests.request(). The default sends them with `requests`; set_transport()
+replaces it, i.e. with an http_replay.Recorder to save the responses (and their
+timing), or an http_replay.Replayer to serve saved responses without a server.
+
+Requires the 3rd party `requests` module (`pip install requests`), unless the
+responses are replayed.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse  # Python 2
+
+import threading
+
+try:
+    import requests
+except ImportError:
+    # Only replayed responses (see http_replay.py) can be used without requests.
+    requests = None
+
+import adaptive_limit
+import tracing
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# The last part of a service's URL (i.e. .../Folder/Roads/MapServer)
+SERVICE_TYPES = (
+    "MapServer",
+    "ImageServer",
+    "FeatureServer",
+    "GPServer",
+    "GeometryServer",
+    "GeocodeServer",
+    "GlobeServer",
+    "SceneServer",
+)
+
+if requests is not None:
+    RequestException = requests.exceptions.RequestException
+    HTTPError = requests.exceptions.HTTPError
+else:
+
+    class RequestException(IOError):
+        """A stand-in for requests.exceptions.RequestException."""
+
+    class HTTPError(RequestException):
+        """A stand-in for requests.exceptions.HTTPError."""
+
+
+class RequestsTransport(object):
+    """Sends requests to the server with `requests` (the default transport)."""
+
+    # pylint: disable=too-few-public-methods
+
+    @staticmethod
+    def request(method, url, **kwargs):
+        """Send a request; the arguments are the same as requests.request()."""
+        if requests is None:
+            raise ImportError("Sending requests requires `pip install requests`")
+        return requests.request(method, url, **kwargs)
+
+
+_transport = RequestsTransport()
+_transport_lock = threading.Lock()
+
+
+def set_transport(transport):
+    """Send all the requests with transport (None for the default); returns the
+    transport that was replaced."""
+    global _transport  # pylint: disable=global-statement
+    with _transport_lock:
+        previous = _transport
+        _transport = transport if transport is not None else RequestsTransport()
+    return previous
+
+
+def get(url, **kwargs):
+    """Send a GET request; the arguments are the same as requests.get()."""
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send a POST request; the arguments are the same as requests.post()."""
+    return request("POST", url, **kwargs)
+
+
+def request(method, url, limited=True, **kwargs):
+    """Send a request; the arguments are the same as requests.request().
+
+    If limited is False, the request does not count toward (or wait for) the limit
+    of concurrent requests; i.e. for a load test."""
+    kind = "admin" if "/admin/" in url else "rest"
+    if limited:
+        limiter = adaptive_limit.limiter(kind, urlparse(url).netloc)
+        slot = limiter.slot(_endpoint(url))
+    else:
+        slot = adaptive_limit.UNLIMITED
+    with slot:
+        # The query string is not traced; it may have a token.
+        with tracing.span("rest", method=method, url=url.split("?", 1)[0]) as span:
+            response = _transport.request(method, url, **kwargs)
+            span.set("status", response.status_code)
+            if is_server_error(response, check_body=kind == "admin"):
+                slot.failed()
+            return response
+
+
+def is_server_error(response, check_body=True):
+    """Return True if response is a server error: a 5xx status, or (if check_body)
+    a JSON error that is not a client error (a 4xx code, i.e. a bad token).
+
+    The ReST API errors are {"error": {"code": 500, ...}}, and the admin API errors
+    are {"status": "error", "code": 500, "messages": [...]}; either may have a 200
+    status, and the code may be missing."""
+    if response.status_code >= 500:
+        return True
+    if not check_body:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    if isinstance(body.get("error"), dict):
+        code = body["error"].get("code")
+    elif body.get("status") == "error":
+        code = body.get("code")
+    else:
+        return False
+    try:
+        return not 400 <= int(code) < 500
+    except (TypeError, ValueError):
+        return True
+
+
+def _endpoint(url):
+    """Return the endpoint of url without the folder and service names, i.e.
+    'MapServer/export', 'catalog' or 'generateToken'."""
+    parts = [part for part in urlparse(url).path.split("/") if part]
+    for index, part in enumerate(parts):
+        # Admin URLs have the type after the name (i.e. Roads.MapServer)
+        service_type = part.split(".")[-1]
+        if service_type in SERVICE_TYPES:
+            return "/".join([service_type] + parts[index + 1 : index + 2])
+    if "rest" in parts and "services" in parts:
+        return "catalog"
+    return parts[-1] if parts else ""
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the ReST client transports, and recording and replaying responses.
+
+Run with: python -m pytest rest_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import adaptive_limit
+import http_replay
+import rest
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+SERVER = "https://gis.example.com/arcgis"
+
+
+class FakeServer(object):
+    """A transport that answers with a JSON document after a delay."""
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        """Return a catalog (or a token) response."""
+        self.requests.append((method, url, kwargs))
+        time.sleep(self.seconds)
+        if url.endswith("/generateToken"):
+            body = {"token": "secret-token", "expires": 1}
+        else:
+            body = {
+                "folders": ["Transport"],
+                "services": [],
+                "call": len(self.requests),
+            }
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+def record(path, server):
+    """Record a token request and two catalog requests to path."""
+    previous = rest.set_transport(http_replay.Recorder(path, server))
+    try:
+        rest.post(
+            SERVER + "/admin/generateToken",
+            data={"username": "admin", "password": "secret", "f": "json"},
+        )
+        rest.get(SERVER + "/rest/services?f=json", params={"token": "secret-token"})
+        rest.get(SERVER + "/rest/services", params={"f": "json", "token": "other"})
+    finally:
+        rest.set_transport(previous)
+
+
+def test_record_and_replay():
+    """Replayed responses match the recorded ones, without secrets."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "run.jsonl")
+        server = FakeServer()
+        record(path, server)
+        with open(path, "r", encoding="utf-8") as in_file:
+            text = in_file.read()
+        print(text)
+        assert "secret" not in text
+        assert len(text.splitlines()) == 3
+
+        replayer = http_replay.Replayer(path, latency_scale=0)
+        previous = rest.set_transport(replayer)
+        try:
+            token = rest.post(
+                SERVER + "/admin/generateToken",
+                data={"username": "someone", "password": "else", "f": "json"},
+            ).json()
+            assert token["token"] == http_replay.REDACTED
+            # The same request is answered in the recorded order, then repeats.
+            calls = [
+                rest.get(SERVER + "/rest/services", params={"f": "json"}).json()["call"]
+                for _ in range(3)
+            ]
+            assert calls == [2, 3, 2]
+            try:
+                rest.get(SERVER + "/rest/services/Transport?f=json")
+                assert False, "an unrecorded request should fail"
+            except rest.RequestException:
+                pass
+        finally:
+            rest.set_transport(previous)
+        assert len(server.requests) == 3
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_replay_scales_latency():
+    """The recorded latency is multiplied by the latency_scale."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "run.jsonl")
+        record(path, FakeServer(seconds=0.05))
+        replayer = http_replay.Replayer(path, latency_scale=3.0)
+        start = time.time()
+        response = replayer.request("GET", SERVER + "/rest/services?f=json")
+        assert time.time() - start >= 0.14
+        assert response.status_code == 200
+        start = time.time()
+        http_replay.Replayer(path, latency_scale=0).request(
+            "GET", SERVER + "/rest/services?f=json"
+        )
+        assert time.time() - start < 0.05
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_replay_injects_failures():
+    """A fraction of the replayed requests fail with a status, or an error."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "run.jsonl")
+        record(path, FakeServer())
+        url = SERVER + "/rest/services?f=json"
+        replayer = http_replay.Replayer(path, latency_scale=0, failure_rate=1.0)
+        response = replayer.request("GET", url)
+        assert response.status_code == 503
+        try:
+            response.raise_for_status()
+            assert False, "a 503 response should raise"
+        except rest.HTTPError:
+            pass
+        replayer = http_replay.Replayer(
+            path, latency_scale=0, failure_rate=0.5, failure_status=None, seed=1
+        )
+        failures = 0
+        for _ in range(100):
+            try:
+                replayer.request("GET", url)
+            except rest.RequestException:
+                failures += 1
+        assert 30 < failures < 70
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_json_errors_are_failures():
+    """ArcGIS errors with a 200 status count as failed admin requests, unless they
+    are client errors (i.e. an invalid token)."""
+
+    def response(body, status=200):
+        return http_replay.ReplayResponse(
+            status, json.dumps(body), SERVER, "application/json"
+        )
+
+    assert rest.is_server_error(response({"status": "error", "code": 500}))
+    assert rest.is_server_error(response({"error": {"message": "Internal"}}))
+    assert rest.is_server_error(response({}, status=502), check_body=False)
+    assert not rest.is_server_error(response({"error": {"code": 498}}))
+    assert not rest.is_server_error(response({"status": "success"}))
+    assert not rest.is_server_error(response({"error": {"code": 500}}), False)
+    assert not rest.is_server_error(
+        http_replay.ReplayResponse(200, "<html></html>", SERVER, "text/html")
+    )
+
+    print("test the admin limiter counts the error")
+
+    class ErrorServer(object):
+        """Answers every request with an admin API error."""
+
+        @staticmethod
+        def request(method, url, **kwargs):
+            """Return an error with a 200 status."""
+            # pylint: disable=unused-argument
+            return response({"status": "error", "messages": ["Busy"], "code": 500})
+
+    previous = rest.set_transport(ErrorServer())
+    try:
+        url = "https://errors.example.com/arcgis/admin/services/Roads.MapServer/edit"
+        rest.post(url, data={"f": "json"})
+    finally:
+        rest.set_transport(previous)
+    limiter = adaptive_limit.limiter("admin", "errors.example.com")
+    assert limiter.summary()["errors"] == 1
+
+
+if __name__ == "__main__":
+    test_record_and_replay()
+    test_replay_scales_latency()
+    test_replay_injects_failures()
+    test_json_errors_are_failures()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+A record of what was done (or not done) during a publishing run.
+
+The report is saved as a JSON file. When a run is split across several
+publishing nodes (see the --shard option in publisher.py) each node writes its
+own report, and they can be combined with:
+
+    python run_report.py merged.json shard1.json shard2.json ...
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+
+class RunReport(object):
+    """The outcome of each publish/unpublish action in a run."""
+
+    def __init__(self, shard=None):
+        self.__shard = shard
+        self.__started = time.time()
+        self.__finished = None
+        self.__entries = []
+        self.__sections = {}
+        # Documents in different folders are published on different threads.
+        self.__lock = threading.Lock()
+
+    @property
+    def entries(self):
+        """Return the list of entries (dictionaries) added to the report."""
+        return self.__entries
+
+    def add(self, action, doc, status, seconds=None, message=None, target=None):
+        """Add the outcome of an action (i.e. 'publish') on a document to the report.
+
+        doc is anything with a name and a service_path (i.e. a Doc).
+        target is the name of the server, when publishing to several (see fanout.py).
+        """
+        entry = {
+            "action": action,
+            "name": doc.name,
+            "service_path": doc.service_path,
+            "status": status,
+        }
+        if seconds is not None:
+            entry["seconds"] = round(seconds, 3)
+        if message is not None:
+            entry["message"] = "{0}".format(message)
+        if target is not None:
+            entry["target"] = target
+        with self.__lock:
+            self.__entries.append(entry)
+        return entry
+
+    def set_section(self, name, value):
+        """Add (or replace) a named section of additional (JSON compatible) details."""
+        self.__sections[name] = value
+
+    def summary(self):
+        """Return a dictionary of counts of each action/status."""
+        with self.__lock:
+            return summarize(self.__entries)
+
+    def as_dict(self):
+        """Return the report as a JSON compatible dictionary."""
+        if self.__finished is None:
+            self.__finished = time.time()
+        report = {
+            "started": self.__started,
+            "finished": self.__finished,
+            "summary": self.summary(),
+            "entries": self.__entries,
+        }
+        if self.__shard is not None:
+            report["shard"] = "{0}/{1}".format(*self.__shard)
+        report.update(self.__sections)
+        return report
+
+    def save(self, path):
+        """Write the report to path as JSON."""
+        if path is None:
+            return
+        save(self.as_dict(), path)
+
+
+def summarize(entries):
+    """Return a dictionary of counts of each action/status in entries."""
+    counts = {}
+    for entry in entries:
+        key = "{0}:{1}".format(entry["action"], entry["status"])
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def load(path):
+    """Return the report (as a dictionary) saved in the JSON file at path."""
+    with open(path, "r", encoding="utf-8") as in_file:
+        return json.load(in_file)
+
+
+def save(report, path):
+    """Write the report (a dictionary) to path as JSON."""
+    try:
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(report, indent=2, sort_keys=True))
+    except Exception as ex:
+        logger.warning("Unable to save the run report to %s: %s", path, ex)
+
+
+def merge(reports):
+    """Combine a list of report dictionaries (one per shard) into one report.
+
+    The entries are concatenated and summarized. Any other sections are kept
+    (per shard) in the 'shards' list."""
+    merged = {"started": None, "finished": None, "entries": [], "shards": []}
+    for report in reports:
+        started = report.get("started")
+        finished = report.get("finished")
+        if started is not None and (
+            merged["started"] is None or started < merged["started"]
+        ):
+            merged["started"] = started
+        if finished is not None and (
+            merged["finished"] is None or finished > merged["finished"]
+        ):
+            merged["finished"] = finished
+        merged["entries"].extend(report.get("entries", []))
+        details = dict(
+            (key, value)
+            for key, value in report.items()
+            if key not in ("entries", "started", "finished")
+        )
+        merged["shards"].append(details)
+    merged["summary"] = summarize(merged["entries"])
+    return merged
+
+
+def main():
+    """Merge the reports named on the command line."""
+    if len(sys.argv) < 3:
+        print("Usage: {0} OUTPUT INPUT [INPUT ...]".format(sys.argv[0]))
+        sys.exit(1)
+    reports = [load(path) for path in sys.argv[2:]]
+    save(merge(reports), sys.argv[1])
+
+
+if __name__ == "__main__":
+    main()
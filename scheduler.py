@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+A time budgeted scheduler for the documents to publish.
+
+Documents are ordered by a score, highest first:
+    score = PRIORITY_WEIGHT * priority     (the priority column in the service_list)
+          + hours since the source document changed (capped at MAX_WAIT_HOURS)
+          + hours since the document was first deferred (capped at MAX_WAIT_HOURS)
+          + USAGE_WEIGHT * log10(1 + requests per day)  (if usage is known)
+A document is only started if the estimate of its duration (from previous runs)
+fits in the time left in the budget; otherwise it is deferred to the next run.
+Documents with a current service definition (no real work) are always started.
+
+The durations and the backlog of deferred documents are saved in a JSON file:
+  {"durations": {"service_path": seconds, ...},
+   "backlog": {"service_path": time first deferred, ...}}
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+PRIORITY_WEIGHT = 24.0
+USAGE_WEIGHT = 6.0
+MAX_WAIT_HOURS = 24.0 * 7
+
+# Duration (seconds) assumed for a document that has never been timed.
+DEFAULT_DURATION = 300.0
+
+# Weight of the latest duration in the running average of durations.
+DURATION_SMOOTHING = 0.5
+
+
+class Scheduler(object):
+    """Orders the documents to publish and decides which fit in the time budget."""
+
+    def __init__(self, path=None, max_runtime=None, usage=None):
+        """path is the JSON file with the saved state (may be None).
+        max_runtime is the time budget in seconds (None for no limit).
+        usage is an optional dictionary of requests per day for each service path."""
+        self.__path = path
+        self.__max_runtime = max_runtime
+        self.__usage = dict(
+            (key.lower(), value) for key, value in (usage or {}).items()
+        )
+        self.__durations = {}
+        self.__backlog = {}
+        self.__jobs = []
+        self.__needs_work = set()
+        self.__started = None
+        self.__deferred = []
+        # Documents in different folders finish on different threads.
+        self.__lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.__load()
+
+    @property
+    def deferred(self):
+        """Return the list of documents deferred to the next run."""
+        return self.__deferred
+
+    @property
+    def planned(self):
+        """Return the list of documents with real work to do, in the order added."""
+        return [job[2] for job in self.__jobs if job[3]]
+
+    def add(self, doc, priority=0, needs_work=True, force=False):
+        """Add doc (a DocRecord) to the list of jobs. force is passed on to the publisher."""
+        score = None
+        if needs_work:
+            score = self.__score(doc, priority)
+            self.__needs_work.add(_key(doc.service_path))
+        self.__jobs.append((score, len(self.__jobs), doc, needs_work, force))
+
+    def estimate(self, service_path):
+        """Return the expected time (in seconds) to publish service_path."""
+        return self.__durations.get(_key(service_path), DEFAULT_DURATION)
+
+    def jobs(self):
+        """Yield (doc, force) in order of decreasing score; skipping (deferring) jobs
+        with a duration estimate that will not fit in the remaining time budget."""
+        self.__started = time.time()
+        # Jobs without any real work (score is None) go first; they are quick.
+        ordered = sorted(
+            self.__jobs, key=lambda job: (job[0] is not None, -(job[0] or 0), job[1])
+        )
+        for score, _, doc, needs_work, force in ordered:
+            if needs_work and not self.__fits(doc.service_path):
+                logger.info(
+                    "Deferring %s (score %.1f) to the next run", doc.name, score
+                )
+                self.__deferred.append(doc)
+                self.__backlog.setdefault(_key(doc.service_path), time.time())
+                continue
+            yield doc, force
+
+    def finished(self, doc, seconds):
+        """Record the time it took to publish doc; it is removed from the backlog."""
+        key = _key(doc.service_path)
+        with self.__lock:
+            self.__backlog.pop(key, None)
+            if key not in self.__needs_work:
+                return
+            if key in self.__durations:
+                old = self.__durations[key]
+                seconds = DURATION_SMOOTHING * seconds + (1 - DURATION_SMOOTHING) * old
+            self.__durations[key] = seconds
+
+    def save(self):
+        """Save the durations and backlog for the next run."""
+        if self.__path is None:
+            return
+        state = {"durations": self.__durations, "backlog": self.__backlog}
+        try:
+            with open(self.__path, "w", encoding="utf-8") as out_file:
+                out_file.write(json.dumps(state, indent=2, sort_keys=True))
+        except Exception as ex:
+            logger.warning("Unable to save the schedule %s: %s", self.__path, ex)
+
+    def __fits(self, service_path):
+        if self.__max_runtime is None:
+            return True
+        elapsed = time.time() - self.__started
+        return elapsed + self.estimate(service_path) <= self.__max_runtime
+
+    def __score(self, doc, priority):
+        key = _key(doc.service_path)
+        now = time.time()
+        score = PRIORITY_WEIGHT * priority
+        try:
+            changed = os.path.getmtime(doc.path)
+            score += min(MAX_WAIT_HOURS, max(0, now - changed) / 3600.0)
+        except (OSError, TypeError):
+            pass
+        if key in self.__backlog:
+            score += min(MAX_WAIT_HOURS, (now - self.__backlog[key]) / 3600.0)
+        if key in self.__usage:
+            score += USAGE_WEIGHT * math.log10(1 + max(0, self.__usage[key]))
+        return score
+
+    def __load(self):
+        try:
+            with open(self.__path, "r", encoding="utf-8") as in_file:
+                state = json.load(in_file)
+            self.__durations = state.get("durations", {})
+            self.__backlog = state.get("backlog", {})
+        except Exception as ex:
+            logger.warning("Unable to load the schedule %s: %s", self.__path, ex)
+
+
+def _key(service_path):
+    """Service paths are case insensitive on the server."""
+    return (service_path or "").lower()
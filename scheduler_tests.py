@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the time budgeted scheduler of the documents to publish.
+
+Run with: python -m pytest scheduler_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from doc_record import DocRecord
+import scheduler
+from scheduler import Scheduler
+
+
+def records(*names):
+    """Return a DocRecord for each service name (the documents do not exist)."""
+    return [DocRecord(None, service_name=name) for name in names]
+
+
+def test_order():
+    """Jobs without work go first, then jobs by decreasing score."""
+    low, high, none, usage = records("Low", "High", "None", "Busy")
+    jobs = Scheduler(usage={"busy": 10000})
+    jobs.add(low, priority=0)
+    jobs.add(high, priority=2, force=True)
+    jobs.add(none, needs_work=False)
+    jobs.add(usage, priority=0)
+    order = [(doc.service_name, force) for doc, force in jobs.jobs()]
+    print(order)
+    assert order == [("None", False), ("High", True), ("Busy", False), ("Low", False)]
+    assert jobs.deferred == []
+    assert [doc.service_name for doc in jobs.planned] == ["Low", "High", "Busy"]
+
+
+def test_budget_defers_jobs():
+    """Jobs that do not fit in the budget are deferred (and remembered); jobs without
+    work are never deferred."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "schedule.json")
+        with open(path, "w") as out_file:
+            json.dump(
+                {"durations": {"slow": 500, "quick": 10}, "backlog": {}}, out_file
+            )
+        slow, quick, none = records("Slow", "Quick", "None")
+        jobs = Scheduler(path, max_runtime=100)
+        jobs.add(slow, priority=1)
+        jobs.add(quick)
+        jobs.add(none, needs_work=False)
+        assert jobs.estimate("Never/Timed") == scheduler.DEFAULT_DURATION
+        started = [doc.service_name for doc, _ in jobs.jobs()]
+        assert started == ["None", "Quick"]
+        assert [doc.service_name for doc in jobs.deferred] == ["Slow"]
+        jobs.save()
+
+        print("test a deferred job gains score while it waits")
+        with open(path) as in_file:
+            state = json.load(in_file)
+        assert list(state["backlog"]) == ["slow"]
+        state["backlog"]["slow"] = time.time() - 3600 * 48
+        with open(path, "w") as out_file:
+            json.dump(state, out_file)
+        slow, urgent = records("Slow", "Urgent")
+        jobs = Scheduler(path)
+        jobs.add(urgent, priority=1)
+        jobs.add(slow, priority=0)
+        assert [doc.service_name for doc, _ in jobs.jobs()] == ["Slow", "Urgent"]
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_finished_records_durations():
+    """Durations of jobs with work are averaged; jobs without work are not timed."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "schedule.json")
+        work, none = records("Work", "None")
+        jobs = Scheduler(path)
+        jobs.add(work)
+        jobs.add(none, needs_work=False)
+        list(jobs.jobs())
+        jobs.finished(work, 100)
+        jobs.finished(work, 200)
+        jobs.finished(none, 1)
+        assert jobs.estimate("Work") == 150
+        assert jobs.estimate("None") == scheduler.DEFAULT_DURATION
+        jobs.save()
+        assert Scheduler(path).estimate("work") == 150
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_order()
+    test_budget_defers_jobs()
+    test_finished_records_durations()
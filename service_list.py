@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+The service_list: a csv file of the services to publish, and their settings.
+
+The first row is a header row. The first three columns are (whatever their
+header says) the source_path, service_folder and service_name; the others are
+optional and named (case insensitive) in the header row:
+
+| column             | value                                                     |
+|--------------------|-----------------------------------------------------------|
+| source_path        | the path to the source document (i.e. an *.mxd)          |
+| service_folder     | the folder on the server (the default is the subfolder    |
+|                    | of the root_directory, or the root folder)                |
+| service_name       | the service name (the default is the source file name)    |
+| image_service      | yes to publish the source as an image service             |
+| skip               | yes to leave the service alone (no publish or unpublish)  |
+| force              | yes to republish the service on every run                 |
+| priority           | a number; higher priorities are published first           |
+| summary, tags      | the item description (tags are comma separated)           |
+| cache_scales       | the scales to rebuild when the data changes (see          |
+|                    | tile_cache.py; comma separated)                           |
+| min_instances, ... | the instance and pooling settings (see pooling.py)        |
+
+Yes/no columns accept yes/no, true/false, y/n, 1/0 or blank (no).
+
+A row with a source_path applies to that document; the document is published
+even if it is not in the root_directory. A row without a source_path applies
+to the document in the root_directory with the service path
+service_folder/service_name (i.e. to set its priority).
+
+The file is checked as it is read, one row at a time. A row with an invalid
+value is ignored (and reported in issues), as is a second row for the same
+document. The rows are indexed by source path and by service path, so each
+document's row is found in constant time.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import csv
+import logging
+import os
+import sys
+
+import pooling
+import util
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+POSITIONAL_COLUMNS = ["source_path", "service_folder", "service_name"]
+BOOLEAN_COLUMNS = ["image_service", "skip", "force"]
+NUMBER_COLUMNS = ["priority"]
+TEXT_COLUMNS = ["summary", "tags", "cache_scales"]
+KNOWN_COLUMNS = (
+    POSITIONAL_COLUMNS
+    + BOOLEAN_COLUMNS
+    + NUMBER_COLUMNS
+    + TEXT_COLUMNS
+    + sorted(pooling.SETTINGS)
+)
+
+TRUE_TEXT = ("yes", "y", "true", "t", "1")
+FALSE_TEXT = ("no", "n", "false", "f", "0", "")
+
+
+class ServiceEntry(object):
+    """A (valid) row of the service_list.
+
+    settings is a dictionary of the other (text) columns with a value, i.e. the
+    summary, tags and pooling settings (see service_properties.py and pooling.py)."""
+
+    # pylint: disable=too-few-public-methods,too-many-arguments
+
+    __slots__ = (
+        "source_path",
+        "folder",
+        "name",
+        "image_service",
+        "skip",
+        "force",
+        "priority",
+        "settings",
+        "line",
+    )
+
+    def __init__(
+        self,
+        source_path=None,
+        folder=None,
+        name=None,
+        image_service=False,
+        skip=False,
+        force=False,
+        priority=0.0,
+        settings=None,
+        line=None,
+    ):
+        self.source_path = source_path
+        self.folder = folder
+        self.name = name
+        self.image_service = image_service
+        self.skip = skip
+        self.force = force
+        self.priority = priority
+        self.settings = settings or {}
+        self.line = line
+
+    def __repr__(self):
+        return "ServiceEntry({0!r}, folder={1!r}, name={2!r})".format(
+            self.source_path, self.folder, self.name
+        )
+
+    @property
+    def service_path(self):
+        """Return the service path named by this row (None if there is no name)."""
+        name = self.name
+        if name is None and self.source_path is not None:
+            name = os.path.splitext(os.path.basename(self.source_path))[0]
+        return service_path_key(self.folder, name)
+
+
+class ServiceList(object):
+    """The rows of a service_list, indexed by source path and by service path."""
+
+    def __init__(self, entries=None):
+        self.issues = []  # (line, message)
+        self.__entries = []
+        self.__by_source = {}
+        self.__by_service = {}
+        for entry in entries or []:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter__(self):
+        return iter(self.__entries)
+
+    def add(self, entry):
+        """Add entry; returns False (and adds an issue) if it is a duplicate."""
+        if entry.source_path is not None:
+            index, key = self.__by_source, normalize_path(entry.source_path)
+        else:
+            index, key = self.__by_service, entry.service_path
+        if key in index:
+            self.add_issue(
+                entry.line,
+                "Duplicate of line {0} ({1})".format(index[key].line, key),
+            )
+            return False
+        index[key] = entry
+        self.__entries.append(entry)
+        return True
+
+    def add_issue(self, line, message):
+        """Record (and log) a problem with the file."""
+        logger.warning("service_list line %s: %s", line, message)
+        self.issues.append((line, message))
+
+    def find(self, source_path=None, service_path=None):
+        """Return the entry for a document, by its source path (first) or by its
+        (default) service path, or None if there is not one."""
+        if source_path is not None and self.__by_source:
+            entry = self.__by_source.get(normalize_path(source_path))
+            if entry is not None:
+                return entry
+        if service_path is not None and self.__by_service:
+            return self.__by_service.get(service_path.lower())
+        return None
+
+    def sources(self):
+        """Return the entries with a source path (in the order of the file)."""
+        return [entry for entry in self.__entries if entry.source_path is not None]
+
+
+def load(path):
+    """Read and check the service_list at path; returns a ServiceList.
+
+    Problems with the file are in the issues of the result; if the file can not be
+    read at all, the result is empty."""
+    result = ServiceList()
+    try:
+        with _open_csv(path) as csv_file:
+            rows = csv.reader(csv_file)
+            header = _decode(next(rows, []))
+            if len(header) < 3:
+                result.add_issue(1, "The header must have at least 3 columns")
+                return result
+            names = POSITIONAL_COLUMNS + [name.strip().lower() for name in header[3:]]
+            for name in names[3:]:
+                if name not in KNOWN_COLUMNS:
+                    result.add_issue(1, "Unknown column {0}".format(name))
+            for row in rows:
+                line = rows.line_num
+                entry = parse_row(dict(zip(names, _decode(row))), line, result)
+                if entry is not None:
+                    result.add(entry)
+    except (IOError, OSError, csv.Error, UnicodeError) as ex:
+        logger.warning("Unable to read the service_list %s: %s", path, ex)
+        result.add_issue(None, "Unable to read the file: {0}".format(ex))
+    logger.info(
+        "Read %s services from %s (%s issues)", len(result), path, len(result.issues)
+    )
+    return result
+
+
+def from_tuples(rows):
+    """Return a ServiceList for a list of (source_path, folder, name) tuples."""
+    result = ServiceList()
+    for line, row in enumerate(rows, 1):
+        entry = parse_row(dict(zip(POSITIONAL_COLUMNS, row)), line, result)
+        if entry is not None:
+            result.add(entry)
+    return result
+
+
+def parse_row(row, line, service_list):
+    """Return a ServiceEntry for row (a dictionary of text by column name), or None
+    if the row is blank or invalid (the problems are added to service_list)."""
+    values = dict((name, (value or "").strip()) for name, value in row.items())
+    if not any(values.values()):
+        return None
+    entry = ServiceEntry(
+        source_path=values.pop("source_path", "") or None,
+        folder=values.pop("service_folder", "") or None,
+        name=values.pop("service_name", "") or None,
+        line=line,
+    )
+    errors = []
+    if entry.source_path is None and entry.name is None:
+        errors.append("A source_path or a service_name is required")
+    for name in BOOLEAN_COLUMNS:
+        text = values.pop(name, "").lower()
+        if text in TRUE_TEXT:
+            setattr(entry, name, True)
+        elif text not in FALSE_TEXT:
+            errors.append("{0} must be yes or no, not {1}".format(name, text))
+    priority = values.pop("priority", "")
+    try:
+        entry.priority = float(priority or 0)
+    except ValueError:
+        errors.append("priority must be a number, not {0}".format(priority))
+    for name in pooling.invalid_settings(values):
+        errors.append("Invalid {0}: {1}".format(name, values[name]))
+    for scale in values.get("cache_scales", "").split(","):
+        try:
+            if scale.strip():
+                float(scale)
+        except ValueError:
+            errors.append("Invalid cache_scales: {0}".format(values["cache_scales"]))
+            break
+    if errors:
+        service_list.add_issue(line, "; ".join(errors) + ". The row is ignored.")
+        return None
+    entry.settings = dict((name, value) for name, value in values.items() if value)
+    return entry
+
+
+def normalize_path(path):
+    """Return a key for a file system path (absolute and case normalized)."""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def service_path_key(folder, name):
+    """Return the (lower case) service path for a service folder and name."""
+    name = util.sanitize_service_name(name)
+    if name is None:
+        return None
+    folder = util.sanitize_service_name(folder)
+    return (name if folder is None else folder + "/" + name).lower()
+
+
+def _open_csv(path):
+    """Open a file for CSV mode that is compatible with unicode and Python 2/3"""
+    if sys.version_info[0] < 3:
+        return open(path, "rb")
+    return open(path, "r", encoding="utf8", newline="")
+
+
+def _decode(row):
+    if sys.version_info[0] < 3:
+        return [value.decode("utf-8") for value in row]
+    return row
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for reading the service_list, and applying it to the documents to publish.
+
+Run with: python -m pytest service_list_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import os
+import shutil
+import tempfile
+
+from document_finder import Documents
+import service_list
+
+SERVICE_LIST = """source,folder,name,Priority,skip,force,image_service,min_instances
+{root}/Transport/Roads.mxd,Streets,,2,,,,1
+,Transport,Rail,,yes,,,
+{other}/Imagery.tif,Imagery,Ortho,,,,yes,
+{other}/Parks.mxd,,,1,,true,,
+{root}/Transport/Roads.mxd,Other,,,,,,
+,,,,,,,
+{other}/Bad.mxd,,,high,maybe,,,-1
+"""
+
+
+def write(path, text):
+    """Write text to a new file at path."""
+    with open(path, "w", encoding="utf-8", newline="") as out_file:
+        out_file.write(text)
+
+
+def make_tree(folder):
+    """Create a root_directory and a service_list in folder; returns the paths."""
+    root = os.path.join(folder, "root")
+    other = os.path.join(folder, "other")
+    os.makedirs(os.path.join(root, "Transport"))
+    os.makedirs(other)
+    for path in (
+        os.path.join(root, "Transport", "Roads.mxd"),
+        os.path.join(root, "Transport", "Rail.mxd"),
+        os.path.join(root, "Transport", "Bus.mxd"),
+        os.path.join(other, "Imagery.tif"),
+        os.path.join(other, "Parks.mxd"),
+    ):
+        write(path, "")
+    csv_path = os.path.join(folder, "services.csv")
+    write(csv_path, SERVICE_LIST.format(root=root, other=other))
+    return root, csv_path
+
+
+def test_load_checks_and_indexes_rows():
+    """Invalid and duplicate rows are reported and ignored; the rest are indexed."""
+    folder = tempfile.mkdtemp()
+    try:
+        root, csv_path = make_tree(folder)
+        services = service_list.load(csv_path)
+        print(services.issues)
+        assert len(services) == 4
+        assert [line for line, _ in services.issues] == [6, 8]
+        assert "priority" in services.issues[1][1]
+        roads = services.find(os.path.join(root, "Transport", "Roads.mxd"))
+        assert roads.folder == "Streets"
+        assert roads.priority == 2.0
+        assert roads.settings == {"min_instances": "1"}
+        rail = services.find(None, "transport/rail")
+        assert rail.skip
+        assert services.find(None, "Transport/Bus") is None
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_documents_apply_the_overrides():
+    """The documents to publish have the folder, name and flags in the list."""
+    folder = tempfile.mkdtemp()
+    try:
+        root, csv_path = make_tree(folder)
+        documents = Documents(path=root, history=[], service_list=csv_path)
+        records = dict(
+            (record.service_path, record) for record in documents.items_to_publish
+        )
+        print(records)
+        assert sorted(records) == [
+            "Imagery/Ortho",
+            "Parks",
+            "Streets/Roads",
+            "Transport/Bus",
+        ]
+        assert records["Streets/Roads"].priority == 2.0
+        assert records["Streets/Roads"].settings["min_instances"] == "1"
+        assert records["Imagery/Ortho"].image_service
+        assert not records["Imagery/Ortho"].is_up_to_date
+        assert records["Parks"].force
+        assert not records["Transport/Bus"].force
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_skipped_and_listed_services_are_not_unpublished():
+    """Services in the service_list (even skipped ones) are not unpublished."""
+    folder = tempfile.mkdtemp()
+    try:
+        root, csv_path = make_tree(folder)
+        history = [
+            (None, "Transport", "Rail"),
+            (None, "Streets", "Roads"),
+            (None, None, "Parks"),
+            (None, "Old", "Gone"),
+        ]
+        documents = Documents(path=root, history=history, service_list=csv_path)
+        paths = [record.service_path for record in documents.items_to_unpublish]
+        assert paths == ["Old/Gone"]
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_load_checks_and_indexes_rows()
+    test_documents_apply_the_overrides()
+    test_skipped_and_listed_services_are_not_unpublished()
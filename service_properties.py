@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Publishing properties from the service_list that can be changed without
+republishing a service.
+
+The summary and tags of a service are part of its item info, and the instance
+and pooling settings (see pooling.py) are part of the service properties; both
+can be edited with the ArcGIS Server admin API. When only these properties
+change, the service is edited in place, rather than redrafted, reanalyzed,
+restaged and uploaded.
+
+To know what changed, the properties are recorded (as JSON) beside the service
+definition each time the service is published or edited.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import os
+
+import rest
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# The service_list columns for the item info, and the item info key for each.
+ITEM_INFO = {"summary": "summary", "tags": "tags"}
+
+
+def from_settings(settings):
+    """Return the properties in settings (a row from the service_list).
+
+    Missing and empty values are None. Tags are returned as comma separated text."""
+    properties = {}
+    for name in ITEM_INFO:
+        value = (settings or {}).get(name)
+        if value is not None:
+            value = value.strip() or None
+        properties[name] = value
+    if properties["tags"] is not None:
+        tags = [tag.strip() for tag in properties["tags"].split(",")]
+        properties["tags"] = ",".join([tag for tag in tags if tag]) or None
+    return properties
+
+
+def changes(recorded, wanted):
+    """Return a dictionary of the properties in wanted that differ from recorded.
+
+    If recorded is None (the published properties are unknown), all the properties
+    in wanted with a value are returned."""
+    if recorded is None:
+        return dict((key, value) for key, value in wanted.items() if value is not None)
+    return dict(
+        (key, value) for key, value in wanted.items() if recorded.get(key) != value
+    )
+
+
+def load(path):
+    """Return the properties recorded at path, or None if they are unknown."""
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as in_file:
+            return json.load(in_file)
+    except Exception as ex:
+        logger.warning("Unable to load the published properties %s: %s", path, ex)
+        return None
+
+
+def save(properties, path):
+    """Record the published properties at path."""
+    if path is None:
+        return
+    try:
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(properties, indent=2, sort_keys=True))
+    except Exception as ex:
+        logger.warning("Unable to save the published properties %s: %s", path, ex)
+
+
+def edit_item_info(server_url, service, token, properties):
+    """Change the item info of service (i.e. 'folder/name.MapServer') on server_url.
+
+    properties is a dictionary like the one returned by changes().
+    Returns True if the server accepted the change."""
+    url = server_url + "/admin/services/" + service + "/iteminfo"
+    try:
+        response = rest.get(url, params={"f": "json", "token": token})
+        response.raise_for_status()
+        item_info = response.json()
+    except Exception as ex:
+        logger.error("Unable to get the item info for %s: %s", service, ex)
+        return False
+    if "error" in item_info or item_info.get("status") == "error":
+        logger.error("Unable to get the item info for %s: %s", service, item_info)
+        return False
+    for name, key in ITEM_INFO.items():
+        if name not in properties:
+            continue
+        value = properties[name]
+        if name == "tags":
+            # The item info tags are a list (empty to remove them all)
+            item_info[key] = value.split(",") if value else []
+        else:
+            item_info[key] = value or ""
+    data = {"f": "json", "token": token, "serviceItemInfo": json.dumps(item_info)}
+    try:
+        logger.info("Editing the item info of %s: %s", service, properties)
+        response = rest.post(url + "/edit", data=data)
+        response.raise_for_status()
+        json_response = response.json()
+    except Exception as ex:
+        logger.error("Unable to edit the item info for %s: %s", service, ex)
+        return False
+    logger.debug("Edit item info response: %s", json_response)
+    if json_response.get("status") != "success":
+        logger.error("Unable to edit the item info for %s: %s", service, json_response)
+        return False
+    return True
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the properties that can be changed without republishing a service.
+
+Run with: python -m pytest service_properties_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+
+import http_replay
+import rest
+import service_properties
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+URL = "https://gis/arcgis"
+
+
+class FakeAdmin(object):
+    """A transport for the item info admin requests of a service."""
+
+    def __init__(self, item_info, edit_status="success"):
+        self.item_info = item_info
+        self.edit_status = edit_status
+        self.edits = []  # the item info of each edit
+
+    def request(self, method, url, **kwargs):
+        """Return the item info, or save an edit."""
+        if url.endswith("/iteminfo/edit"):
+            assert method == "POST" and kwargs["data"]["token"] == "secret"
+            self.edits.append(json.loads(kwargs["data"]["serviceItemInfo"]))
+            body = {"status": self.edit_status}
+        else:
+            assert url == URL + "/admin/services/Transport/Roads.MapServer/iteminfo"
+            body = self.item_info
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+def test_from_settings():
+    """Empty values are None, and tags are cleaned up."""
+    settings = {"summary": "  Roads  ", "tags": " roads, , highways ,", "x": "1"}
+    assert service_properties.from_settings(settings) == {
+        "summary": "Roads",
+        "tags": "roads,highways",
+    }
+    assert service_properties.from_settings({"summary": " ", "tags": ", ,"}) == {
+        "summary": None,
+        "tags": None,
+    }
+    assert service_properties.from_settings(None) == {"summary": None, "tags": None}
+
+
+def test_changes():
+    """Only the properties that differ from the recorded ones are changes."""
+    recorded = {"summary": "Roads", "tags": "roads", "maxInstancesPerNode": 2}
+    wanted = {"summary": "Roads", "tags": "roads,highways", "maxInstancesPerNode": 2}
+    assert service_properties.changes(recorded, wanted) == {"tags": "roads,highways"}
+    assert service_properties.changes(recorded, dict(recorded)) == {}
+    print("test a property that was removed is a change to None")
+    assert service_properties.changes(recorded, {"summary": None}) == {"summary": None}
+    print("test a property that was not recorded is a change")
+    assert service_properties.changes({}, {"summary": "Roads"}) == {"summary": "Roads"}
+    print("test without a record, only properties with a value are changes")
+    assert service_properties.changes(None, {"summary": "Roads", "tags": None}) == {
+        "summary": "Roads"
+    }
+    assert service_properties.changes(None, {"summary": None}) == {}
+
+
+def test_save_and_load():
+    """The recorded properties are saved beside the service definition."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "roads.properties.json")
+        assert service_properties.load(path) is None
+        properties = {"summary": "Roads", "tags": None}
+        service_properties.save(properties, path)
+        assert service_properties.load(path) == properties
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write("{not json")
+        assert service_properties.load(path) is None
+        assert service_properties.load(None) is None
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_edit_item_info():
+    """The changed properties are merged into the item info; tags are a list."""
+    admin = FakeAdmin({"summary": "Old", "tags": ["old"], "title": "Roads"})
+    previous = rest.set_transport(admin)
+    try:
+        service = "Transport/Roads.MapServer"
+        changed = {"tags": "roads,highways"}
+        assert service_properties.edit_item_info(URL, service, "secret", changed)
+        assert admin.edits == [
+            {"summary": "Old", "tags": ["roads", "highways"], "title": "Roads"}
+        ]
+        assert service_properties.edit_item_info(
+            URL, service, "secret", {"summary": None, "tags": None}
+        )
+        assert admin.edits[-1]["summary"] == "" and admin.edits[-1]["tags"] == []
+        print("test a rejected edit fails")
+        admin.edit_status = "error"
+        assert not service_properties.edit_item_info(URL, service, "secret", changed)
+        admin.item_info = {"status": "error", "messages": ["No such service"]}
+        assert not service_properties.edit_item_info(URL, service, "secret", changed)
+        assert len(admin.edits) == 3
+    finally:
+        rest.set_transport(previous)
+
+
+if __name__ == "__main__":
+    test_from_settings()
+    test_changes()
+    test_save_and_load()
+    test_edit_item_info()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+A logging handler that emails a summary of the errors in a run.
+
+Unlike BufferingSMTPHandler, the email is sent by a background thread, so the
+thread that logs an error never waits for the mail server. Errors are grouped
+by their message template (the message before the arguments are merged), so
+the same error on a hundred documents is one line with a count and the last
+example. A summary is sent every flush_interval seconds, or sooner when
+capacity errors are waiting, but never more than max_per_hour times an hour;
+errors that arrive when the limit is reached wait for the next summary. If the
+mail server can not be reached, the errors are kept for the next summary.
+
+Example logging config (see config_logger.py):
+
+    "email": {
+        "class": "smtp_error_reporter.SMTPErrorReporter",
+        "level": "ERROR",
+        "formatter": "detailed",
+        "mailhost": "mailer.example.com",
+        "fromaddr": "publisher@example.com",
+        "toaddrs": ["gis_admin@example.com"],
+        "subject": "Errors running the ArcGIS Service Builder/Publisher",
+    }
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict, deque
+from email.mime.text import MIMEText
+import logging
+import smtplib
+import threading
+import time
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# pylint: disable=too-many-arguments,too-many-instance-attributes
+
+
+class SMTPErrorReporter(logging.Handler):
+    """A logging handler that emails grouped records from a background thread."""
+
+    def __init__(
+        self,
+        mailhost,
+        fromaddr,
+        toaddrs,
+        subject,
+        capacity=100,
+        flush_interval=300,
+        max_per_hour=4,
+        credentials=None,
+        secure=None,
+        timeout=30,
+    ):
+        """mailhost is a host name or a (host, port) tuple; toaddrs is a list of
+        addresses (or a single address). credentials is a (username, password) tuple,
+        and secure is a tuple of the arguments to starttls() (possibly empty), as in
+        logging.handlers.SMTPHandler."""
+        logging.Handler.__init__(self)
+        if isinstance(mailhost, (list, tuple)):
+            self.mailhost, self.mailport = mailhost
+        else:
+            self.mailhost, self.mailport = mailhost, None
+        self.fromaddr = fromaddr
+        if not isinstance(toaddrs, (list, tuple)):
+            toaddrs = [toaddrs]
+        self.toaddrs = list(toaddrs)
+        self.subject = subject
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_per_hour = max_per_hour
+        self.credentials = credentials
+        self.secure = secure
+        self.timeout = timeout
+        # template key: {"count", "first", "last", "text"}
+        self.__groups = OrderedDict()
+        self.__waiting = 0
+        self.__sent = deque()  # times of the summaries sent in the last hour
+        self.__group_lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__closed = False
+        self.__sender = threading.Thread(target=self.__run, name="smtp-error-reporter")
+        self.__sender.daemon = True
+        self.__sender.start()
+
+    def emit(self, record):
+        """Add record to the summary (this does not wait for the mail server)."""
+        try:
+            text = self.format(record)
+            key = (record.name, record.levelname, "{0}".format(record.msg))
+            with self.__group_lock:
+                group = self.__groups.get(key)
+                if group is None:
+                    group = {"count": 0, "first": record.created}
+                    self.__groups[key] = group
+                group["count"] += 1
+                group["last"] = record.created
+                group["text"] = text
+                self.__waiting += 1
+                full = self.__waiting >= self.capacity
+            if full:
+                self.__wake.set()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Ask the background thread to send a summary (subject to the rate limit)."""
+        self.__wake.set()
+
+    def close(self):
+        """Send the waiting records (even if the rate limit is reached) and stop."""
+        if not self.__closed:
+            self.__closed = True
+            self.__wake.set()
+            self.__sender.join(self.timeout * 2)
+        logging.Handler.close(self)
+
+    def __run(self):
+        while not self.__closed:
+            self.__wake.wait(self.flush_interval)
+            self.__wake.clear()
+            if self.__closed or self.__can_send():
+                self.__send()
+        self.__send()
+
+    def __can_send(self):
+        hour_ago = time.time() - 3600
+        while self.__sent and self.__sent[0] < hour_ago:
+            self.__sent.popleft()
+        return len(self.__sent) < self.max_per_hour
+
+    def __send(self):
+        with self.__group_lock:
+            groups = self.__groups
+            count = self.__waiting
+            self.__groups = OrderedDict()
+            self.__waiting = 0
+        if not groups:
+            return
+        message = MIMEText(self.__body(groups, count), "plain", "utf-8")
+        message["From"] = self.fromaddr
+        message["To"] = ",".join(self.toaddrs)
+        message["Subject"] = "{0} ({1} errors)".format(self.subject, count)
+        try:
+            port = self.mailport or smtplib.SMTP_PORT
+            smtp = smtplib.SMTP(self.mailhost, port, timeout=self.timeout)
+            try:
+                if self.credentials:
+                    if self.secure is not None:
+                        smtp.ehlo()
+                        smtp.starttls(*self.secure)
+                        smtp.ehlo()
+                    smtp.login(*self.credentials)
+                smtp.sendmail(self.fromaddr, self.toaddrs, message.as_string())
+            finally:
+                smtp.quit()
+            self.__sent.append(time.time())
+        except Exception:
+            self.__restore(groups, count)
+            self.handleError(None)  # no particular record
+
+    def __restore(self, groups, count):
+        """Put the groups of a summary that was not sent back in front of the groups
+        logged since."""
+        with self.__group_lock:
+            newer = self.__groups
+            self.__groups = groups
+            for key, group in newer.items():
+                older = groups.get(key)
+                if older is None:
+                    groups[key] = group
+                else:
+                    older["count"] += group["count"]
+                    older["last"] = group["last"]
+                    older["text"] = group["text"]
+            self.__waiting += count
+
+    @staticmethod
+    def __body(groups, count):
+        lines = [
+            "{0} errors ({1} different) were logged:".format(count, len(groups)),
+            "",
+        ]
+        for group in groups.values():
+            if group["count"] > 1:
+                lines.append(
+                    "{0} times between {1} and {2}; the last was:".format(
+                        group["count"],
+                        time.strftime("%H:%M:%S", time.localtime(group["first"])),
+                        time.strftime("%H:%M:%S", time.localtime(group["last"])),
+                    )
+                )
+            lines.append(group["text"])
+            lines.append("")
+        return "\r\n".join(lines)
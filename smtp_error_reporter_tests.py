@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the SMTP error reporter, against a local SMTP stand-in.
+
+Run with: python -m pytest smtp_error_reporter_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import email
+import logging
+import socket
+import threading
+
+from smtp_error_reporter import SMTPErrorReporter
+
+
+class FakeSMTPServer(object):
+    """Accepts SMTP connections on localhost and records the messages (the headers
+    and the decoded body as text)."""
+
+    # pylint: disable=useless-object-inheritance
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__socket.bind(("127.0.0.1", 0))
+        self.__socket.listen(5)
+        self.port = self.__socket.getsockname()[1]
+        thread = threading.Thread(target=self.__serve)
+        thread.daemon = True
+        thread.start()
+
+    def __serve(self):
+        while True:
+            try:
+                connection, _ = self.__socket.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            self.__session(connection)
+
+    def __session(self, connection):
+        reader = connection.makefile("rb")
+        connection.sendall(b"220 localhost ready\r\n")
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            command = line.strip().upper()
+            if command.startswith(b"DATA"):
+                connection.sendall(b"354 go ahead\r\n")
+                lines = []
+                while True:
+                    data = reader.readline()
+                    if data in (b".\r\n", b".\n", b""):
+                        break
+                    lines.append(data)
+                message = email.message_from_string(b"".join(lines).decode("utf-8"))
+                body = message.get_payload(decode=True).decode("utf-8")
+                headers = "".join(
+                    "{0}: {1}\n".format(key, value) for key, value in message.items()
+                )
+                self.messages.append(headers + "\n" + body)
+                connection.sendall(b"250 OK\r\n")
+            elif command.startswith(b"QUIT"):
+                connection.sendall(b"221 bye\r\n")
+                break
+            else:
+                connection.sendall(b"250 OK\r\n")
+        reader.close()
+        connection.close()
+
+    def close(self):
+        """Stop accepting connections."""
+        self.__socket.close()
+
+
+def make_logger(name, handler):
+    """Return a logger that only logs to handler."""
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    return logger
+
+
+def test_groups_repeated_errors():
+    """The same error template is sent once, with a count."""
+    server = FakeSMTPServer()
+    handler = SMTPErrorReporter(
+        ("127.0.0.1", server.port), "from@test", ["a@test", "b@test"], "Errors"
+    )
+    logger = make_logger("test_groups", handler)
+    for index in range(5):
+        logger.error("Unable to publish %s", "doc{0}".format(index))
+    logger.error("Something else")
+    handler.close()
+    server.close()
+    print(server.messages)
+    assert len(server.messages) == 1
+    message = server.messages[0]
+    assert "6 errors (2 different)" in message
+    assert "5 times between" in message
+    assert "Unable to publish doc4" in message
+    assert "To: a@test,b@test" in message
+
+
+def test_flushes_at_capacity():
+    """A summary is sent (in the background) once capacity errors are waiting."""
+    server = FakeSMTPServer()
+    handler = SMTPErrorReporter(
+        ("127.0.0.1", server.port), "from@test", "a@test", "Errors", capacity=3
+    )
+    logger = make_logger("test_capacity", handler)
+    for _ in range(3):
+        logger.error("Full")
+    for _ in range(100):
+        if server.messages:
+            break
+        threading.Event().wait(0.05)
+    assert len(server.messages) == 1
+    handler.close()
+    server.close()
+    assert len(server.messages) == 1
+
+
+def test_rate_limit():
+    """Summaries over the hourly limit wait; the remaining errors are sent at close."""
+    server = FakeSMTPServer()
+    handler = SMTPErrorReporter(
+        ("127.0.0.1", server.port),
+        "from@test",
+        "a@test",
+        "Errors",
+        capacity=1,
+        max_per_hour=1,
+    )
+    logger = make_logger("test_rate", handler)
+    logger.error("First")
+    for _ in range(100):
+        if server.messages:
+            break
+        threading.Event().wait(0.05)
+    logger.error("Second")
+    logger.error("Third")
+    threading.Event().wait(0.2)
+    assert len(server.messages) == 1
+    handler.close()
+    server.close()
+    print(server.messages)
+    assert len(server.messages) == 2
+    assert "Second" in server.messages[1] and "Third" in server.messages[1]
+    assert server.connections == 2
+
+
+def test_keeps_errors_when_unable_to_send():
+    """Errors in a summary that could not be sent are in the next summary."""
+    unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    unused.bind(("127.0.0.1", 0))
+    closed_port = unused.getsockname()[1]
+    unused.close()
+    server = FakeSMTPServer()
+    handler = SMTPErrorReporter(
+        ("127.0.0.1", closed_port), "from@test", "a@test", "Errors", capacity=2
+    )
+    logger = make_logger("test_unable", handler)
+    raise_exceptions = logging.raiseExceptions
+    logging.raiseExceptions = False  # handleError() is quiet
+    try:
+        logger.error("Lost %s", "one")
+        logger.error("Lost %s", "two")
+        threading.Event().wait(0.5)
+        handler.mailport = server.port
+        logger.error("Lost %s", "three")
+        handler.close()
+    finally:
+        logging.raiseExceptions = raise_exceptions
+    server.close()
+    print(server.messages)
+    assert len(server.messages) == 1
+    assert "3 errors (1 different)" in server.messages[0]
+    assert "Lost three" in server.messages[0]
+
+
+if __name__ == "__main__":
+    test_groups_repeated_errors()
+    test_flushes_at_capacity()
+    test_rate_limit()
+    test_keeps_errors_when_unable_to_send()
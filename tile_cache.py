@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+Update the tile caches of cached map services after they are republished.
+
+When a cached service is republished because its data changed, only the tiles
+that cover the changed data need to be rebuilt. A cache job is queued with the
+data sources that changed (see DependencyIndex.changed_sources). When it is
+submitted, the extents of those sources (projected to the service's spatial
+reference) are combined, and the Manage Map Cache Tiles task is asked to
+recreate the tiles in that extent only (the full extent if the changed data
+is unknown), at the service's cached scales (or the scales in the cache_scales
+column of the service_list). The extents are the current extents of the
+sources; the extent before the change is not recorded, so tiles of features
+that were moved or deleted outside the current extent are not recreated (queue
+the service without changed_sources to recreate the full extent).
+
+Cache jobs can take hours and slow the server, so they are only submitted in
+an off-peak window (i.e. "22:00-05:00"); jobs queued outside the window are
+saved, and submitted by a later run, or from the command line (i.e. from a
+scheduled task that runs in the window):
+
+    python tile_cache.py cache_jobs.json [22:00-05:00]
+
+Jobs are submitted to the CachingTools geoprocessing service with the ReST API
+(a job ID is returned at once), and the job IDs are saved in the cache jobs file
+with the queued jobs, so a later run (or wait()) can check each job's status on
+the server, and the run report shows when it finished. A job that can not be
+submitted (i.e. the server is down) stays queued for a later run, up to
+MAX_ATTEMPTS times.
+
+The arcpy module (used for the extents of the changed data) can be replaced
+(see CacheJobs) so this can be tested without ArcGIS.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+UPDATE_MODE = "RECREATE_ALL_TILES"
+
+# The geoprocessing task (below server_url) that updates map caches
+CACHING_TASK = "/rest/services/System/CachingTools/GPServer/Manage Map Cache Tiles"
+
+# The status of a geoprocessing job: the status of a cache job
+JOB_STATUS = {
+    "esriJobNew": "new",
+    "esriJobSubmitted": "submitted",
+    "esriJobWaiting": "waiting",
+    "esriJobExecuting": "executing",
+    "esriJobSucceeded": "succeeded",
+    "esriJobFailed": "failed",
+    "esriJobTimedOut": "timed_out",
+    "esriJobCancelling": "canceling",
+    "esriJobCancelled": "canceled",
+    "esriJobDeleting": "deleting",
+    "esriJobDeleted": "deleted",
+}
+DONE = ("succeeded", "failed", "timed_out", "canceled", "deleted", "not_cached")
+
+# Seconds between checks of the status of the submitted jobs (see wait())
+POLL_INTERVAL = 30
+
+# The number of times a job is submitted before it is reported as failed
+MAX_ATTEMPTS = 3
+
+
+class CacheJobs(object):
+    """A queue of tile cache updates, saved in a JSON file between runs."""
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(
+        self,
+        path=None,
+        window=None,
+        instances=2,
+        arcpy_module=None,
+        username=None,
+        password=None,
+    ):
+        """window is the off-peak time to submit jobs ('HH:MM-HH:MM', local time),
+        or None for any time. instances is the number of caching service instances
+        to use for each job. arcpy_module replaces arcpy (for testing). username and
+        password are the admin credentials to submit (and check) the jobs."""
+        self.__path = path
+        self.__window = parse_window(window)
+        self.__instances = instances
+        self.__arcpy = arcpy_module
+        self.__username = username
+        self.__password = password
+        self.__lock = threading.Lock()
+        self.__queued = {}  # "server service_path" (lower): job
+        self.__submitted = []  # jobs (with a job_id if they were started)
+        if path is not None and os.path.exists(path):
+            self.__load()
+
+    @property
+    def queued(self):
+        """Return a list of the jobs that are waiting to be submitted."""
+        with self.__lock:
+            return list(self.__queued.values())
+
+    @property
+    def running(self):
+        """Return a list of the submitted jobs that have not finished."""
+        with self.__lock:
+            return [job for job in self.__submitted if job["status"] not in DONE]
+
+    def add(self, service_path, server, server_url, changed_sources=None, scales=None):
+        """Queue a cache update for service_path on server (a connection file path)
+        at server_url (used to read the service's tiling scheme, and to submit the
+        job).
+
+        changed_sources is a list of data source paths (None for the full extent),
+        and scales is a list of scales (None for all the cached scales). Updates of
+        the same service are combined."""
+        key = "{0} {1}".format(server, service_path).lower()
+        with self.__lock:
+            job = self.__queued.get(key)
+            if job is None:
+                job = {
+                    "service_path": service_path,
+                    "server": server,
+                    "server_url": server_url,
+                    "sources": [],
+                    "scales": scales,
+                    "queued": time.time(),
+                }
+                self.__queued[key] = job
+            if changed_sources is None or job["sources"] is None:
+                job["sources"] = None
+            else:
+                job["sources"] = sorted(set(job["sources"]) | set(changed_sources))
+            if scales is None or job["scales"] is None:
+                job["scales"] = None
+            else:
+                job["scales"] = sorted(set(job["scales"]) | set(scales))
+        logger.info("Queued a tile cache update for %s", service_path)
+
+    def submit_due(self, now=None):
+        """Submit the queued jobs if now (the default is the current time) is in
+        the off-peak window. Returns the number of jobs submitted."""
+        if not in_window(self.__window, now):
+            logger.info("Waiting for the off-peak window to update the tile caches")
+            return 0
+        with self.__lock:
+            jobs = list(self.__queued.values())
+            self.__queued = {}
+        count = 0
+        tokens = {}
+        for job in jobs:
+            job["attempts"] = job.get("attempts", 0) + 1
+            if self.__submit(job, tokens):
+                count += 1
+            elif job["status"] == "failed" and job["attempts"] < MAX_ATTEMPTS:
+                logger.info(
+                    "Will retry the cache job for %s (attempt %s of %s)",
+                    job["service_path"],
+                    job["attempts"],
+                    MAX_ATTEMPTS,
+                )
+                self.__requeue(job)
+                continue
+            with self.__lock:
+                self.__submitted.append(job)
+        return count
+
+    def refresh(self):
+        """Check the status of the running jobs on their servers. Returns the number
+        of jobs that are known to be still running (a job that can not be checked
+        is checked again by a later run)."""
+        running = 0
+        tokens = {}
+        for job in self.running:
+            status = self.__check(job, tokens)
+            if status is None:
+                continue
+            if status != job["status"]:
+                logger.info("Cache job for %s is %s", job["service_path"], status)
+                job["status"] = status
+            if status in DONE:
+                job["finished"] = time.time()
+            else:
+                running += 1
+        return running
+
+    def status(self):
+        """Return a list of the status of each job (for the run report)."""
+        with self.__lock:
+            submitted = list(self.__submitted)
+            queued = list(self.__queued.values())
+        result = []
+        for job in submitted:
+            result.append(dict(job))
+        for job in queued:
+            result.append(dict(job, status="queued"))
+        return result
+
+    def wait(self, timeout=None):
+        """Wait (up to timeout seconds) for the submitted jobs to finish. Returns
+        True if they all finished."""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.refresh():
+            if deadline is not None and time.time() + POLL_INTERVAL > deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def save(self):
+        """Save the queued (unsubmitted) jobs, and the running jobs, for a later run.
+
+        Finished jobs are not saved; they are in the report of the run that saw
+        them finish."""
+        if self.__path is None:
+            return
+        state = {"queued": self.queued, "running": self.running}
+        try:
+            with open(self.__path, "w", encoding="utf-8") as out_file:
+                out_file.write(json.dumps(state, indent=2, sort_keys=True))
+        except Exception as ex:
+            logger.warning("Unable to save the cache jobs %s: %s", self.__path, ex)
+
+    def __requeue(self, job):
+        """Queue job (that could not be submitted) again, combined with an update of
+        the same service queued since it was taken from the queue."""
+        key = "{0} {1}".format(job["server"], job["service_path"]).lower()
+        with self.__lock:
+            queued = self.__queued.get(key)
+            if queued is None:
+                self.__queued[key] = job
+                return
+            queued["attempts"] = job["attempts"]
+        self.add(
+            job["service_path"],
+            job["server"],
+            job["server_url"],
+            job["sources"],
+            job["scales"],
+        )
+
+    def __submit(self, job, tokens):
+        """Start the cache update for job. Returns True if it was submitted."""
+        job["status"] = "failed"
+        if job["server_url"] is None:
+            job["message"] = "The URL of the server is unknown"
+            return False
+        info = service_info(job["server_url"], job["service_path"])
+        if info is None:
+            job["message"] = "Unable to read the service description"
+            return False
+        if not info.get("singleFusedMapCache"):
+            logger.info("%s is not a cached service", job["service_path"])
+            job["status"] = "not_cached"
+            return False
+        scales = job["scales"] or cached_scales(info)
+        if not scales:
+            logger.warning("Unknown cache scales for %s", job["service_path"])
+            job["message"] = "Unknown cache scales"
+            return False
+        token = self.__token(job["server_url"], tokens)
+        if token is None:
+            job["message"] = "Unable to login to the server"
+            return False
+        extent = None
+        if job["sources"] is not None:
+            extent = changed_extent(self.__get_arcpy(), job["sources"], info)
+        data = {
+            "f": "json",
+            "token": token,
+            "service_url": job["service_path"] + ":MapServer",
+            "levels": ";".join("{0}".format(scale) for scale in scales),
+            "thread_count": self.__instances,
+            "update_mode": UPDATE_MODE,
+            "update_extent": _extent_json(extent, info),
+        }
+        # Imported here so that jobs can be queued (and tested) without requests.
+        import rest  # pylint: disable=import-outside-toplevel
+
+        url = job["server_url"] + CACHING_TASK + "/submitJob"
+        try:
+            logger.info(
+                "Submitting a cache job for %s (%s scales, %s)",
+                job["service_path"],
+                len(scales),
+                extent,
+            )
+            response = rest.post(url, data=data)
+            response.raise_for_status()
+            json_response = response.json()
+            job_id = json_response["jobId"]
+        except Exception as ex:
+            logger.error(
+                "Unable to update the cache of %s: %s", job["service_path"], ex
+            )
+            job["message"] = "{0}".format(ex)
+            return False
+        job["job_id"] = job_id
+        job["status"] = JOB_STATUS.get(json_response.get("jobStatus"), "submitted")
+        job["submitted"] = time.time()
+        job["extent"] = None if extent is None else "{0}".format(extent)
+        return True
+
+    def __check(self, job, tokens):
+        """Return the status of job on its server, or None if it is unknown."""
+        if job.get("job_id") is None or job["server_url"] is None:
+            return "failed"
+        token = self.__token(job["server_url"], tokens)
+        if token is None:
+            return None
+        # Imported here so that jobs can be queued (and tested) without requests.
+        import rest  # pylint: disable=import-outside-toplevel
+
+        url = "{0}{1}/jobs/{2}".format(job["server_url"], CACHING_TASK, job["job_id"])
+        try:
+            response = rest.get(url, params={"f": "json", "token": token})
+            response.raise_for_status()
+            json_response = response.json()
+        except Exception as ex:
+            logger.warning("Unable to check the cache job: %s", ex)
+            return None
+        if "error" in json_response:
+            # i.e. the server was restarted, and no longer has the job
+            logger.warning("Unable to check the cache job: %s", json_response)
+            return None
+        return JOB_STATUS.get(json_response.get("jobStatus"))
+
+    def __token(self, server_url, tokens):
+        """Return an admin token for server_url (once for each call of submit_due()
+        or refresh(), in tokens)."""
+        if server_url not in tokens:
+            tokens[server_url] = None
+            if self.__username is None or self.__password is None:
+                logger.warning("No credentials provided. Can't update tile caches.")
+            else:
+                # Imported here so that jobs can be queued without requests.
+                import util  # pylint: disable=import-outside-toplevel
+
+                tokens[server_url] = util.get_token(
+                    server_url, self.__username, self.__password
+                )
+        return tokens[server_url]
+
+    def __get_arcpy(self):
+        if self.__arcpy is None:
+            # Imported here so that jobs can be queued without arcpy.
+            import arcpy  # pylint: disable=import-outside-toplevel,import-error
+
+            self.__arcpy = arcpy
+        return self.__arcpy
+
+    def __load(self):
+        try:
+            with open(self.__path, "r", encoding="utf-8") as in_file:
+                state = json.load(in_file)
+            if isinstance(state, list):
+                # Saved before the submitted jobs were kept
+                state = {"queued": state, "running": []}
+            self.__queued = dict(
+                ("{0} {1}".format(job["server"], job["service_path"]).lower(), job)
+                for job in state.get("queued", [])
+            )
+            self.__submitted = list(state.get("running", []))
+        except Exception as ex:
+            logger.warning("Unable to load the cache jobs %s: %s", self.__path, ex)
+
+
+def parse_window(text):
+    """Return the (start, end) minutes after midnight for 'HH:MM-HH:MM', or None."""
+    if not text:
+        return None
+    try:
+        start, end = text.split("-")
+        return _minutes(start), _minutes(end)
+    except ValueError:
+        logger.warning("Ignoring the invalid cache window %s", text)
+        return None
+
+
+def in_window(window, now=None):
+    """Return True if now (seconds since the epoch) is in window (see parse_window)."""
+    if window is None:
+        return True
+    local = time.localtime(now)
+    minutes = local.tm_hour * 60 + local.tm_min
+    start, end = window
+    if start <= end:
+        return start <= minutes < end
+    return minutes >= start or minutes < end  # the window spans midnight
+
+
+def service_info(server_url, service_path):
+    """Return the ReST description of the map service, or None."""
+    # Imported here so that jobs can be queued (and tested) without requests.
+    import rest  # pylint: disable=import-outside-toplevel
+
+    url = "{0}/rest/services/{1}/MapServer".format(server_url, service_path)
+    try:
+        response = rest.get(url, params={"f": "json"})
+        response.raise_for_status()
+        info = response.json()
+    except Exception as ex:
+        logger.warning("Unable to get the description of %s: %s", service_path, ex)
+        return None
+    if "error" in info:
+        logger.warning("Unable to get the description of %s: %s", service_path, info)
+        return None
+    return info
+
+
+def cached_scales(info):
+    """Return the list of scales in the service's tiling scheme."""
+    lods = ((info or {}).get("tileInfo") or {}).get("lods") or []
+    return [lod["scale"] for lod in lods if "scale" in lod]
+
+
+def changed_extent(arcpy, sources, info=None):
+    """Return the extent (an arcpy Extent in the service's spatial reference) that
+    covers the data sources, or None if it is unknown (use the full extent).
+
+    This is the current extent of each source, not the extent before it changed
+    (see the module documentation)."""
+    spatial_reference = None
+    wkid = ((info or {}).get("spatialReference") or {}).get("wkid")
+    if wkid is not None:
+        spatial_reference = arcpy.SpatialReference(wkid)
+    bounds = None
+    for source in sources:
+        try:
+            extent = arcpy.Describe(source).extent
+            if spatial_reference is not None:
+                extent = extent.projectAs(spatial_reference)
+        except Exception as ex:
+            logger.info("Unable to get the extent of %s: %s", source, ex)
+            return None
+        box = (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+        if bounds is None:
+            bounds = box
+        else:
+            bounds = (
+                min(bounds[0], box[0]),
+                min(bounds[1], box[1]),
+                max(bounds[2], box[2]),
+                max(bounds[3], box[3]),
+            )
+    if bounds is None:
+        return None
+    return arcpy.Extent(*bounds)
+
+
+def _extent_json(extent, info=None):
+    """Return extent (see changed_extent()) as a geoprocessing extent parameter, or
+    an empty string for the full extent."""
+    if extent is None:
+        return ""
+    value = {
+        "xmin": extent.XMin,
+        "ymin": extent.YMin,
+        "xmax": extent.XMax,
+        "ymax": extent.YMax,
+    }
+    spatial_reference = (info or {}).get("spatialReference")
+    if spatial_reference:
+        value["spatialReference"] = spatial_reference
+    return json.dumps(value)
+
+
+def _minutes(text):
+    hours, minutes = text.strip().split(":")
+    value = int(hours) * 60 + int(minutes)
+    if not 0 <= value < 24 * 60:
+        raise ValueError(text)
+    return value
+
+
+def main():
+    """Submit the queued cache jobs in the file named on the command line."""
+    if len(sys.argv) < 2:
+        print("Usage: {0} CACHE_JOBS [HH:MM-HH:MM]".format(sys.argv[0]))
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    window = sys.argv[2] if len(sys.argv) > 2 else None
+    try:
+        # The admin credentials are in the publisher's configuration.
+        from config import Config  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        Config = None  # pylint: disable=invalid-name
+    jobs = CacheJobs(
+        sys.argv[1],
+        window=window,
+        username=getattr(Config, "admin_username", None),
+        password=getattr(Config, "admin_password", None),
+    )
+    jobs.refresh()
+    jobs.submit_due()
+    jobs.save()
+    jobs.wait()
+    jobs.save()
+    print(json.dumps(jobs.status(), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
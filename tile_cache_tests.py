@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the tile cache updates, with a stand-in for arcpy and the server.
+
+Run with: python -m pytest tile_cache_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import http_replay
+import rest
+import tile_cache
+from tile_cache import CacheJobs
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+tile_cache.POLL_INTERVAL = 0.01
+
+URL = "https://gis/arcgis"
+
+
+class FakeExtent(object):
+    """A stand-in for arcpy.Extent."""
+
+    def __init__(self, x_min, y_min, x_max, y_max):
+        self.XMin = x_min  # pylint: disable=invalid-name
+        self.YMin = y_min  # pylint: disable=invalid-name
+        self.XMax = x_max  # pylint: disable=invalid-name
+        self.YMax = y_max  # pylint: disable=invalid-name
+
+    def projectAs(self, _):  # pylint: disable=invalid-name
+        """The test data is already in the service's spatial reference."""
+        return self
+
+    def __str__(self):
+        return "{0} {1} {2} {3}".format(self.XMin, self.YMin, self.XMax, self.YMax)
+
+
+class FakeArcpy(object):
+    """A stand-in for the parts of arcpy used by tile_cache."""
+
+    Extent = FakeExtent
+
+    def __init__(self, extents):
+        self.extents = extents
+
+    @staticmethod
+    def SpatialReference(wkid):  # pylint: disable=invalid-name
+        """Return a stand-in spatial reference."""
+        return wkid
+
+    def Describe(self, source):  # pylint: disable=invalid-name
+        """Return an object with the extent of source."""
+        if source not in self.extents:
+            raise IOError("{0} does not exist".format(source))
+        return type(str("Describe"), (object,), {"extent": self.extents[source]})
+
+
+class FakeServer(object):
+    """A transport for a server with cached services, and caching jobs that are
+    executing until they are checked twice."""
+
+    def __init__(self, cached=True, failures=0):
+        self.cached = cached
+        self.failures = failures  # the number of submitJob requests that fail
+        self.jobs = []  # the data of each submitted job
+        self.checks = {}  # job ID: number of checks
+
+    def request(self, method, url, **kwargs):
+        """Answer a token, service description, submitJob or job status request."""
+        if url.endswith("/admin/generateToken"):
+            body = {"token": "secret"}
+        elif url.endswith("/MapServer"):
+            body = {
+                "singleFusedMapCache": self.cached,
+                "spatialReference": {"wkid": 3857},
+                "tileInfo": {"lods": [{"scale": 4000}, {"scale": 2000}]},
+            }
+        elif url.endswith("/submitJob"):
+            assert method == "POST" and kwargs["data"]["token"] == "secret"
+            if self.failures:
+                self.failures -= 1
+                return http_replay.ReplayResponse(503, "", url)
+            self.jobs.append(kwargs["data"])
+            body = {
+                "jobId": "j{0}".format(len(self.jobs)),
+                "jobStatus": "esriJobSubmitted",
+            }
+        elif "/jobs/" in url:
+            job_id = url.split("/jobs/")[1]
+            self.checks[job_id] = self.checks.get(job_id, 0) + 1
+            status = (
+                "esriJobSucceeded" if self.checks[job_id] > 1 else "esriJobExecuting"
+            )
+            body = {"jobId": job_id, "jobStatus": status}
+        else:
+            return http_replay.ReplayResponse(404, "", url)
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+class FakeServerContext(object):
+    """Sends the requests to a FakeServer while in the with block."""
+
+    def __init__(self, server):
+        self.server = server
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = rest.set_transport(self.server)
+        return self.server
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        rest.set_transport(self.previous)
+
+
+def cache_jobs(path=None, window=None):
+    """Return CacheJobs with a FakeArcpy and credentials."""
+    return CacheJobs(
+        path, window=window, arcpy_module=fake_arcpy(), username="admin", password="pw"
+    )
+
+
+def fake_arcpy():
+    """Return a FakeArcpy with extents for two data sources."""
+    return FakeArcpy(
+        {
+            "c:/data/roads.shp": FakeExtent(0, 0, 10, 10),
+            "c:/data/parks.shp": FakeExtent(5, -5, 20, 8),
+        }
+    )
+
+
+def test_in_window():
+    """The off-peak window can span midnight."""
+    window = tile_cache.parse_window("22:00-05:00")
+    night = time.mktime((2020, 1, 1, 23, 30, 0, 0, 0, -1))
+    day = time.mktime((2020, 1, 1, 12, 0, 0, 0, 0, -1))
+    early = time.mktime((2020, 1, 2, 4, 59, 0, 0, 0, -1))
+    assert tile_cache.in_window(window, night)
+    assert tile_cache.in_window(window, early)
+    assert not tile_cache.in_window(window, day)
+    assert tile_cache.in_window(tile_cache.parse_window("09:00-17:00"), day)
+    assert tile_cache.in_window(None, day)
+    assert tile_cache.parse_window("noon") is None
+
+
+def test_updates_changed_extent():
+    """The update covers the union of the changed sources at the given scales, and
+    its status is checked on the server."""
+    with FakeServerContext(FakeServer()) as server:
+        jobs = cache_jobs()
+        jobs.add("Roads/Map", "c:/server.ags", URL, ["c:/data/roads.shp"], [2000, 1000])
+        jobs.add("Roads/Map", "c:/server.ags", URL, ["c:/data/parks.shp"], [500])
+        assert len(jobs.queued) == 1
+        assert jobs.submit_due() == 1
+        assert jobs.wait(5)
+    print(server.jobs)
+    data = server.jobs[0]
+    assert data["service_url"] == "Roads/Map:MapServer"
+    assert data["levels"] == "500;1000;2000"
+    assert data["update_mode"] == tile_cache.UPDATE_MODE
+    extent = json.loads(data["update_extent"])
+    assert (extent["xmin"], extent["ymin"], extent["xmax"], extent["ymax"]) == (
+        0,
+        -5,
+        20,
+        10,
+    )
+    assert extent["spatialReference"] == {"wkid": 3857}
+    status = jobs.status()[0]
+    assert status["status"] == "succeeded" and status["job_id"] == "j1"
+
+
+def test_unknown_source_uses_full_extent():
+    """If the extent of a changed source is unknown, the full extent is updated at
+    all the cached scales; services that are not cached are skipped."""
+    with FakeServerContext(FakeServer()) as server:
+        jobs = cache_jobs()
+        jobs.add("Map", "c:/server.ags", URL, ["c:/data/missing.shp"])
+        jobs.submit_due()
+    assert server.jobs[0]["update_extent"] == ""
+    assert server.jobs[0]["levels"] == "4000;2000"
+    with FakeServerContext(FakeServer(cached=False)) as server:
+        jobs = cache_jobs()
+        jobs.add("Map", "c:/server.ags", URL)
+        assert jobs.submit_due() == 0
+    assert not server.jobs
+    assert jobs.status()[0]["status"] == "not_cached"
+
+
+def test_failed_submission_is_retried():
+    """A job that can not be submitted stays queued (with an update of the same
+    service queued since) until MAX_ATTEMPTS submissions have failed."""
+    with FakeServerContext(FakeServer(failures=1)) as server:
+        jobs = cache_jobs()
+        jobs.add("Map", "c:/server.ags", URL, ["c:/data/roads.shp"], [1000])
+        assert jobs.submit_due() == 0
+        assert [job["attempts"] for job in jobs.queued] == [1]
+        assert jobs.running == []
+        jobs.add("Map", "c:/server.ags", URL, ["c:/data/parks.shp"], [1000])
+        assert jobs.submit_due() == 1
+        assert len(server.jobs) == 1
+        assert not jobs.queued
+    extent = json.loads(server.jobs[0]["update_extent"])
+    assert (extent["xmin"], extent["xmax"]) == (0, 20)
+
+    print("test the job fails after MAX_ATTEMPTS")
+    with FakeServerContext(FakeServer(failures=tile_cache.MAX_ATTEMPTS)) as server:
+        jobs = cache_jobs()
+        jobs.add("Map", "c:/server.ags", URL, None, [1000])
+        for _ in range(tile_cache.MAX_ATTEMPTS):
+            assert jobs.submit_due() == 0
+        assert not jobs.queued
+        status = jobs.status()[0]
+        assert status["status"] == "failed"
+        assert status["attempts"] == tile_cache.MAX_ATTEMPTS
+    assert not server.jobs
+
+
+def test_waits_for_window():
+    """Jobs queued outside the window are saved and submitted by a later run; the
+    running jobs are saved, and a later run reports when they finish."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "cache_jobs.json")
+        day = time.mktime((2020, 1, 1, 12, 0, 0, 0, 0, -1))
+        night = time.mktime((2020, 1, 1, 23, 0, 0, 0, 0, -1))
+        with FakeServerContext(FakeServer()) as server:
+            jobs = cache_jobs(path, window="22:00-05:00")
+            jobs.add("Map", "c:/server.ags", URL, None, [1000])
+            assert jobs.submit_due(day) == 0
+            assert jobs.status()[0]["status"] == "queued"
+            jobs.save()
+            assert not server.jobs
+
+            jobs = cache_jobs(path, window="22:00-05:00")
+            assert len(jobs.queued) == 1
+            assert jobs.submit_due(night) == 1
+            assert jobs.refresh() == 1
+            jobs.save()
+            assert len(server.jobs) == 1
+
+            print("test the next run checks the running job")
+            jobs = cache_jobs(path)
+            assert not jobs.queued
+            assert [job["job_id"] for job in jobs.running] == ["j1"]
+            assert jobs.refresh() == 0
+            assert jobs.status()[0]["status"] == "succeeded"
+            jobs.save()
+            assert not cache_jobs(path).running
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_legacy_file():
+    """A file saved before the running jobs were kept is the list of queued jobs."""
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "cache_jobs.json")
+        job = {
+            "service_path": "Map",
+            "server": "c:/server.ags",
+            "server_url": URL,
+            "sources": None,
+            "scales": None,
+            "queued": 0,
+        }
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps([job]))
+        jobs = cache_jobs(path)
+        assert [queued["service_path"] for queued in jobs.queued] == ["Map"]
+        assert jobs.running == []
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_in_window()
+    test_updates_changed_extent()
+    test_unknown_source_uses_full_extent()
+    test_failed_submission_is_retried()
+    test_waits_for_window()
+    test_legacy_file()
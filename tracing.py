@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Span based tracing of a publishing run.
+
+A span is a named, timed piece of work (i.e. drafting a document, or a ReST
+request) with the thread (worker) that did it, the span it is part of (the
+span that was open in the same thread when it started), and a few attributes.
+Tracing is off until start() is called; until then span() does nothing.
+
+At the end of the run, the spans can be saved as a Chrome trace (open it in
+chrome://tracing or https://ui.perfetto.dev) or sent to an OpenTelemetry
+collector with OTLP/HTTP (JSON) to see where the workers wait and which work
+is on the critical path.
+
+    with tracing.span("upload", service=doc.service_path):
+        ...
+
+    @tracing.traced("draft")
+    def create_draft(self):
+        ...
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import functools
+from io import open
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# The default OTLP/HTTP endpoint of a local OpenTelemetry collector
+OTLP_ENDPOINT = "http://localhost:4318/v1/traces"
+
+SERVICE_NAME = "agsbuilder"
+
+_tracer = None
+
+
+class Span(object):
+    """A timed piece of work. Use Tracer.span() (or span()) to create one."""
+
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.thread = threading.current_thread().name
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self.end = None
+
+    def set(self, key, value):
+        """Add (or replace) an attribute."""
+        self.attributes[key] = value
+
+
+class _NoSpan(object):
+    """The span returned when tracing is off."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, key, value):
+        """Do nothing."""
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _OpenSpan(object):
+    """A context manager that opens a span in the current thread."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, tracer, name, attributes):
+        self.__tracer = tracer
+        self.__name = name
+        self.__attributes = attributes
+        self.__span = None
+
+    def __enter__(self):
+        self.__span = self.__tracer.open(self.__name, self.__attributes)
+        return self.__span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None:
+            self.__span.error = "{0}".format(exc_value)
+        self.__tracer.close(self.__span)
+        return False
+
+
+class Tracer(object):
+    """Collects the spans of a run."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.__spans = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    @property
+    def spans(self):
+        """Return a list of the finished spans."""
+        with self.__lock:
+            return list(self.__spans)
+
+    def span(self, name, **attributes):
+        """Return a context manager for a span that is open in its with block."""
+        return _OpenSpan(self, name, attributes)
+
+    def open(self, name, attributes):
+        """Start and return a span in the current thread (see close())."""
+        stack = self.__stack()
+        parent_id = stack[-1].span_id if stack else None
+        new_span = Span(name, parent_id, attributes)
+        stack.append(new_span)
+        return new_span
+
+    def close(self, open_span):
+        """Finish a span started with open() in the current thread."""
+        open_span.end = time.time()
+        stack = self.__stack()
+        if open_span in stack:
+            stack.remove(open_span)
+        with self.__lock:
+            self.__spans.append(open_span)
+
+    def chrome_trace(self):
+        """Return the spans in the Chrome trace event format."""
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for item in sorted(self.spans, key=lambda s: s.start):
+            if item.thread not in thread_ids:
+                thread_ids[item.thread] = len(thread_ids) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": thread_ids[item.thread],
+                        "args": {"name": item.thread},
+                    }
+                )
+            args = dict(item.attributes)
+            args["span_id"] = item.span_id
+            args["parent_id"] = item.parent_id
+            if item.error is not None:
+                args["error"] = item.error
+            events.append(
+                {
+                    "name": item.name,
+                    "cat": item.name.split(".")[0],
+                    "ph": "X",
+                    "ts": int(item.start * 1000000),
+                    "dur": int((item.end - item.start) * 1000000),
+                    "pid": pid,
+                    "tid": thread_ids[item.thread],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def otlp(self):
+        """Return the spans as an OTLP/HTTP JSON (ExportTraceServiceRequest) payload."""
+        spans = []
+        for item in self.spans:
+            attributes = dict(item.attributes)
+            attributes["thread.name"] = item.thread
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 1,  # internal
+                "startTimeUnixNano": "{0}".format(int(item.start * 1e9)),
+                "endTimeUnixNano": "{0}".format(int(item.end * 1e9)),
+                "attributes": [
+                    _otlp_attribute(key, value)
+                    for key, value in sorted(attributes.items())
+                    if value is not None
+                ],
+                "status": {"code": 1},  # ok
+            }
+            if item.parent_id is not None:
+                otlp_span["parentSpanId"] = item.parent_id
+            if item.error is not None:
+                otlp_span["status"] = {"code": 2, "message": item.error}
+            spans.append(otlp_span)
+        resource = {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]}
+        scope_spans = [{"scope": {"name": SERVICE_NAME}, "spans": spans}]
+        return {"resourceSpans": [{"resource": resource, "scopeSpans": scope_spans}]}
+
+    def save_chrome_trace(self, path):
+        """Write the Chrome trace to path."""
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(self.chrome_trace()))
+
+    def export_otlp(self, endpoint=OTLP_ENDPOINT):
+        """Send the spans to an OpenTelemetry collector. Returns True if successful."""
+        # Imported here so that tracing can be used without requests.
+        import requests  # pylint: disable=import-outside-toplevel
+
+        try:
+            response = requests.post(
+                endpoint,
+                data=json.dumps(self.otlp()),
+                headers={"Content-Type": "application/json"},
+                timeout=30,
+            )
+            response.raise_for_status()
+        except Exception as ex:
+            logger.error("Unable to export the trace to %s: %s", endpoint, ex)
+            return False
+        return True
+
+    def __stack(self):
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = []
+            self.__local.stack = stack
+        return stack
+
+
+def start():
+    """Start tracing (if it is not already started), and return the tracer."""
+    global _tracer  # pylint: disable=global-statement
+
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    """Stop tracing and return the tracer (or None if tracing was not started)."""
+    global _tracer  # pylint: disable=global-statement
+
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def span(name, **attributes):
+    """Return a context manager for a span (it does nothing if tracing is off)."""
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return tracer.span(name, **attributes)
+
+
+def traced(name):
+    """A decorator that wraps a function (or method) call in a span.
+
+    If the first argument has a service_path (i.e. a Doc), it is added to the span."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            service = getattr(args[0], "service_path", None) if args else None
+            with _tracer.span(name, service=service):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": "{0}".format(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": "{0}".format(value)}
+    return {"key": key, "value": typed}
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the run tracing.
+
+Run with: python -m pytest tracing_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import tempfile
+import threading
+
+import tracing
+
+
+class FakeDoc(object):
+    """An object with a service_path, like a Doc."""
+
+    # pylint: disable=useless-object-inheritance,too-few-public-methods
+
+    service_path = "folder/name"
+
+    @tracing.traced("draft")
+    def draft(self):
+        """A traced method."""
+        with tracing.span("rest", url="http://server/arcgis"):
+            pass
+
+
+def test_off_by_default():
+    """Spans do nothing until tracing is started."""
+    tracing.stop()
+    with tracing.span("nothing") as span:
+        span.set("key", "value")
+    FakeDoc().draft()
+    assert tracing.stop() is None
+
+
+def test_parent_and_threads():
+    """Spans link to the open span in the same thread, and record the thread."""
+    tracer = tracing.start()
+    with tracing.span("run"):
+        FakeDoc().draft()
+    worker = threading.Thread(target=FakeDoc().draft, name="worker-1")
+    worker.start()
+    worker.join()
+    tracing.stop()
+    spans = dict(((span.name, span.thread), span) for span in tracer.spans)
+    main = threading.current_thread().name
+    assert spans[("draft", main)].parent_id == spans[("run", main)].span_id
+    assert spans[("rest", main)].parent_id == spans[("draft", main)].span_id
+    assert spans[("draft", main)].attributes["service"] == "folder/name"
+    assert spans[("draft", "worker-1")].parent_id is None
+    assert spans[("rest", "worker-1")].parent_id == spans[("draft", "worker-1")].span_id
+
+
+def test_exports():
+    """The spans are exported as a Chrome trace and an OTLP payload."""
+    tracer = tracing.start()
+    try:
+        with tracing.span("upload", service="a/b"):
+            raise ValueError("failed")
+    except ValueError:
+        pass
+    tracing.stop()
+    path = os.path.join(tempfile.mkdtemp(), "trace.json")
+    tracer.save_chrome_trace(path)
+    with open(path) as in_file:
+        events = json.load(in_file)["traceEvents"]
+    complete = [event for event in events if event["ph"] == "X"]
+    assert len(complete) == 1
+    assert complete[0]["args"]["error"] == "failed"
+    assert complete[0]["args"]["service"] == "a/b"
+    otlp = tracer.otlp()
+    span = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert span["status"]["code"] == 2
+    assert span["traceId"] == tracer.trace_id
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    test_off_by_default()
+    test_parent_and_threads()
+    test_exports()
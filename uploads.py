@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+A record of the service definitions uploaded for each document.
+
+A service definition that is newer than its source document does not mean the
+service is up to date: the upload may have failed, or the run may have stopped
+before it. Each time a service definition is uploaded, its signature (file name,
+mtime and size) is recorded beside the document, in <name>.uploads.json:
+  {"servers": {"<server>": ["<name>.sd", mtime, size], ...}}
+where <server> is the connection (*.ags) file, or 'My Hosted Services'. The
+service on a server is up to date if the recorded signature is the signature
+of the current service definition.
+
+When a replacement is rolled back (see Doc.rollback()), the signature of the
+source document is recorded as "rejected", so the document is not republished
+(and rolled back again) until it changes.
+
+Documents published before uploads were recorded have no file; for them, the
+catalog on the server is the only way to know if they were published.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# The server used by Doc when there is no connection file (see Doc.server)
+HOSTED_SERVICES = "My Hosted Services"
+
+# Uploads to several servers (see fanout.py) update the same file.
+_LOCK = threading.Lock()
+
+
+def path_for(source_path):
+    """Return the path of the uploads file for the document at source_path."""
+    return os.path.splitext(source_path)[0] + ".uploads.json"
+
+
+def connection(server):
+    """Return the server that a document is uploaded to for a server setting (a
+    connection file that may not exist, or None); the same as Doc uses."""
+    try:
+        if server is not None and os.path.exists(server):
+            return server
+    except TypeError:
+        pass
+    return HOSTED_SERVICES
+
+
+def is_current(source_path, server, service_definition):
+    """Return True if service_definition was the last one uploaded to server, False
+    if it was not, or None if uploads are not recorded for the document."""
+    if source_path is None:
+        return None
+    with _LOCK:
+        state = _load(path_for(source_path))
+    if state is None:
+        return None
+    uploaded = state["servers"].get(_key(server))
+    return uploaded is not None and uploaded == signature(service_definition)
+
+
+def record(source_path, server, service_definition):
+    """Record that service_definition was uploaded to server."""
+    if source_path is None:
+        return
+    with _LOCK:
+        path = path_for(source_path)
+        state = _load(path) or {"servers": {}}
+        state["servers"][_key(server)] = signature(service_definition)
+        state.pop("rejected", None)
+        _save(state, path)
+
+
+def reject(source_path):
+    """Record that the current version of the document was rejected (rolled back)."""
+    with _LOCK:
+        path = path_for(source_path)
+        state = _load(path) or {"servers": {}}
+        state["rejected"] = signature(source_path)
+        _save(state, path)
+
+
+def is_rejected(source_path):
+    """Return True if the document has not changed since it was rejected."""
+    if source_path is None:
+        return False
+    with _LOCK:
+        state = _load(path_for(source_path))
+    if state is None or state.get("rejected") is None:
+        return False
+    return state["rejected"] == signature(source_path)
+
+
+def signature(path):
+    """Return the [file name, mtime, size] of path (None if it is missing)."""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [os.path.basename(path), stat.st_mtime, stat.st_size]
+
+
+def _key(server):
+    return os.path.normcase("{0}".format(server))
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as in_file:
+            state = json.load(in_file)
+        state.setdefault("servers", {})
+        return state
+    except Exception as ex:
+        logger.warning("Unable to load the uploads %s: %s", path, ex)
+        return {"servers": {}}
+
+
+def _save(state, path):
+    try:
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(state, indent=2, sort_keys=True))
+    except Exception as ex:
+        logger.warning("Unable to save the uploads %s: %s", path, ex)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the record of the uploaded service definitions, and its use in planning.
+
+Run with: python -m pytest uploads_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import os
+import shutil
+import tempfile
+
+from doc_record import DocRecord
+import uploads
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+
+class FakeConfig(object):
+    """Settings with a connection file, or targets."""
+
+    def __init__(self, server=None, target=None):
+        self.server = server
+        self.target = target
+
+
+def write(path, text, mtime):
+    """Write text to path, and set its modified time."""
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_record_and_check():
+    """A service definition is current on the servers it was uploaded to."""
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        sd_file = os.path.join(folder, "roads.sd")
+        write(mxd, "map", 1000)
+        write(sd_file, "sd", 2000)
+        assert uploads.is_current(mxd, "c:/prod.ags", sd_file) is None
+        uploads.record(mxd, "c:/prod.ags", sd_file)
+        assert uploads.is_current(mxd, "c:/prod.ags", sd_file)
+        assert uploads.is_current(mxd, "c:/dev.ags", sd_file) is False
+        print("test a restaged service definition is not current")
+        write(sd_file, "sd", 3000)
+        assert uploads.is_current(mxd, "c:/prod.ags", sd_file) is False
+        assert uploads.connection(None) == uploads.HOSTED_SERVICES
+        assert uploads.connection(mxd) == mxd
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_failed_upload_is_not_up_to_date():
+    """A service definition newer than the document is only up to date if it was
+    uploaded; without a record of the uploads, the server must be checked."""
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        sd_file = os.path.join(folder, "roads.sd")
+        ags = os.path.join(folder, "prod.ags")
+        write(mxd, "map", 1000)
+        write(ags, "connection", 1000)
+        record = DocRecord(mxd, config=FakeConfig(ags))
+        assert not record.is_up_to_date
+
+        write(sd_file, "sd", 2000)
+        assert record.is_up_to_date and record.is_uploaded is None
+        uploads.record(mxd, ags, os.path.join(folder, "other.sd"))
+        assert not record.is_up_to_date and record.is_uploaded is False
+        uploads.record(mxd, ags, sd_file)
+        assert record.is_up_to_date and record.is_uploaded
+        write(mxd, "new map", 3000)
+        assert not record.is_up_to_date
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_staged_variants_are_up_to_date_on_targets():
+    """Publishing to targets stages variants (not <name>.sd); a document is up to
+    date when a staged variant was uploaded to every target."""
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        new_sd = os.path.join(folder, "roads.new.sd")
+        replacement_sd = os.path.join(folder, "roads.replacement.sd")
+        write(mxd, "map", 1000)
+        config = FakeConfig(target=["dev=c:/dev.ags", "c:/prod.ags"])
+        record = DocRecord(mxd, config=config)
+        assert not record.is_up_to_date
+
+        write(new_sd, "sd", 2000)
+        write(replacement_sd, "sd", 2000)
+        assert record.is_up_to_date and record.is_uploaded is None
+        uploads.record(mxd, "c:/dev.ags", new_sd)
+        assert not record.is_up_to_date and record.is_uploaded is False
+        uploads.record(mxd, "c:/prod.ags", os.path.join(folder, "other.sd"))
+        assert not record.is_up_to_date
+        uploads.record(mxd, "c:/prod.ags", replacement_sd)
+        assert record.is_up_to_date and record.is_uploaded
+        write(mxd, "new map", 3000)
+        assert not record.is_up_to_date
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_rejected_until_changed():
+    """A rolled back document is rejected until it changes, or is uploaded again."""
+    folder = tempfile.mkdtemp()
+    try:
+        mxd = os.path.join(folder, "roads.mxd")
+        write(mxd, "map", 1000)
+        record = DocRecord(mxd)
+        assert not record.is_rejected
+        uploads.reject(mxd)
+        assert record.is_rejected
+        write(mxd, "edited map", 2000)
+        assert not record.is_rejected
+        uploads.reject(mxd)
+        uploads.record(mxd, "c:/prod.ags", mxd)
+        assert not record.is_rejected
+        assert not uploads.is_rejected(None)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_record_and_check()
+    test_failed_upload_is_not_up_to_date()
+    test_staged_variants_are_up_to_date_on_targets()
+    test_rejected_until_changed()
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Collect service usage statistics from ArcGIS Server, and recommend instance
+settings from them.
+
+The request count and response times of each service are read from the admin
+usage report API (admin/usagereports/query) and stored in a local SQLite time
+series (one row per service per time slice). Each collection continues where the
+last one stopped, so collecting on every publishing run (or on any other
+schedule) builds a continuous history.
+
+ArcGIS Server does not report the time a request waits for a free instance;
+requests that wait longer than the maxWaitTime are reported as timed out, so
+timeouts are used as the sign that a service needs more instances.
+
+From the history, the busy concurrency of each service is estimated with
+Little's law (requests per second * average response time). The recommended
+max_instances covers the peak concurrency with HEADROOM to spare, and
+min_instances covers the typical concurrency (0 for services that are rarely
+used). The recommendations use the pooling.py setting names, so they can be
+applied with the same path as the service_list settings.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import closing
+import json
+import logging
+import math
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# usage report metric: column in the usage table
+METRICS = {
+    "RequestCount": "requests",
+    "RequestAvgResponseTime": "avg_response",  # milliseconds
+    "RequestMaxResponseTime": "max_response",  # milliseconds
+    "RequestsTimedOut": "timeouts",
+    "ServiceActiveInstances": "instances",
+}
+
+# Minutes in each time slice of a collected report
+AGGREGATION_INTERVAL = 60
+
+# Days of history to collect the first time, and to use for recommendations
+HISTORY_DAYS = 7
+
+# Multiple of the peak concurrency to allow for in max_instances
+HEADROOM = 1.5
+
+# Upper limit for a recommended max_instances
+MAX_INSTANCES = 8
+
+# Services with fewer requests per day (on average) can have min_instances = 0
+IDLE_REQUESTS_PER_DAY = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    service TEXT NOT NULL,
+    time REAL NOT NULL,
+    seconds REAL NOT NULL,
+    requests INTEGER,
+    avg_response REAL,
+    max_response REAL,
+    timeouts INTEGER,
+    instances REAL,
+    PRIMARY KEY (service, time)
+)
+"""
+
+
+class UsageStore(object):
+    """A time series of service usage in a SQLite database.
+
+    Service paths (folder/name) are stored in lower case."""
+
+    def __init__(self, path, timeout=60):
+        self.__path = path
+        self.__timeout = timeout
+        with closing(self.__connect()) as connection:
+            connection.execute(SCHEMA)
+
+    @property
+    def path(self):
+        """Return the filesystem path to the database."""
+        return self.__path
+
+    def add(self, rows):
+        """Add (or replace) rows; each is a dictionary with service, time, seconds
+        and a value (or None) for each of the METRICS columns."""
+        columns = ["service", "time", "seconds"] + sorted(METRICS.values())
+        sql = "INSERT OR REPLACE INTO usage ({0}) VALUES ({1})".format(
+            ", ".join(columns), ", ".join("?" * len(columns))
+        )
+        values = [[row.get(column) for column in columns] for row in rows]
+        with closing(self.__connect()) as connection:
+            connection.execute("BEGIN")
+            connection.executemany(sql, values)
+            connection.execute("COMMIT")
+        return len(values)
+
+    def last_time(self):
+        """Return the end time (seconds since the epoch) of the newest slice, or None."""
+        with closing(self.__connect()) as connection:
+            row = connection.execute("SELECT MAX(time + seconds) FROM usage").fetchone()
+        return row[0]
+
+    def rows(self, since):
+        """Return a dictionary of {service path: [row, ...]} of the slices after since."""
+        columns = ["service", "time", "seconds"] + sorted(METRICS.values())
+        sql = "SELECT {0} FROM usage WHERE time >= ? ORDER BY service, time".format(
+            ", ".join(columns)
+        )
+        result = {}
+        with closing(self.__connect()) as connection:
+            for values in connection.execute(sql, (since,)):
+                row = dict(zip(columns, values))
+                result.setdefault(row["service"], []).append(row)
+        return result
+
+    def daily_requests(self, days=HISTORY_DAYS):
+        """Return a dictionary of {service path: average requests per day}."""
+        since = time.time() - days * 86400
+        sql = (
+            "SELECT service, SUM(requests) FROM usage WHERE time >= ? GROUP BY service"
+        )
+        with closing(self.__connect()) as connection:
+            return dict(
+                (service, (total or 0) / days)
+                for service, total in connection.execute(sql, (since,))
+            )
+
+    def recommendations(self, days=HISTORY_DAYS):
+        """Return a dictionary of {service path: {'min_instances': n,
+        'max_instances': m}} from the usage in the last days."""
+        since = time.time() - days * 86400
+        return dict(
+            (service, recommend(rows, days))
+            for service, rows in self.rows(since).items()
+        )
+
+    def prune(self, days):
+        """Delete the slices older than days."""
+        with closing(self.__connect()) as connection:
+            connection.execute(
+                "DELETE FROM usage WHERE time < ?", (time.time() - days * 86400,)
+            )
+
+    def __connect(self):
+        # Autocommit mode; transactions are managed explicitly where needed.
+        return sqlite3.connect(
+            self.__path, timeout=self.__timeout, isolation_level=None
+        )
+
+
+class UsageCollector(object):
+    """Reads usage reports from the admin API of an ArcGIS Server."""
+
+    def __init__(self, server_url, token, post=None):
+        """post is a function like rest.post (the default); tests can provide
+        a stand-in that returns recorded responses."""
+        self.__server_url = server_url
+        self.__token = token
+        if post is None:
+            # Imported here so that the usage history can be used without requests.
+            import rest  # pylint: disable=import-outside-toplevel
+
+            post = rest.post
+        self.__post = post
+
+    def collect(self, resource_uris, since, until=None):
+        """Return the usage rows for resource_uris between since and until (seconds
+        since the epoch; until defaults to now), or None if the query failed."""
+        if until is None:
+            until = time.time()
+        report = {
+            "reportname": "agsbuilder_" + uuid.uuid4().hex,
+            "since": "CUSTOM",
+            "from": int(since * 1000),
+            "to": int(until * 1000),
+            "aggregationInterval": AGGREGATION_INTERVAL,
+            "queries": [{"resourceURIs": resource_uris, "metrics": sorted(METRICS)}],
+            "metadata": {"temp": True},
+        }
+        data = {
+            "f": "json",
+            "token": self.__token,
+            "usagereport": json.dumps(report),
+            "filter": json.dumps({"machines": "*"}),
+        }
+        url = self.__server_url + "/admin/usagereports/query"
+        try:
+            logger.info("Querying usage of %s services", len(resource_uris))
+            response = self.__post(url, data=data)
+            response.raise_for_status()
+            json_response = response.json()
+        except Exception as ex:
+            logger.error("Unable to query the usage reports: %s", ex)
+            return None
+        if "report" not in json_response:
+            logger.error("Invalid usage report response: %s", json_response)
+            return None
+        return parse_report(json_response["report"])
+
+
+def collect(store, collector, services, days=HISTORY_DAYS):
+    """Add the usage of services (from util.get_services_from_server) since the last
+    collection (at most days ago) to store. Returns the number of rows added."""
+    now = time.time()
+    since = now - days * 86400
+    last = store.last_time()
+    if last is not None and last > since:
+        since = last
+    if now - since < AGGREGATION_INTERVAL * 60:
+        logger.debug("Usage was collected less than a time slice ago")
+        return 0
+    uris = resource_uris(services)
+    if not uris:
+        return 0
+    rows = collector.collect(uris, since, now)
+    if rows is None:
+        return 0
+    return store.add(rows)
+
+
+def resource_uris(services):
+    """Return the usage report resource URIs for services, a list of (folder,
+    service) from util.get_services_from_server."""
+    uris = []
+    for _, service in services or []:
+        try:
+            uris.append("services/{0}.{1}".format(service["name"], service["type"]))
+        except (TypeError, KeyError):
+            logger.debug("Skipping a service without a name and type: %s", service)
+    return uris
+
+
+def parse_report(report):
+    """Return a list of usage rows from a usage report (the 'report' in the response)."""
+    slices = [ms / 1000.0 for ms in report.get("time-slices", [])]
+    seconds = AGGREGATION_INTERVAL * 60.0
+    if len(slices) > 1:
+        seconds = slices[1] - slices[0]
+    rows = {}
+    for group in report.get("report-data", []):
+        for item in group:
+            column = METRICS.get(item.get("metric-type"))
+            service = _service_path(item.get("resourceURI"))
+            if column is None or service is None:
+                continue
+            for index, value in enumerate(item.get("data", [])):
+                if index >= len(slices):
+                    break
+                key = (service, slices[index])
+                if key not in rows:
+                    rows[key] = {"service": service, "time": slices[index]}
+                    rows[key]["seconds"] = seconds
+                rows[key][column] = value
+    return [rows[key] for key in sorted(rows)]
+
+
+def recommend(rows, days=HISTORY_DAYS):
+    """Return the recommended {'min_instances': n, 'max_instances': m} for the usage
+    rows of one service."""
+    concurrency = []
+    total_requests = 0
+    timeouts = 0
+    for row in rows:
+        requests_count = row.get("requests") or 0
+        total_requests += requests_count
+        timeouts += row.get("timeouts") or 0
+        if requests_count and row.get("seconds"):
+            response = (row.get("avg_response") or 0) / 1000.0
+            concurrency.append(requests_count * response / row["seconds"])
+    peak = max(concurrency) if concurrency else 0
+    max_instances = int(math.ceil(peak * HEADROOM)) + (1 if timeouts else 0)
+    max_instances = min(MAX_INSTANCES, max(1, max_instances))
+    if total_requests < IDLE_REQUESTS_PER_DAY * days:
+        min_instances = 0
+    else:
+        typical = sum(concurrency) / len(concurrency)
+        min_instances = min(max_instances, max(1, int(math.ceil(typical))))
+    return {"min_instances": min_instances, "max_instances": max_instances}
+
+
+def apply_recommendation(settings, recommendation):
+    """Return a copy of settings (a service_list row) with the recommended instance
+    settings added. Settings in the service_list are not replaced."""
+    settings = dict(settings or {})
+    for name, value in (recommendation or {}).items():
+        if not (settings.get(name) or "").strip():
+            settings[name] = "{0}".format(value)
+    return settings
+
+
+def _service_path(resource_uri):
+    """Return 'folder/name' (lower case) for 'services/folder/name.MapServer'."""
+    if not resource_uri or not resource_uri.startswith("services/"):
+        return None
+    path = resource_uri[len("services/") :]
+    if "." in path:
+        path = path.rsplit(".", 1)[0]
+    return path.lower() or None
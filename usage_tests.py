@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the usage statistics collector, with a recorded server response.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import usage
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+SERVICES = [
+    (None, {"name": "Trails", "type": "MapServer"}),
+    ("Base", {"name": "Base/Roads", "type": "MapServer"}),
+]
+
+
+class RecordedResponse(object):
+    """A stand-in for a requests.Response with a recorded JSON body."""
+
+    # pylint: disable=useless-object-inheritance
+
+    def __init__(self, name):
+        with open(os.path.join(TEST_DATA, name), "r", encoding="utf-8") as in_file:
+            self.__json = json.load(in_file)
+
+    def raise_for_status(self):
+        """The recorded response was successful."""
+
+    def json(self):
+        """Return the recorded body."""
+        return self.__json
+
+
+class RecordedServer(object):
+    """A stand-in for requests.post that records the requests."""
+
+    # pylint: disable=useless-object-inheritance,too-few-public-methods
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = []
+
+    def __call__(self, url, data=None):
+        self.requests.append((url, data))
+        return RecordedResponse(self.name)
+
+
+def test_collect():
+    """Test that a usage report is queried, parsed and stored."""
+    folder = tempfile.mkdtemp()
+    try:
+        store = usage.UsageStore(os.path.join(folder, "usage.sqlite"))
+        server = RecordedServer("usage_report.json")
+        collector = usage.UsageCollector("http://server/arcgis", "token", post=server)
+        count = usage.collect(store, collector, SERVICES)
+        print("rows added:", count)
+        assert count == 6
+        url, data = server.requests[0]
+        assert url == "http://server/arcgis/admin/usagereports/query"
+        query = json.loads(data["usagereport"])["queries"][0]
+        assert query["resourceURIs"] == [
+            "services/Trails.MapServer",
+            "services/Base/Roads.MapServer",
+        ]
+        rows = store.rows(0)
+        assert sorted(rows) == ["base/roads", "trails"]
+        assert rows["base/roads"][1]["requests"] == 7200
+        assert rows["base/roads"][1]["seconds"] == 3600
+        assert rows["trails"][1]["requests"] is None
+        assert store.last_time() == 1600010800
+
+        print("test the next collection starts where the last one stopped")
+        usage.collect(store, collector, SERVICES)
+        report = json.loads(server.requests[1][1]["usagereport"])
+        assert report["from"] >= int(time.time() - usage.HISTORY_DAYS * 86400) * 1000
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_recommend():
+    """Test the recommended instances for busy and idle services."""
+    report = RecordedResponse("usage_report.json").json()["report"]
+    rows = usage.parse_report(report)
+    busy = [row for row in rows if row["service"] == "base/roads"]
+    idle = [row for row in rows if row["service"] == "trails"]
+    # Peak concurrency is 7200 requests * 1 second / 3600 seconds = 2
+    # 2 * HEADROOM = 3, plus 1 for the timeouts
+    recommendation = usage.recommend(busy, days=1)
+    print("busy:", recommendation)
+    assert recommendation == {"min_instances": 1, "max_instances": 4}
+    recommendation = usage.recommend(idle, days=1)
+    print("idle:", recommendation)
+    assert recommendation == {"min_instances": 0, "max_instances": 1}
+
+    print("test the service_list settings are not replaced")
+    settings = usage.apply_recommendation(
+        {"min_instances": "2", "max_instances": " "},
+        {"min_instances": 0, "max_instances": 4},
+    )
+    assert settings == {"min_instances": "2", "max_instances": "4"}
+
+
+def test_daily_requests():
+    """Test the requests per day used to prioritize the publishing schedule."""
+    folder = tempfile.mkdtemp()
+    try:
+        store = usage.UsageStore(os.path.join(folder, "usage.sqlite"))
+        now = time.time()
+        store.add(
+            [
+                {"service": "a", "time": now - 3600, "seconds": 3600, "requests": 70},
+                {"service": "a", "time": now - 7200, "seconds": 3600, "requests": 70},
+                {"service": "b", "time": now - 30 * 86400, "seconds": 3600},
+            ]
+        )
+        daily = store.daily_requests(days=7)
+        print("daily requests:", daily)
+        assert daily == {"a": 20}
+        store.prune(days=7)
+        assert sorted(store.rows(0)) == ["a"]
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_collect()
+    test_recommend()
+    test_daily_requests()
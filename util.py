@@ -8,10 +8,12 @@ Requires the 3rd party `requests` module: `pip install requests`
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from io import open
+import hashlib
 import logging
 import os
 
-import requests
+import ags_file
+import rest
 
 
 logger = logging.getLogger(__name__)
@@ -22,14 +24,25 @@ logger.addHandler(logging.NullHandler())
 
 
 def get_service_url_from_ags_file(path):
-    """Find and return the first 'URL' string in the utf16 encoded file at path.
+    """Return the base server URL (i.e. http://server:6080/arcgis) in the *.ags file.
 
+    The file is parsed (and the result cached) by ags_file.read(); if it is not a
+    compound document, fall back to searching the (utf16) text for a URL.
     Will return None with unexpected input or results."""
 
     if path is None or not os.path.exists(path):
         logger.warning("No valid path provided to get_service_url_from_ags_file()")
         return None
 
+    connection = ags_file.read(path)
+    if connection is not None:
+        return connection.server_url
+    return _find_service_url_in_text_file(path)
+
+
+def _find_service_url_in_text_file(path):
+    """Find and return the first 'URL' string in the utf16 encoded file at path."""
+
     url_start = "http"
     url_end = "/arcgis"
     result = set([])
@@ -63,7 +76,7 @@ def get_services_from_server(server_url):
     url = server_url + "/rest/services?f=json"
 
     try:
-        json = requests.get(url).json()
+        json = rest.get(url).json()
         # sample response: {..., "folders":["folder1","folder2"], ...}
         root_services = json["services"]
         folders = json["folders"]
@@ -93,7 +106,7 @@ def get_services_from_server_folder(server_url, folder):
     else:
         url = server_url + "/rest/services/" + folder + "?f=json"
     try:
-        json = requests.get(url).json()
+        json = rest.get(url).json()
         # sample response: {..., "services":
         #    [{"name": "WebMercator/DENA_Final_IFSAR_WM", "type": "ImageServer"}]}
         services = json["services"]
@@ -108,6 +121,47 @@ def get_services_from_server_folder(server_url, folder):
     return services
 
 
+def get_token(url, username, password):
+    """Return an admin token for the server at url (or None if login fails)."""
+
+    # TODO: use url/rest/info?f=json  resp['authInfo']['tokenServicesUrl'] + generateTokens
+    logger.debug("Generate admin token")
+    path = "/admin/generateToken"
+    # path = '/tokens/generateToken' requires https?
+    data = {
+        "f": "json",
+        "username": username,
+        "password": password,
+        "client": "request_ip",
+        "expiration": "60",
+    }
+    try:
+        response = rest.post(url + path, data=data)
+        response.raise_for_status()
+    except rest.RequestException as ex:
+        logger.error(ex)
+        return None
+    json_response = response.json()
+    logger.debug("Login Response: %s", json_response)
+    try:
+        if "token" in json_response:
+            return json_response["token"]
+        if "error" in json_response:
+            logger.debug("Server response: %s", json_response)
+            logger.error(
+                "%s (%s)",
+                json_response["error"]["message"],
+                ";".join(json_response["error"]["details"]),
+            )
+        else:
+            raise TypeError
+    except (TypeError, KeyError):
+        logger.error(
+            "Invalid server response while generating token: %s", json_response
+        )
+    return None
+
+
 def service_path(mxd_path, folder=None):
     """Return a server appropriate service and folder name for mxd_path and folder."""
 
@@ -133,3 +187,26 @@ def sanitize_service_name(name, replacement="_"):
         return None
     clean_chars = [c if c.isalnum() else replacement for c in name]
     return "".join(clean_chars)[:120]
+
+
+def shard_index(service_path, shard_count):
+    """Return the (zero based) shard that service_path belongs to.
+
+    The shard is based on a stable hash of the (case insensitive) service path,
+    so every node in a multi-node run will make the same assignment."""
+
+    if shard_count is None or shard_count < 2 or service_path is None:
+        return 0
+    digest = hashlib.md5(service_path.lower().encode("utf-8")).hexdigest()
+    return int(digest, 16) % shard_count
+
+
+def parse_shard(text):
+    """Convert 'i/n' to the tuple (i, n) where 1 <= i <= n.
+
+    Raises ValueError if text is not a valid shard."""
+
+    index, count = [int(part) for part in text.split("/")]
+    if count < 1 or index < 1 or index > count:
+        raise ValueError("Shard must be i/n where 1 <= i <= n, got {0}".format(text))
+    return index, count
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Wait for newly published services to be ready, and warm them up.
+
+After a service is uploaded, a background worker polls the service's ReST
+endpoint until it answers (or until the timeout), and records the time it took
+(from the first poll, like the timeout) apart from the time the service waited
+for a free worker.
+It then sends a few warm-up requests, so that the first users do not wait for
+cold instances and empty caches:
+  * export: a map image of the full extent,
+  * query: a count of the features in the first layer,
+  * tile: the first tile (only for cached services).
+Each request is sent `repeat` times at once, so that more than one instance
+is started.  Services that never become ready are flagged in the results.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import threading
+import time
+
+import rest
+import util
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# broad exception catching will be logged.
+# pylint: disable=broad-except
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+WARMUP_REQUESTS = ("export", "query", "tile")
+
+
+class Warmup(object):
+    """A pool of background workers that check and warm up published services."""
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(
+        self,
+        warmup_requests=WARMUP_REQUESTS,
+        repeat=2,
+        max_workers=4,
+        timeout=300,
+        interval=5,
+    ):
+        """warmup_requests is a list of the warm-up requests (see WARMUP_REQUESTS).
+        timeout is the time (seconds) to wait for a service to be ready, and interval
+        is the time between checks."""
+        self.__warmup_requests = [
+            name for name in warmup_requests or [] if name in WARMUP_REQUESTS
+        ]
+        self.__repeat = max(1, repeat)
+        self.__timeout = timeout
+        self.__interval = interval
+        self.__queue = queue.Queue()
+        self.__results = []
+        self.__lock = threading.Lock()
+        self.__workers = []
+        for index in range(max(1, max_workers)):
+            worker = threading.Thread(
+                target=self.__work, name="warmup-{0}".format(index)
+            )
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    def submit(self, doc, server_url=None, target=None):
+        """Check and warm up the service for doc (on server_url, the default is
+        doc.server_url) in the background."""
+        server_url = server_url or doc.server_url
+        if server_url is None or doc.service_path is None:
+            logger.info("Unable to warm up %s without a server URL", doc.name)
+            return
+        self.__queue.put((doc, server_url, target, time.time()))
+
+    def listener(self, doc, stage, _):
+        """A Doc stage listener (see Doc.add_listener) that submits uploaded services."""
+        if stage == "uploaded":
+            self.submit(doc)
+
+    def wait(self):
+        """Wait for all the submitted services, and return a list of the results.
+
+        Each result is a dictionary with the doc, service_path, target, ready (bool),
+        seconds_queued (from the upload to the first check), seconds_to_ready (from
+        the first check), and the milliseconds for each warm-up request."""
+        self.__queue.join()
+        with self.__lock:
+            return list(self.__results)
+
+    def __work(self):
+        while True:
+            item = self.__queue.get()
+            try:
+                result = self.__check(*item)
+                with self.__lock:
+                    self.__results.append(result)
+            except Exception as ex:
+                logger.error("Unable to warm up %s: %s", item[0].name, ex)
+            finally:
+                self.__queue.task_done()
+
+    def __check(self, doc, server_url, target, uploaded):
+        result = {
+            "doc": doc,
+            "service_path": doc.service_path,
+            "target": target,
+            "ready": False,
+            "seconds_queued": None,
+            "seconds_to_ready": None,
+            "warmup": {},
+        }
+        started = time.time()
+        result["seconds_queued"] = round(started - uploaded, 3)
+        url, info = wait_until_ready(
+            server_url, doc.service_path, self.__timeout, self.__interval
+        )
+        if info is None:
+            logger.error(
+                "%s did not start in %s seconds", doc.service_path, self.__timeout
+            )
+            return result
+        result["ready"] = True
+        result["seconds_to_ready"] = round(time.time() - started, 3)
+        logger.info(
+            "%s was ready in %s seconds", doc.service_path, result["seconds_to_ready"]
+        )
+        for name in self.__warmup_requests:
+            request = warmup_request(name, url, info)
+            if request is not None:
+                result["warmup"][name] = self.__send(*request)
+        return result
+
+    def __send(self, url, params):
+        """Send the request repeat times at once, and return the milliseconds for each
+        (None for a failed request)."""
+        times = [None] * self.__repeat
+
+        def send(index):
+            start = time.time()
+            try:
+                response = rest.get(url, params=params, timeout=120)
+                response.raise_for_status()
+                times[index] = round((time.time() - start) * 1000)
+            except Exception as ex:
+                logger.warning("Warm-up request %s failed: %s", url, ex)
+
+        threads = [
+            threading.Thread(target=send, args=(index,))
+            for index in range(self.__repeat)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return times
+
+
+def wait_until_ready(server_url, service_path, timeout=300, interval=5):
+    """Return the URL and the JSON description of the service once it answers,
+    or (None, None) if it is not ready before the timeout (seconds)."""
+    deadline = time.time() + timeout
+    while True:
+        url = service_url(server_url, service_path)
+        if url is not None:
+            try:
+                response = rest.get(url, params={"f": "json"}, timeout=30)
+                info = response.json()
+                if response.status_code == 200 and "error" not in info:
+                    return url, info
+                logger.debug("%s is not ready: %s", service_path, info)
+            except Exception as ex:
+                logger.debug("%s is not ready: %s", service_path, ex)
+        if time.time() + interval > deadline:
+            return None, None
+        time.sleep(interval)
+
+
+def service_url(server_url, service_path):
+    """Return the ReST URL of the service (the type is looked up in the catalog)."""
+    folder = None
+    if "/" in service_path:
+        folder = service_path.split("/", 1)[0]
+    services = util.get_services_from_server_folder(server_url, folder)
+    for service in services or []:
+        try:
+            if service["name"].lower() == service_path.lower():
+                return "{0}/rest/services/{1}/{2}".format(
+                    server_url, service["name"], service["type"]
+                )
+        except (TypeError, KeyError):
+            continue
+    return None
+
+
+def warmup_request(name, url, info):
+    """Return the (url, params) for the warm-up request name, or None if it does not
+    apply to the service described by info."""
+    if name == "export":
+        extent = info.get("fullExtent") or info.get("initialExtent")
+        if not extent or not url.endswith("MapServer"):
+            return None
+        bbox = "{0},{1},{2},{3}".format(
+            extent["xmin"], extent["ymin"], extent["xmax"], extent["ymax"]
+        )
+        params = {"f": "image", "bbox": bbox, "size": "800,600", "format": "png"}
+        return url + "/export", params
+    if name == "query":
+        layers = info.get("layers") or []
+        if not layers:
+            return None
+        params = {"f": "json", "where": "1=1", "returnCountOnly": "true"}
+        return "{0}/{1}/query".format(url, layers[0]["id"]), params
+    if name == "tile":
+        if not info.get("singleFusedMapCache") or not info.get("tileInfo"):
+            return None
+        return url + "/tile/0/0/0", {}
+    return None
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for waiting for new services to be ready, and warming them up.
+
+Run with: python -m pytest warmup_tests.py
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import time
+
+import http_replay
+import rest
+from warmup import Warmup, wait_until_ready, warmup_request
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+
+URL = "https://gis/arcgis"
+
+
+class StartingService(object):
+    """A transport for a server with a cached map service (Transport/Roads) that is
+    not ready (an error) until it has been checked `starts_after` times."""
+
+    def __init__(self, starts_after=2):
+        self.starts_after = starts_after
+        self.checks = 0
+        self.requests = []  # the URL of each warm-up request
+
+    def request(self, method, url, **kwargs):
+        """Answer a catalog, service description, or warm-up request."""
+        # pylint: disable=unused-argument
+        url = url.split("?", 1)[0]
+        if url == URL + "/rest/services/Transport":
+            services = [{"name": "Transport/Roads", "type": "MapServer"}]
+            body = {"folders": [], "services": services}
+        elif url == URL + "/rest/services/Transport/Roads/MapServer":
+            self.checks += 1
+            if self.checks < self.starts_after:
+                body = {"error": {"code": 500, "message": "Service not started"}}
+            else:
+                body = {
+                    "fullExtent": {"xmin": 0, "ymin": 1, "xmax": 2, "ymax": 3},
+                    "layers": [{"id": 4, "name": "Roads"}],
+                    "singleFusedMapCache": True,
+                    "tileInfo": {"rows": 256},
+                }
+        else:
+            self.requests.append(url)
+            body = {}
+        return http_replay.ReplayResponse(
+            200, json.dumps(body), url, "application/json"
+        )
+
+
+class FakeDoc(object):
+    """The parts of a Doc used by Warmup."""
+
+    def __init__(self, service_path="Transport/Roads"):
+        self.name = self.service_path = service_path
+        self.server_url = URL
+
+
+def test_polls_until_ready():
+    """The service is checked every interval until it answers without an error."""
+    service = StartingService(starts_after=3)
+    previous = rest.set_transport(service)
+    try:
+        url, info = wait_until_ready(URL, "Transport/Roads", timeout=5, interval=0.01)
+    finally:
+        rest.set_transport(previous)
+    assert url == URL + "/rest/services/Transport/Roads/MapServer"
+    assert info["layers"][0]["id"] == 4
+    assert service.checks == 3
+
+
+def test_gives_up_at_the_timeout():
+    """A service that does not start (or is not in the catalog) is not ready."""
+    service = StartingService(starts_after=1000)
+    previous = rest.set_transport(service)
+    try:
+        start = time.time()
+        result = wait_until_ready(URL, "Transport/Roads", timeout=0.2, interval=0.05)
+        assert result == (None, None)
+        assert time.time() - start < 1
+        assert 1 < service.checks < 10
+        missing = wait_until_ready(URL, "Transport/Rails", timeout=0, interval=0.05)
+        assert missing == (None, None)
+    finally:
+        rest.set_transport(previous)
+
+
+def test_warmup_requests():
+    """Each warm-up request applies only to services that support it."""
+    url = URL + "/rest/services/Roads/MapServer"
+    info = {
+        "fullExtent": {"xmin": 0, "ymin": 1, "xmax": 2, "ymax": 3},
+        "layers": [{"id": 4}],
+    }
+    export_url, params = warmup_request("export", url, info)
+    assert export_url == url + "/export" and params["bbox"] == "0,1,2,3"
+    assert warmup_request("query", url, info)[0] == url + "/4/query"
+    assert warmup_request("tile", url, info) is None
+    assert warmup_request("query", url, {}) is None
+    assert (
+        warmup_request("export", URL + "/rest/services/Ortho/ImageServer", info) is None
+    )
+
+
+def test_times_queue_and_startup_apart():
+    """The time waiting for a worker is not part of the startup time (which is timed
+    from the first check, like the timeout)."""
+    service = StartingService(starts_after=5)
+    previous = rest.set_transport(service)
+    try:
+        # One worker: the second service waits while the first one starts.
+        warmer = Warmup(repeat=2, max_workers=1, timeout=5, interval=0.05)
+        first, second = FakeDoc(), FakeDoc()
+        warmer.submit(first)
+        warmer.submit(second)
+        warmer.submit(FakeDoc(service_path=None))  # not warmed up
+        results = warmer.wait()
+    finally:
+        rest.set_transport(previous)
+    print(results)
+    assert [result["doc"] for result in results] == [first, second]
+    assert all(result["ready"] for result in results)
+    assert results[0]["seconds_to_ready"] >= 0.15
+    assert results[1]["seconds_queued"] >= 0.15
+    assert results[1]["seconds_to_ready"] < 0.15
+    assert sorted(results[0]["warmup"]) == ["export", "query", "tile"]
+    assert all(len(times) == 2 for times in results[0]["warmup"].values())
+    assert len(service.requests) == 12
+
+
+if __name__ == "__main__":
+    test_polls_until_ready()
+    test_gives_up_at_the_timeout()
+    test_warmup_requests()
+    test_times_queue_and_startup_apart()
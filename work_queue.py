@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+A shared queue of publishing jobs with time limited leases.
+
+The queue is a SQLite database, typically on a network share that all the
+publishing nodes can reach.  One process discovers the work and enqueues a job
+for each document to publish or unpublish.  Any number of worker processes (on
+any number of machines) claim jobs one at a time.  A claimed job is leased to
+the worker for a limited time; the worker must renew (heartbeat) the lease
+while it is working.  If a worker dies, its lease expires and the job is
+returned to the queue for another worker.  A failed job (or one with an expired
+lease) is retried until it has been attempted max_attempts times.
+
+Note: SQLite locking on a network share is only as reliable as the share's
+file locking. Use a share that supports byte range locks (i.e. SMB).
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import closing
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# object inheritance is maintained for Python2 compatibility
+# pylint: disable=useless-object-inheritance
+
+# Job states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    action TEXT NOT NULL,
+    service_path TEXT NOT NULL,
+    source_path TEXT,
+    folder TEXT,
+    service_name TEXT,
+    force INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    UNIQUE (action, service_path)
+)
+"""
+
+JOB_COLUMNS = (
+    "id, action, service_path, source_path, folder, service_name, force, attempts"
+)
+
+
+class Job(object):
+    """A unit of work (publish or unpublish a document) claimed from the queue."""
+
+    # pylint: disable=too-few-public-methods,too-many-arguments
+
+    def __init__(
+        self,
+        job_id,
+        action,
+        service_path,
+        source_path=None,
+        folder=None,
+        service_name=None,
+        force=False,
+        attempts=0,
+    ):
+        self.job_id = job_id
+        self.action = action
+        self.service_path = service_path
+        self.source_path = source_path
+        self.folder = folder
+        self.service_name = service_name
+        self.force = bool(force)
+        self.attempts = attempts
+
+    def __repr__(self):
+        return "Job({0}, {1}, {2})".format(self.job_id, self.action, self.service_path)
+
+
+class WorkQueue(object):
+    """A SQLite backed queue of publishing jobs with leases."""
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3, timeout=60):
+        self.__path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.__timeout = timeout
+        with closing(self.__connect()) as connection:
+            connection.execute(SCHEMA)
+
+    @property
+    def path(self):
+        """Return the filesystem path to the queue database."""
+        return self.__path
+
+    def enqueue(
+        self,
+        action,
+        service_path,
+        source_path=None,
+        folder=None,
+        service_name=None,
+        force=False,
+    ):
+        """Add a job to the queue.
+
+        If there is already a finished (done or failed) job for the same action
+        and service, it is reset and reused.  An active job is not changed, except
+        that a pending job is forced if force is True.
+        Returns True if the job was added, reset or forced."""
+
+        # pylint: disable=too-many-arguments
+
+        with closing(self.__connect()) as connection:
+            try:
+                connection.execute(
+                    "INSERT INTO jobs (action, service_path, source_path, folder, "
+                    "service_name, force) VALUES (?, ?, ?, ?, ?, ?)",
+                    (action, service_path, source_path, folder, service_name, force),
+                )
+                return True
+            except sqlite3.IntegrityError:
+                cursor = connection.execute(
+                    "UPDATE jobs SET source_path = ?, folder = ?, service_name = ?, "
+                    "force = ?, state = ?, owner = NULL, lease_expires = NULL, "
+                    "attempts = 0, message = NULL, result = NULL "
+                    "WHERE action = ? AND service_path = ? AND state IN (?, ?)",
+                    (
+                        source_path,
+                        folder,
+                        service_name,
+                        force,
+                        PENDING,
+                        action,
+                        service_path,
+                        DONE,
+                        FAILED,
+                    ),
+                )
+                if cursor.rowcount == 0 and force:
+                    cursor = connection.execute(
+                        "UPDATE jobs SET force = ? WHERE action = ? AND "
+                        "service_path = ? AND state = ? AND force = 0",
+                        (force, action, service_path, PENDING),
+                    )
+                return cursor.rowcount == 1
+
+    def claim(self, worker):
+        """Lease the next pending job to worker. Returns a Job or None if there is no work.
+
+        Expired leases are reclaimed first, so abandoned jobs are not lost."""
+        now = time.time()
+        with closing(self.__connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.__reclaim(connection, now)
+                row = connection.execute(
+                    "SELECT " + JOB_COLUMNS + " FROM jobs WHERE state = ? "
+                    "ORDER BY id LIMIT 1",
+                    (PENDING,),
+                ).fetchone()
+                if row is None:
+                    connection.execute("COMMIT")
+                    return None
+                connection.execute(
+                    "UPDATE jobs SET state = ?, owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (LEASED, worker, now + self.lease_seconds, row[0]),
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        job = Job(*row)
+        job.attempts += 1
+        logger.debug("%s claimed %s", worker, job)
+        return job
+
+    def heartbeat(self, job, worker):
+        """Renew the lease on job. Returns False if worker no longer holds the lease."""
+        with closing(self.__connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ? "
+                "WHERE id = ? AND owner = ? AND state = ?",
+                (time.time() + self.lease_seconds, job.job_id, worker, LEASED),
+            )
+            renewed = cursor.rowcount == 1
+        if not renewed:
+            logger.warning("%s lost the lease on %s", worker, job)
+        return renewed
+
+    def complete(self, job, worker, result=None):
+        """Mark the job as done. result is saved as JSON (i.e. the data sources)."""
+        if result is not None:
+            result = json.dumps(result)
+        return self.__finish(job, worker, DONE, None, result)
+
+    def fail(self, job, worker, message=None):
+        """Release a failed job for retry, or mark it failed if out of attempts."""
+        state = FAILED if job.attempts >= self.max_attempts else PENDING
+        if state == PENDING:
+            logger.info("Returning %s to the queue for retry", job)
+        return self.__finish(job, worker, state, message, None)
+
+    def reclaim(self):
+        """Return jobs with an expired lease to the queue, or mark them failed if out
+        of attempts (as fail() does). Returns the number reclaimed."""
+        with closing(self.__connect()) as connection:
+            return self.__reclaim(connection, time.time())
+
+    def counts(self):
+        """Return a dictionary of the number of jobs in each state."""
+        with closing(self.__connect()) as connection:
+            rows = connection.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+    def results(self):
+        """Return a list of (action, service_path, result) for the finished jobs."""
+        with closing(self.__connect()) as connection:
+            rows = connection.execute(
+                "SELECT action, service_path, result FROM jobs WHERE state = ?",
+                (DONE,),
+            ).fetchall()
+        return [
+            (action, path, None if result is None else json.loads(result))
+            for action, path, result in rows
+        ]
+
+    def __finish(self, job, worker, state, message, result):
+        with closing(self.__connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, lease_expires = NULL, "
+                "message = ?, result = ? WHERE id = ? AND owner = ? AND state = ?",
+                (state, message, result, job.job_id, worker, LEASED),
+            )
+            finished = cursor.rowcount == 1
+        if not finished:
+            logger.warning("%s no longer holds the lease on %s", worker, job)
+        return finished
+
+    def __reclaim(self, connection, now):
+        # A job that kills its worker every time must not be retried forever.
+        failed = connection.execute(
+            "UPDATE jobs SET state = ?, owner = NULL, lease_expires = NULL, "
+            "message = ? WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, "The lease expired", LEASED, now, self.max_attempts),
+        ).rowcount
+        if failed:
+            logger.warning("%s abandoned jobs are out of attempts; failed", failed)
+        cursor = connection.execute(
+            "UPDATE jobs SET state = ?, owner = NULL, lease_expires = NULL "
+            "WHERE state = ? AND lease_expires < ?",
+            (PENDING, LEASED, now),
+        )
+        if cursor.rowcount:
+            logger.info("Reclaimed %s abandoned jobs", cursor.rowcount)
+        return failed + cursor.rowcount
+
+    def __connect(self):
+        # Autocommit mode; transactions are managed explicitly where needed.
+        return sqlite3.connect(
+            self.__path, timeout=self.__timeout, isolation_level=None
+        )
+
+
+class LeaseKeeper(object):
+    """A context manager that renews the lease on a job while it is being worked."""
+
+    def __init__(self, queue, job, worker):
+        self.__queue = queue
+        self.__job = job
+        self.__worker = worker
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="lease-keeper")
+        self.__thread.daemon = True
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        interval = max(1, self.__queue.lease_seconds / 3.0)
+        while not self.__stop.wait(interval):
+            if not self.__queue.heartbeat(self.__job, self.__worker):
+                return
+
+
+def worker_name():
+    """Return a name for this worker process that is unique across machines."""
+    return "{0}-{1}".format(socket.gethostname(), os.getpid())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the shared queue of publishing jobs.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+
+from work_queue import WorkQueue
+
+
+def make_queue(**kwargs):
+    """Return a new queue in a temporary folder."""
+    folder = tempfile.mkdtemp()
+    return folder, WorkQueue(os.path.join(folder, "queue.sqlite"), **kwargs)
+
+
+def test_claim_and_complete():
+    """Test that jobs are claimed in order, and each job is only leased once."""
+    folder, queue = make_queue()
+    try:
+        print("test enqueue; duplicates are ignored")
+        assert queue.enqueue("publish", "a/one", source_path="c:/a/one.mxd")
+        assert queue.enqueue("publish", "a/two", source_path="c:/a/two.mxd")
+        assert not queue.enqueue("publish", "a/one", source_path="c:/a/one.mxd")
+        assert queue.counts() == {"pending": 2}
+        print("test enqueue; a pending job can be forced")
+        assert queue.enqueue("publish", "a/two", source_path="c:/a/two.mxd", force=True)
+        assert not queue.enqueue("publish", "a/two", force=True)
+
+        print("test claim; two workers get different jobs")
+        job1 = queue.claim("worker1")
+        job2 = queue.claim("worker2")
+        assert job1.service_path == "a/one" and job2.service_path == "a/two"
+        assert job1.attempts == 1
+        assert not job1.force and job2.force
+        assert queue.claim("worker3") is None
+
+        print("test complete; only the lease holder can complete a job")
+        assert not queue.complete(job1, "worker2")
+        assert queue.complete(job1, "worker1", result=["c:/data/roads.shp"])
+        assert queue.results() == [("publish", "a/one", ["c:/data/roads.shp"])]
+
+        print("test enqueue; a finished job can be queued again")
+        assert queue.enqueue("publish", "a/one", source_path="c:/a/one.mxd")
+        assert queue.counts() == {"pending": 1, "leased": 1}
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_fail_and_retry():
+    """Test that failed jobs are retried until they run out of attempts."""
+    folder, queue = make_queue(max_attempts=2)
+    try:
+        queue.enqueue("unpublish", "b/old")
+        job = queue.claim("worker1")
+        assert queue.fail(job, "worker1", "server busy")
+        assert queue.counts() == {"pending": 1}
+        job = queue.claim("worker1")
+        assert job.attempts == 2
+        assert queue.fail(job, "worker1", "server busy")
+        assert queue.counts() == {"failed": 1}
+        assert queue.claim("worker1") is None
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_abandoned_lease():
+    """Test that an expired lease is reclaimed by the next worker."""
+    folder, queue = make_queue(lease_seconds=0.1)
+    try:
+        queue.enqueue("publish", "c/slow")
+        job = queue.claim("crashed_worker")
+        time.sleep(0.2)
+        print("test heartbeat; a late heartbeat still renews an unclaimed lease")
+        assert queue.heartbeat(job, "crashed_worker")
+        time.sleep(0.2)
+        job2 = queue.claim("worker2")
+        assert job2 is not None and job2.job_id == job.job_id
+        assert job2.attempts == 2
+        print("test heartbeat; the old worker has lost the lease")
+        assert not queue.heartbeat(job, "crashed_worker")
+        assert not queue.complete(job, "crashed_worker")
+        assert queue.complete(job2, "worker2")
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_abandoned_lease_out_of_attempts():
+    """Test that a job that is abandoned by every worker is not retried forever."""
+    folder, queue = make_queue(lease_seconds=0.1, max_attempts=2)
+    try:
+        queue.enqueue("publish", "d/poison")
+        queue.claim("crashed_worker1")
+        time.sleep(0.2)
+        assert queue.claim("crashed_worker2").attempts == 2
+        time.sleep(0.2)
+        assert queue.reclaim() == 1
+        assert queue.counts() == {"failed": 1}
+        assert queue.claim("worker3") is None
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_claim_and_complete()
+    test_fail_and_retry()
+    test_abandoned_lease()
+    test_abandoned_lease_out_of_attempts()